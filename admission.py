@@ -0,0 +1,145 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, request
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger('oauth-verify')
+
+ADMIT, RATE_LIMITED, OVERLOADED = 'admit', 'rate_limited', 'overloaded'
+
+RETRY_HTML = '''<!DOCTYPE html>
+<html>
+<head>
+    <title>Please retry shortly</title>
+    <meta http-equiv="refresh" content="{retry_after}{target}">
+    <style>
+        body {{ font-family: Arial, sans-serif; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+               display: flex; align-items: center; justify-content: center; min-height: 100vh; margin: 0; }}
+        .box {{ background: white; padding: 40px; border-radius: 12px; text-align: center;
+               box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3); max-width: 480px; }}
+        .box h1 {{ color: #e67e22; margin: 0 0 20px 0; }}
+        .box p {{ color: #555; line-height: 1.6; margin: 10px 0; }}
+    </style>
+</head>
+<body>
+    <div class="box">
+        <h1>We're a little busy</h1>
+        <p>{reason}</p>
+        <p>This page will retry automatically in {retry_after} seconds.</p>
+    </div>
+</body>
+</html>
+'''
+
+
+def retry_response(retry_after, reason, status=503, url=None):
+    """Flask response for the retry page; it reloads itself (or `url`) after `retry_after` seconds."""
+    target = f'; url={url}' if url else ''
+    return RETRY_HTML.format(retry_after=retry_after, reason=reason, target=target), status, {'Retry-After': str(retry_after)}
+
+
+class AdmissionController:
+    """Token-bucket throttling and a bounded in-flight limit for the OAuth routes.
+
+    Requests are refused before doing any work when their IP's bucket or the global
+    bucket is empty, or when `max_in_flight` requests are already being served. The
+    suggested Retry-After grows with the number of requests in flight and the
+    recent average service time, so clients back off harder the deeper the backlog.
+    """
+
+    def __init__(self, per_ip_rate=1.0, per_ip_burst=5, global_rate=50.0, global_burst=100,
+                 max_in_flight=32, max_tracked_ips=50000):
+        self.per_ip_rate = per_ip_rate
+        self.per_ip_burst = per_ip_burst
+        self.max_in_flight = max_in_flight
+        self.max_tracked_ips = max_tracked_ips
+        self._global = TokenBucket(global_rate, global_burst)
+        self._ips = OrderedDict()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._service_time = 0.2
+        self.counters = {ADMIT: 0, RATE_LIMITED: 0, OVERLOADED: 0}
+
+    def _ip_bucket(self, ip):
+        with self._lock:
+            bucket = self._ips.get(ip)
+            if bucket is None:
+                bucket = self._ips[ip] = TokenBucket(self.per_ip_rate, self.per_ip_burst)
+                while len(self._ips) > self.max_tracked_ips:
+                    self._ips.popitem(last=False)
+            else:
+                self._ips.move_to_end(ip)
+            return bucket
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def retry_after(self):
+        """Seconds a refused client should wait, from the current backlog."""
+        backlog = self._in_flight / max(1, self.max_in_flight)
+        return max(1, min(60, math.ceil(self._service_time * (1 + backlog) * 2)))
+
+    def admit(self, ip):
+        """Return `(decision, retry_after)`; an ADMIT must be paired with `release()`."""
+        bucket = self._ip_bucket(ip)
+        if not bucket.try_acquire():
+            self.counters[RATE_LIMITED] += 1
+            return RATE_LIMITED, max(1, math.ceil(bucket.wait_time()))
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                self.counters[OVERLOADED] += 1
+                return OVERLOADED, self.retry_after()
+            if not self._global.try_acquire():
+                self.counters[OVERLOADED] += 1
+                return OVERLOADED, max(1, math.ceil(self._global.wait_time()))
+            self._in_flight += 1
+            self.counters[ADMIT] += 1
+        return ADMIT, 0
+
+    def release(self, service_time=None):
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            if service_time is not None:
+                self._service_time = 0.9 * self._service_time + 0.1 * service_time
+
+
+def client_ip(trust_forwarded=False):
+    """The address to throttle. Behind one trusted proxy that is the rightmost
+    `X-Forwarded-For` entry, the one the proxy appended; entries to its left come
+    from the client and can be anything."""
+    if trust_forwarded:
+        forwarded = request.headers.get('X-Forwarded-For', '')
+        if forwarded.strip():
+            return forwarded.split(',')[-1].strip()
+    return request.remote_addr or 'unknown'
+
+
+def install(app, controller, endpoints, trust_forwarded=False):
+    """Put `controller` in front of the Flask `endpoints` (view function names)."""
+    endpoints = set(endpoints)
+
+    @app.before_request
+    def _admission_check():
+        if request.endpoint not in endpoints:
+            return None
+        decision, retry_after = controller.admit(client_ip(trust_forwarded))
+        if decision == ADMIT:
+            g.admitted_at = time.monotonic()
+            return None
+        if decision == RATE_LIMITED:
+            logger.debug('Admission: rate limited %s on %s', client_ip(trust_forwarded), request.endpoint)
+            return retry_response(retry_after, 'Too many attempts from your network.', 429)
+        logger.debug('Admission: shed %s (in flight %d)', request.endpoint, controller.in_flight)
+        return retry_response(retry_after, 'Lots of people are verifying right now.')
+
+    @app.teardown_request
+    def _admission_release(exc):
+        admitted_at = g.pop('admitted_at', None)
+        if admitted_at is not None:
+            controller.release(time.monotonic() - admitted_at)
@@ -0,0 +1,194 @@
+import gzip
+import hashlib
+import json
+import logging
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger('oauth-verify')
+
+# Layout under the backup root:
+#   objects/<2 hex>/<sha256>.json.gz         one role or channel record, stored once per distinct content
+#   snapshots/<guild_id>/<name>.ndjson.gz    header line, then one {"kind", "id", "name", "hash"} line per record
+# Unchanged roles and channels hash to an existing object, so a snapshot only adds what changed.
+
+
+def _canonical(record):
+    return json.dumps(record, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+class BackupStore:
+    """Content-addressed, gzip-compressed guild snapshots with retention and diffs.
+
+    All methods do blocking file I/O; call them through `asyncio.to_thread`.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.snapshots_dir = os.path.join(root, 'snapshots')
+
+    @contextmanager
+    def _locked(self):
+        """Hold an exclusive `flock` on the backup root's lock file.
+
+        Snapshot writes reuse objects that garbage collection would delete, so both
+        run under this lock; being a file lock, it also holds across processes
+        (web workers, a second bot instance) sharing the same root.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], f'{digest}.json.gz')
+
+    def _guild_dir(self, guild_id):
+        return os.path.join(self.snapshots_dir, str(int(guild_id)))
+
+    def _snapshot_path(self, guild_id, name):
+        if os.sep in name or (os.altsep and os.altsep in name) or name.startswith('.'):
+            raise ValueError(f'Invalid snapshot name {name!r}')
+        return os.path.join(self._guild_dir(guild_id), f'{name}.ndjson.gz')
+
+    def _put_object(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            return digest, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with gzip.open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return digest, True
+
+    def get_object(self, digest):
+        with gzip.open(self._object_path(digest), 'rb') as f:
+            return json.loads(f.read())
+
+    def write_snapshot(self, guild_id, header, records):
+        """Stream `records` (an iterable of dicts with `kind` and `id`) into a new snapshot.
+
+        Returns a dict with the snapshot name and how many objects were new vs reused.
+        """
+        with self._locked():
+            return self._write_snapshot(guild_id, header, records)
+
+    def _write_snapshot(self, guild_id, header, records):
+        guild_dir = self._guild_dir(guild_id)
+        os.makedirs(guild_dir, exist_ok=True)
+        name = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = self._snapshot_path(guild_id, name)
+        suffix = 1
+        while os.path.exists(path):
+            suffix += 1
+            path = self._snapshot_path(guild_id, f'{name}_{suffix}')
+        name = os.path.basename(path)[:-len('.ndjson.gz')]
+
+        counts = {'new': 0, 'reused': 0}
+        per_kind = {}
+        tmp = f'{path}.tmp'
+        with gzip.open(tmp, 'wt', encoding='utf-8') as out:
+            out.write(json.dumps(dict(header, kind='header')) + '\n')
+            for record in records:
+                digest, created = self._put_object(_canonical(record))
+                counts['new' if created else 'reused'] += 1
+                per_kind[record['kind']] = per_kind.get(record['kind'], 0) + 1
+                out.write(json.dumps({'kind': record['kind'], 'id': record['id'],
+                                      'name': record.get('name'), 'hash': digest}) + '\n')
+        os.replace(tmp, path)
+        return {'name': name, 'new_objects': counts['new'], 'reused_objects': counts['reused'],
+                'counts': per_kind, 'bytes': os.path.getsize(path)}
+
+    def list_snapshots(self, guild_id):
+        """Snapshot names for a guild, oldest first."""
+        guild_dir = self._guild_dir(guild_id)
+        if not os.path.isdir(guild_dir):
+            return []
+        return sorted(f[:-len('.ndjson.gz')] for f in os.listdir(guild_dir) if f.endswith('.ndjson.gz'))
+
+    def read_manifest(self, guild_id, name):
+        """Return `(header, entries)` where entries is a list of `{kind, id, name, hash}` dicts."""
+        with gzip.open(self._snapshot_path(guild_id, name), 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            entries = [json.loads(line) for line in f if line.strip()]
+        return header, entries
+
+    def iter_records(self, guild_id, name):
+        """Yield the full records of a snapshot, loading each object lazily."""
+        _, entries = self.read_manifest(guild_id, name)
+        for entry in entries:
+            yield self.get_object(entry['hash'])
+
+    def describe(self, guild_id, name):
+        header, entries = self.read_manifest(guild_id, name)
+        counts = {}
+        for entry in entries:
+            counts[entry['kind']] = counts.get(entry['kind'], 0) + 1
+        return {'name': name, 'backup_date': header.get('backup_date'), 'counts': counts,
+                'bytes': os.path.getsize(self._snapshot_path(guild_id, name))}
+
+    def diff(self, guild_id, older, newer):
+        """Compare two snapshots by record id: added, removed and changed entries per kind."""
+        _, old_entries = self.read_manifest(guild_id, older)
+        _, new_entries = self.read_manifest(guild_id, newer)
+        old = {(e['kind'], e['id']): e for e in old_entries}
+        new = {(e['kind'], e['id']): e for e in new_entries}
+        result = {'added': [], 'removed': [], 'changed': []}
+        for key in new.keys() - old.keys():
+            result['added'].append(new[key])
+        for key in old.keys() - new.keys():
+            result['removed'].append(old[key])
+        for key in new.keys() & old.keys():
+            if new[key]['hash'] != old[key]['hash']:
+                result['changed'].append(new[key])
+        for entries in result.values():
+            entries.sort(key=lambda e: (e['kind'], e['name'] or ''))
+        return result
+
+    def apply_retention(self, guild_id, keep, max_age_days=None):
+        """Delete all but the newest `keep` snapshots (and any older than `max_age_days`),
+        then remove objects no remaining snapshot of any guild references.
+
+        Returns `(snapshots_removed, objects_removed)`.
+        """
+        names = self.list_snapshots(guild_id)
+        doomed = names[:-keep] if keep and len(names) > keep else []
+        if max_age_days:
+            cutoff = time.time() - max_age_days * 86400
+            for name in names[len(doomed):-1]:
+                if os.path.getmtime(self._snapshot_path(guild_id, name)) < cutoff:
+                    doomed.append(name)
+        with self._locked():
+            for name in doomed:
+                os.remove(self._snapshot_path(guild_id, name))
+            objects_removed = self._collect_garbage() if doomed else 0
+        if doomed:
+            logger.info('Backup retention for %s: removed %d snapshots and %d unreferenced objects',
+                        guild_id, len(doomed), objects_removed)
+        return len(doomed), objects_removed
+
+    def _collect_garbage(self):
+        live = set()
+        if os.path.isdir(self.snapshots_dir):
+            for guild_dir in os.listdir(self.snapshots_dir):
+                for name in self.list_snapshots(guild_dir):
+                    live.update(e['hash'] for e in self.read_manifest(guild_dir, name)[1])
+        removed = 0
+        if not os.path.isdir(self.objects_dir):
+            return removed
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            for f in os.listdir(prefix_dir):
+                if f.endswith('.json.gz') and f[:-len('.json.gz')] not in live:
+                    os.remove(os.path.join(prefix_dir, f))
+                    removed += 1
+        return removed
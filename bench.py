@@ -0,0 +1,1168 @@
+"""Offline benchmarks. Run `python bench.py <name> --help` for the options of each one."""
+import argparse
+import asyncio
+import gc
+import http.client
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import discord
+import requests
+from requests.adapters import HTTPAdapter
+from flask import Flask, request
+from werkzeug.serving import make_server
+
+import admission
+from circuit import ApiClient, BreakerRegistry, CircuitOpenError, RetryPolicy
+from membercache import MEMBER_CACHE_MODES, MemberCachePolicy
+from migrations import migrate
+from progress import ProgressBoard, ProgressReporter
+from restore import RestoreEngine, plan_restore
+from records import JoinRequests, UserTokens
+from sharedlimits import SharedRateLimiter
+from storage import MemoryStorage, SQLiteStorage
+from transfer import export_store, import_store
+from writebehind import WriteBehindBuffer
+
+logging.basicConfig(level=logging.WARNING, format='[%(asctime)s] %(levelname)s %(name)s - %(message)s')
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def _role_payload(role_id, name, position):
+    return {'id': str(role_id), 'name': name, 'permissions': '0', 'position': position, 'color': 0,
+            'hoist': False, 'managed': False, 'mentionable': False}
+
+
+def _synthetic_guild(state, guild_id, member_role_id):
+    return discord.Guild(data={
+        'id': str(guild_id), 'name': 'synthetic', 'member_count': 0, 'features': [], 'emojis': [], 'stickers': [],
+        'roles': [_role_payload(guild_id, '@everyone', 0), _role_payload(member_role_id, 'Member', 1)],
+    }, state=state)
+
+
+def _synthetic_member(guild, state, user_id, role_ids):
+    return discord.Member(data={
+        'user': {'id': str(user_id), 'username': f'user{user_id}', 'discriminator': '0', 'avatar': None, 'global_name': None},
+        'roles': [str(r) for r in role_ids], 'joined_at': None, 'deaf': False, 'mute': False, 'flags': 0,
+    }, guild=guild, state=state)
+
+
+@benchmark('member-cache')
+def bench_member_cache(args):
+    """Resident memory of each member cache mode on one synthetic guild.
+
+    `full` caches every member (what startup chunking produces), `lazy` caches only
+    the members touched by `--verifies` verifications, `roles` and `index` replay the
+    whole member list through MemberCachePolicy.remember() as the warm-up would.
+    """
+    guild_id, member_role_id, first_user = 1 << 40, (1 << 40) + 1, 10 ** 17
+    modes = args.modes or MEMBER_CACHE_MODES
+    print(f'{args.members:,} members, {args.holders:.1%} holding the tracked role, {args.verifies:,} verifications')
+    print(f'{"mode":<7} {"cached":>9} {"index":>10} {"resident":>11} {"per member":>11} {"time":>8}')
+    for mode in modes:
+        gc.collect()
+        tracemalloc.start()
+        started = time.perf_counter()
+        intents = discord.Intents.default()
+        intents.members = True
+        policy = MemberCachePolicy(mode, tracked_roles=lambda guild: {member_role_id})
+        client = discord.Client(intents=intents, **policy.bot_options(intents))
+        state = client._connection
+        state.user = discord.ClientUser(state=state, data={'id': str(guild_id + 2), 'username': 'bench', 'discriminator': '0', 'avatar': None})
+        guild = _synthetic_guild(state, guild_id, member_role_id)
+        holder_every = max(1, round(1 / args.holders)) if args.holders else 0
+
+        if mode == 'lazy':
+            # nothing is chunked at startup; verifying members arrive via interactions and stay cached
+            for i in range(args.verifies):
+                guild._add_member(_synthetic_member(guild, state, first_user + i, [member_role_id]))
+        else:
+            for i in range(args.members):
+                roles = [member_role_id] if holder_every and i % holder_every == 0 else []
+                member = _synthetic_member(guild, state, first_user + i, roles)
+                if mode == 'full':
+                    guild._add_member(member)
+                else:
+                    policy.remember(member)
+                del member
+
+        gc.collect()
+        resident, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        elapsed = time.perf_counter() - started
+        print(f'{mode:<7} {len(guild._members):>9,} {policy.index.memory_bytes() / 2**20:>8.1f}MB '
+              f'{resident / 2**20:>9.1f}MB {resident / args.members:>9.1f}B {elapsed:>7.1f}s')
+        del client, state, guild, policy
+
+
+def _fresh_db(directory, name):
+    path = os.path.join(directory, name)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    migrate(conn)
+    conn.close()
+    return path
+
+
+def _run_writers(writers, rows, write_one):
+    per_writer = rows // writers
+
+    def worker(offset):
+        for i in range(per_writer):
+            write_one(offset + i)
+
+    threads = [threading.Thread(target=worker, args=(w * per_writer,)) for w in range(writers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return per_writer * writers, time.perf_counter() - started
+
+
+@benchmark('write-behind')
+def bench_write_behind(args):
+    """Durable verification-record write throughput: commit per row vs WriteBehindBuffer.
+
+    Each of `--writers` threads inserts rows into `verified` and waits for its row to
+    be committed, as a callback handler acknowledging a user would.
+    """
+    sql = 'INSERT OR REPLACE INTO verified (guild_id, discord_id) VALUES (?, ?)'
+    with tempfile.TemporaryDirectory() as tmp:
+        path = _fresh_db(tmp, 'per_row.db')
+        local = threading.local()
+
+        def per_row(i):
+            conn = getattr(local, 'conn', None)
+            if conn is None:
+                conn = local.conn = sqlite3.connect(path, timeout=60)
+                conn.execute('PRAGMA synchronous=FULL')
+            conn.execute(sql, (1, i))
+            conn.commit()
+
+        done, elapsed = _run_writers(args.writers, args.rows, per_row)
+        print(f'commit per row   {done:>7,} rows  {elapsed:6.2f}s  {done / elapsed:>9,.0f} rows/s')
+
+        path = _fresh_db(tmp, 'batched.db')
+        buffer = WriteBehindBuffer(path, max_batch=args.batch, max_delay=args.delay)
+        done, elapsed = _run_writers(args.writers, args.rows, lambda i: buffer.submit(sql, (1, i)).result())
+        stats = buffer.stats()
+        buffer.close()
+        print(f'write-behind     {done:>7,} rows  {elapsed:6.2f}s  {done / elapsed:>9,.0f} rows/s  '
+              f'(avg batch {stats["avg_batch"]:.1f}, avg commit {stats["avg_commit_ms"]:.2f}ms)')
+
+
+def _percentile(values, pct):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+@benchmark('admission')
+def bench_admission(args):
+    """Latency of admitted /callback requests under overload, with and without admission control.
+
+    The handler holds one of `--backend-slots` slots (standing in for the Discord API
+    budget) for `--service-ms`. `--clients` closed-loop clients offer more load than
+    the slots can serve. Without admission the backlog queues inside the server;
+    with it, excess requests get a fast 503 and admitted latency stays near the
+    service time. Per-IP buckets are disabled because every client shares 127.0.0.1.
+    """
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    print(f'{args.clients} clients, {args.backend_slots} backend slots x {args.service_ms}ms, {args.seconds}s per run')
+    print(f'{"admission":<10} {"ok/s":>7} {"shed/s":>7} {"p50":>8} {"p95":>8} {"p99":>8} {"shed p50":>9}')
+    for enabled in (False, True):
+        app = Flask('bench-admission')
+        backend = threading.Semaphore(args.backend_slots)
+
+        @app.route('/callback')
+        def callback():
+            with backend:
+                time.sleep(args.service_ms / 1000)
+            return 'ok'
+
+        if enabled:
+            controller = admission.AdmissionController(
+                per_ip_rate=1e9, per_ip_burst=1e9, global_rate=1e9, global_burst=1e9,
+                max_in_flight=args.max_in_flight or args.backend_slots * 2)
+            admission.install(app, controller, ('callback',))
+
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        url = f'http://127.0.0.1:{server.server_port}/callback'
+        results = []
+        deadline = time.monotonic() + args.seconds
+
+        def client():
+            session = requests.Session()
+            local = []
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                status = session.get(url, timeout=60).status_code
+                local.append((status, time.perf_counter() - started))
+                if status != 200:
+                    time.sleep(0.01)
+            results.extend(local)
+
+        clients = [threading.Thread(target=client) for _ in range(args.clients)]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        server.shutdown()
+
+        ok = [lat * 1000 for status, lat in results if status == 200]
+        shed = [lat * 1000 for status, lat in results if status != 200]
+        print(f'{"on" if enabled else "off":<10} {len(ok) / args.seconds:>7.0f} {len(shed) / args.seconds:>7.0f} '
+              f'{_percentile(ok, 50):>6.0f}ms {_percentile(ok, 95):>6.0f}ms {_percentile(ok, 99):>6.0f}ms '
+              f'{_percentile(shed, 50):>7.1f}ms')
+
+
+STORAGE_BACKENDS = ('memory', 'sqlite', 'sqlite-buffered')
+
+
+def _make_store(backend, directory, delay=0.005):
+    """Return `(store, close)` for a fresh, empty backend."""
+    if backend == 'memory':
+        return MemoryStorage(), lambda: None
+    path = _fresh_db(directory, f'{backend}-{time.monotonic_ns()}.db')
+    if backend == 'sqlite':
+        return SQLiteStorage(path), lambda: None
+    buffer = WriteBehindBuffer(path, max_delay=delay)
+    return SQLiteStorage(path, writer=buffer), buffer.close
+
+
+@benchmark('storage')
+def bench_storage(args):
+    """Per-operation cost of each Storage backend (tests/test_storage.py checks them against the contract).
+
+    `memory` is the in-process baseline, so the difference to `sqlite` (a commit
+    per write) and `sqlite-buffered` (group commit through WriteBehindBuffer, as
+    main.py runs it) is the storage overhead of each operation. Token saves run on
+    `--writers` threads like concurrent callbacks.
+    """
+    backends = args.backends or STORAGE_BACKENDS
+    now = int(time.time())
+    print(f'{args.rows:,} tokens from {args.writers} writers, {args.reads:,} config reads, {args.rows:,} events')
+    print(f'{"backend":<16} {"save_token":>12} {"get_config":>12} {"record_event":>13} {"live_users":>11} {"event_stats":>12}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in backends:
+            store, close = _make_store(backend, tmp, args.delay)
+            try:
+                done, elapsed = _run_writers(args.writers, args.rows, lambda i: store.save_token(
+                    10 ** 17 + i, f'token{i}', 'Bearer', 'identify guilds.join', now + 3600 * (i % 48 - 8), validated_at=now))
+                save_rate = done / elapsed
+
+                store.save_guild_config(1, 2, 3, 4)
+                started = time.perf_counter()
+                for _ in range(args.reads):
+                    store.get_guild_config(1)
+                config_rate = args.reads / (time.perf_counter() - started)
+
+                started = time.perf_counter()
+                for i in range(args.rows):
+                    store.record_event('verified', 1, 10 ** 17 + i, ts=now - i)
+                store.flush()
+                event_rate = args.rows / (time.perf_counter() - started)
+
+                started = time.perf_counter()
+                live = len(store.live_users(now))
+                live_ms = (time.perf_counter() - started) * 1000
+
+                started = time.perf_counter()
+                store.event_stats(1, now)
+                stats_ms = (time.perf_counter() - started) * 1000
+            finally:
+                close()
+            print(f'{backend:<16} {save_rate:>10,.0f}/s {config_rate:>10,.0f}/s {event_rate:>11,.0f}/s '
+                  f'{live_ms:>9.1f}ms {stats_ms:>10.2f}ms   ({live:,} live)')
+
+
+def _rate_limit_worker(path, threads, seconds, rate, burst, bucket, results):
+    limiter = SharedRateLimiter(path, global_rate=rate, global_burst=burst)
+    route = 'PUT /guilds/1/members/{id}'
+    deadline = time.monotonic() + seconds
+    admitted, latencies = [], []
+
+    def run():
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            wait = limiter.reserve(route)
+            latencies.append(time.perf_counter() - started)
+            if wait > 0:
+                time.sleep(min(wait, 0.05))
+            else:
+                admitted.append(time.time())
+
+    if bucket:
+        limit, window = bucket
+        limiter.update(route, 200, {'X-RateLimit-Bucket': 'bench', 'X-RateLimit-Limit': str(limit),
+                                    'X-RateLimit-Remaining': str(limit), 'X-RateLimit-Reset-After': str(window)})
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put((admitted, latencies))
+
+
+def _run_rate_limit(path, processes, threads, seconds, rate, burst, bucket=None):
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_rate_limit_worker, args=(path, threads, seconds, rate, burst, bucket, results))
+             for _ in range(processes)]
+    for proc in procs:
+        proc.start()
+    admitted, latencies = [], []
+    for _ in procs:
+        a, l = results.get()
+        admitted.extend(a)
+        latencies.extend(l)
+    for proc in procs:
+        proc.join()
+    return sorted(admitted), latencies
+
+
+def _max_in_window(times, window):
+    best, lo = 0, 0
+    for hi, t in enumerate(times):
+        while t - times[lo] > window:
+            lo += 1
+        best = max(best, hi - lo + 1)
+    return best
+
+
+@benchmark('rate-limit')
+def bench_rate_limit(args):
+    """Contention on the shared Discord rate-limit store, and whether its budget holds.
+
+    `--processes` x `--threads` senders hammer one SharedRateLimiter file, as web
+    workers and bulk jobs do. The first table uses a budget too large to bind, so it
+    shows the raw cost of an atomic reserve under contention. The second uses a
+    global budget of `--rate`/s (burst `--burst`) plus one route bucket of
+    `--bucket-limit` per `--window` seconds, and checks that across all processes no
+    1-second span admitted more than burst + rate and no window admitted more than
+    the bucket allows.
+    """
+    print(f'{args.seconds}s per run')
+    print(f'{"senders":<12} {"reserve/s":>10} {"p50":>9} {"p99":>9}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for processes in args.processes:
+            path = os.path.join(tmp, f'free-{processes}.db')
+            _, latencies = _run_rate_limit(path, processes, args.threads, args.seconds, 1e9, 1e9)
+            print(f'{f"{processes}x{args.threads}":<12} {len(latencies) / args.seconds:>10,.0f} '
+                  f'{_percentile(latencies, 50) * 1e6:>7.0f}us {_percentile(latencies, 99) * 1e6:>7.0f}us')
+
+        processes = max(args.processes)
+        print(f'\nenforcement: {processes}x{args.threads} senders, global {args.rate:g}/s burst {args.burst:g}, '
+              f'bucket {args.bucket_limit} per {args.window}s')
+        path = os.path.join(tmp, 'enforced.db')
+        admitted, _ = _run_rate_limit(path, processes, args.threads, args.seconds, args.rate, args.burst,
+                                      (args.bucket_limit, args.window))
+        global_cap = args.burst + args.rate
+        worst_second = _max_in_window(admitted, 1.0)
+        # fixed windows: any span of one window length overlaps at most two of them
+        bucket_cap = 2 * args.bucket_limit
+        worst_window = _max_in_window(admitted, args.window)
+        print(f'admitted {len(admitted):,} ({len(admitted) / args.seconds:,.1f}/s)')
+        print(f'busiest 1s span:     {worst_second:>5} (cap {global_cap:g})  {"ok" if worst_second <= global_cap else "EXCEEDED"}')
+        print(f'busiest {args.window}s span: {worst_window:>5} (cap {bucket_cap})  {"ok" if worst_window <= bucket_cap else "EXCEEDED"}')
+
+
+FAKE_BOT_ID = 900
+FAKE_GUILD_ID = 1000
+_FAKE_CHANNEL_TYPES = {0: 'text', 2: 'voice', 4: 'category', 5: 'news', 13: 'stage_voice', 15: 'forum'}
+
+
+class FakeDiscordAPI:
+    """Local stand-in for the member-add endpoint with injectable faults.
+
+    Between `outage[0]` and `outage[1]` seconds after `start()` every request fails:
+    with a 503, or by hanging for `hang` seconds when that is set (a timeout for
+    the client). Outside the outage a random `error_rate` share of requests gets a
+    500. Every request costs `latency` seconds.
+
+    It also serves one empty guild (FAKE_GUILD_ID) to discord.py's own HTTP client,
+    enough to run a restore against: the bot user, the guild with the bot as its
+    member, and role and channel creation. Those calls cost `latency` and fail at
+    `error_rate` too, and each kind allows `bucket_limit` calls per `window`
+    seconds, announced in Discord's rate-limit headers (429 beyond that, with the
+    `Via` header discord.py expects before it treats a 429 as a rate limit rather
+    than a Cloudflare ban). Each
+    create records when it ran and how many creates of its kind were in flight,
+    and one that names a parent category or an overwrite role the guild does not
+    have yet is logged in `violations`.
+    """
+
+    def __init__(self, error_rate=0.0, outage=None, hang=0.0, latency=0.005, bucket_limit=50, window=1.0):
+        self.error_rate = error_rate
+        self.outage = outage
+        self.hang = hang
+        self.latency = latency
+        self.hits = []           # (seconds since start, status)
+        self._t0 = time.monotonic()
+        self._ids = iter(range(10 ** 17, 10 ** 18))
+        self._guild_lock = threading.Lock()
+        self.roles = {FAKE_GUILD_ID: _role_payload(FAKE_GUILD_ID, '@everyone', 0)}
+        bot_role = _role_payload(FAKE_BOT_ID + 1, 'Restore bot', 500)
+        bot_role['permissions'] = str(discord.Permissions.all().value)
+        self.roles[FAKE_BOT_ID + 1] = bot_role
+        self.channels = {}
+        self.calls = []          # (kind, started, finished) of every create, seconds since start
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self.violations = []
+        self.bucket_limit = bucket_limit
+        self.window = window
+        self._buckets = {}       # kind -> (window start, requests in it)
+        self.rate_limited = 0
+        app = Flask('fake-discord')
+
+        @app.route('/api/guilds/<guild_id>/members/<user_id>', methods=['PUT'])
+        def add_member(guild_id, user_id):
+            at = time.monotonic() - self._t0
+            time.sleep(self.latency)
+            if self.outage and self.outage[0] <= at < self.outage[1]:
+                if self.hang:
+                    time.sleep(self.hang)
+                self.hits.append((at, 503))
+                return {'message': 'Service Unavailable'}, 503
+            if random.random() < self.error_rate:
+                self.hits.append((at, 500))
+                return {'message': 'Internal Server Error'}, 500
+            self.hits.append((at, 201))
+            return {}, 201
+
+        bot_user = {'id': str(FAKE_BOT_ID), 'username': 'restore-bot', 'discriminator': '0', 'avatar': None,
+                    'global_name': None, 'bot': True}
+
+        @app.route('/api/users/@me')
+        def me():
+            return bot_user
+
+        @app.route('/api/oauth2/applications/@me')
+        def application():
+            return {'id': str(FAKE_BOT_ID), 'name': 'restore-bot', 'description': '', 'icon': None,
+                    'bot_public': False, 'bot_require_code_grant': False, 'owner': bot_user, 'verify_key': '',
+                    'flags': 0}
+
+        @app.route('/api/guilds/<int:guild_id>')
+        def get_guild(guild_id):
+            with self._guild_lock:
+                roles = list(self.roles.values())
+            member = {'user': bot_user, 'roles': [str(FAKE_BOT_ID + 1)], 'joined_at': None, 'deaf': False,
+                      'mute': False, 'flags': 0}
+            return {'id': str(guild_id), 'name': 'fake', 'owner_id': '1', 'features': [], 'emojis': [],
+                    'stickers': [], 'roles': roles, 'members': [member], 'member_count': 1}
+
+        @app.route('/api/guilds/<int:guild_id>/roles', methods=['POST'])
+        def create_role(guild_id):
+            return self._create('role', lambda: self._add_role(request.get_json()))
+
+        @app.route('/api/guilds/<int:guild_id>/roles', methods=['PATCH'])
+        def move_roles(guild_id):
+            def move():
+                with self._guild_lock:
+                    for entry in request.get_json():
+                        self.roles[int(entry['id'])]['position'] = entry['position']
+                    return list(self.roles.values())
+            return self._create('positions', move)
+
+        @app.route('/api/guilds/<int:guild_id>/channels', methods=['POST'])
+        def create_channel(guild_id):
+            return self._create('channel', lambda: self._add_channel(guild_id, request.get_json()))
+
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self._server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.base = f'http://127.0.0.1:{self._server.server_port}/api'
+
+    def _create(self, kind, make):
+        with self._guild_lock:
+            now = time.monotonic()
+            window_start, used = self._buckets.get(kind, (now, 0))
+            if now - window_start >= self.window:
+                window_start, used = now, 0
+            reset_after = window_start + self.window - now
+            if used >= self.bucket_limit:
+                self.rate_limited += 1
+                headers = {'X-RateLimit-Limit': str(self.bucket_limit), 'X-RateLimit-Remaining': '0',
+                           'X-RateLimit-Reset-After': f'{reset_after:.3f}', 'X-RateLimit-Bucket': kind,
+                           'X-RateLimit-Scope': 'user', 'Via': '1.1 google'}
+                return {'message': 'You are being rate limited.', 'retry_after': reset_after, 'global': False}, 429, headers
+            self._buckets[kind] = (window_start, used + 1)
+            headers = {'X-RateLimit-Limit': str(self.bucket_limit),
+                       'X-RateLimit-Remaining': str(self.bucket_limit - used - 1),
+                       'X-RateLimit-Reset-After': f'{reset_after:.3f}', 'X-RateLimit-Bucket': kind}
+            self.in_flight[kind] = self.in_flight.get(kind, 0) + 1
+            self.max_in_flight[kind] = max(self.max_in_flight.get(kind, 0), self.in_flight[kind])
+        started = time.monotonic() - self._t0
+        try:
+            time.sleep(self.latency)
+            if random.random() < self.error_rate:
+                return {'message': 'Internal Server Error', 'code': 0}, 500, headers
+            return make(), 200, headers
+        finally:
+            with self._guild_lock:
+                self.in_flight[kind] -= 1
+                self.calls.append((kind, started, time.monotonic() - self._t0))
+
+    def _add_role(self, body):
+        with self._guild_lock:
+            role = _role_payload(next(self._ids), body['name'], 1)
+            role.update(permissions=str(body.get('permissions', '0')), color=body.get('color', 0),
+                        hoist=body.get('hoist', False), mentionable=body.get('mentionable', False))
+            self.roles[int(role['id'])] = role
+            return role
+
+    def _add_channel(self, guild_id, body):
+        with self._guild_lock:
+            parent_id = body.get('parent_id')
+            if parent_id is not None and self.channels.get(int(parent_id), {}).get('type') != 4:
+                self.violations.append(f"{body['name']}: parent {parent_id} is not a category yet")
+            for overwrite in body.get('permission_overwrites', ()):
+                if overwrite['type'] == 0 and int(overwrite['id']) not in self.roles:
+                    self.violations.append(f"{body['name']}: overwrite for unknown role {overwrite['id']}")
+            channel = {'id': str(next(self._ids)), 'guild_id': str(guild_id), 'name': body['name'],
+                       'type': body.get('type', 0), 'position': body.get('position', 0), 'parent_id': parent_id,
+                       'permission_overwrites': body.get('permission_overwrites', []), 'nsfw': False,
+                       'bitrate': 64000, 'user_limit': 0, 'rate_limit_per_user': 0, 'flags': 0,
+                       'available_tags': []}
+            self.channels[int(channel['id'])] = channel
+            return channel
+
+    def start(self):
+        self._t0 = time.monotonic()
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+
+
+def synthetic_backup(roles=20, categories=5, channels_per_category=8):
+    """Backup records of a guild: roles, categories with role overwrites, and channels under them."""
+    source_guild_id = 1
+    records = []
+    for i in range(roles):
+        records.append({'kind': 'role', 'id': 100 + i, 'name': f'role-{i}', 'permissions': 0, 'color': 0,
+                        'position': i + 1, 'hoist': False, 'mentionable': False})
+    allow = {'allow': discord.Permissions(view_channel=True).value, 'deny': 0}
+    deny = {'allow': 0, 'deny': discord.Permissions(view_channel=True).value}
+    channel_id = 10_000
+    for c in range(categories):
+        category_id = channel_id
+        channel_id += 1
+        role_key = f'role_{100 + c % max(1, roles)}' if roles else None
+        permissions = {f'role_{source_guild_id}': deny, **({role_key: allow} if role_key else {})}
+        records.append({'kind': 'channel', 'id': category_id, 'name': f'category-{c}', 'type': 'category',
+                        'position': c, 'parent_id': None, 'permissions': permissions})
+        for n in range(channels_per_category):
+            records.append({'kind': 'channel', 'id': channel_id, 'name': f'channel-{c}-{n}',
+                            'type': 'voice' if n % 4 == 3 else 'text', 'position': n, 'parent_id': category_id,
+                            'permissions': dict(permissions)})
+            channel_id += 1
+    return source_guild_id, records
+
+
+async def restore_into_fake(api, source_guild_id, records, engine):
+    """Plan `records` and execute them with `engine` (a RestoreEngine) into the fake API's guild,
+    through discord.py's HTTP client.
+
+    Returns `(plan, results, problems)`, where `problems` lists ordering and remapping
+    faults found in the guild the fake ended up with.
+    """
+    base, discord.http.Route.BASE = discord.http.Route.BASE, api.base
+    client = discord.Client(intents=discord.Intents.none())
+    try:
+        await client.login('fake-token')
+        guild = await client.fetch_guild(FAKE_GUILD_ID)
+        plan = plan_restore(guild, source_guild_id, records)
+        results = await engine.execute(guild, plan)
+    finally:
+        await client.close()
+        discord.http.Route.BASE = base
+
+    problems = list(api.violations)
+    # stages must not overlap: every role is created (and moved) before any category, and so on
+    spans = {}
+    for kind, started, finished in api.calls:
+        first, last = spans.get(kind, (started, finished))
+        spans[kind] = (min(first, started), max(last, finished))
+    stages = [k for k in ('role', 'positions', 'category', 'channel') if k in spans]
+    for earlier, later in zip(stages, stages[1:]):
+        if spans[earlier][1] > spans[later][0]:
+            problems.append(f'{later} creates started before the {earlier} stage finished')
+    # channels sit under the category restored for their backed-up parent
+    names = {record['id']: record['name'] for record in records}
+    by_id = {int(c['id']): c for c in api.channels.values()}
+    for record in records:
+        if record['kind'] != 'channel' or record['type'] == 'category' or record['parent_id'] is None:
+            continue
+        created = next((c for c in by_id.values() if c['name'] == record['name']), None)
+        if created is None:
+            continue
+        parent = by_id.get(int(created['parent_id'] or 0))
+        if parent is None or parent['name'] != names[record['parent_id']]:
+            problems.append(f"{record['name']} is not under {names[record['parent_id']]}")
+    # restored roles keep their backed-up order
+    restored = sorted((r for r in api.roles.values() if r['name'].startswith('role-')), key=lambda r: r['position'])
+    wanted = [r['name'] for r in sorted((r for r in records if r['kind'] == 'role'), key=lambda r: r['position'])]
+    if results['created']['role'] == len(wanted) and [r['name'] for r in restored] != wanted:
+        problems.append('restored roles are out of order')
+    return plan, results, problems
+
+
+@benchmark('restore')
+def bench_restore(args):
+    """A real restore of a synthetic backup into the fake Discord API, per engine concurrency.
+
+    Runs plan_restore and RestoreEngine.execute through discord.py's HTTP client
+    against an empty fake guild whose create calls cost `--api-ms`. Reported: the
+    wall time against the plan's up-front estimate (with latencies learned from the
+    previous run), the most creates of one kind in flight at once, failed creates,
+    and the ordering faults found: a channel created before its category or with an
+    overwrite for a role that does not exist yet, overlapping stages, channels under
+    the wrong category, roles out of order.
+    """
+    source_guild_id, records = synthetic_backup(args.roles, args.categories, args.channels)
+    print(f'{args.roles} roles, {args.categories} categories, {args.categories * args.channels} channels; '
+          f'fake API {args.api_ms:g}ms per call, error rate {args.error_rate:.0%}')
+    print(f'{"concurrency":>11} {"seconds":>8} {"estimate":>9} {"max in flight":>14} {"failed":>7} {"faults":>7}')
+    logging.getLogger('oauth-verify').setLevel(logging.ERROR)
+    costs = None
+    for concurrency in args.concurrency:
+        engine = RestoreEngine(concurrency=concurrency, costs=costs)
+        api = FakeDiscordAPI(error_rate=args.error_rate, latency=args.api_ms / 1000,
+                             bucket_limit=args.bucket_limit, window=args.window)
+        api.start()
+        try:
+            plan, results, problems = asyncio.run(restore_into_fake(api, source_guild_id, records, engine))
+        finally:
+            api.stop()
+        # the plan is estimated with the per-call costs the previous run learned
+        estimate = plan.estimate_seconds(RestoreEngine(costs=costs).costs, concurrency) if costs else None
+        costs = engine.costs
+        in_flight = max(api.max_in_flight.values(), default=0)
+        print(f'{concurrency:>11} {results["seconds"]:>7.2f}s {f"{estimate:.2f}s" if estimate else "-":>9} '
+              f'{in_flight:>14} {len(results["failed"]):>7} {len(problems):>7}')
+        for problem in problems[:5]:
+            print(f'    {problem}')
+
+
+API_FAULT_POLICIES = ('naive', 'retry', 'breaker')
+
+
+@benchmark('api-faults')
+def bench_api_faults(args):
+    """Member adds against a fake Discord API through an outage, per retry/breaker policy.
+
+    `--senders` threads add members in a closed loop, like callbacks arriving. The
+    fake API fails every request between `--outage-start` and `--outage-end`
+    (with 503s, or timeouts with `--hang`) and `--error-rate` of the rest. `naive`
+    makes one attempt, `retry` adds jittered retries within the deadline, and
+    `breaker` adds per-endpoint circuit breakers as main.py runs them. Reported:
+    calls that succeeded, requests the API absorbed during the outage, how long a
+    failed call kept its caller waiting, and how soon after the outage the first
+    call succeeded again.
+    """
+    outage = (args.outage_start, args.outage_end)
+    print(f'{args.senders} senders for {args.seconds}s, outage {outage[0]}-{outage[1]}s '
+          f'({"hang " + str(args.hang) + "s" if args.hang else "503"}), error rate {args.error_rate:.0%}')
+    print(f'{"policy":<9} {"ok":>6} {"failed":>7} {"outage hits":>12} {"fail p50":>9} {"fail p99":>9} {"recovered":>10}')
+    logging.getLogger('oauth-verify').setLevel(logging.ERROR)
+    for policy in args.policies or API_FAULT_POLICIES:
+        session = requests.Session()
+        session.mount('http://', HTTPAdapter(pool_maxsize=args.senders))
+        api = FakeDiscordAPI(args.error_rate, outage, args.hang)
+        threshold = args.breaker_failures if policy == 'breaker' else 10 ** 9
+        retry = RetryPolicy(attempts=1 if policy == 'naive' else args.attempts, base_delay=0.05, max_delay=1.0,
+                            deadline=args.deadline)
+        client = ApiClient(session, BreakerRegistry(failure_threshold=threshold, open_for=args.open_for),
+                           retry, timeout=args.timeout)
+        outcomes = []        # (finished at, ok, seconds the caller waited)
+        api.start()
+        deadline = time.monotonic() + args.seconds
+
+        def sender(n):
+            local = []
+            i = 0
+            while time.monotonic() < deadline:
+                i += 1
+                started = time.monotonic()
+                try:
+                    ok = client.request('PUT', f'{api.base}/guilds/1/members/{n * 10 ** 6 + i}',
+                                        headers={'Authorization': 'Bot bench'}).status_code == 201
+                except (CircuitOpenError, TimeoutError, requests.RequestException):
+                    ok = False
+                local.append((time.monotonic() - api._t0, ok, time.monotonic() - started))
+                time.sleep(0.01)
+            outcomes.extend(local)
+
+        threads = [threading.Thread(target=sender, args=(n,)) for n in range(args.senders)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        api.stop()
+
+        ok = sum(1 for _, success, _ in outcomes if success)
+        failed = [waited * 1000 for _, success, waited in outcomes if not success]
+        outage_hits = sum(1 for at, _ in api.hits if outage[0] <= at < outage[1])
+        recovered = min((at for at, success, _ in outcomes if success and at >= outage[1]), default=None)
+        recovered = f'+{recovered - outage[1]:.2f}s' if recovered is not None else 'never'
+        print(f'{policy:<9} {ok:>6} {len(failed):>7} {outage_hits:>12} {_percentile(failed, 50):>7.0f}ms '
+              f'{_percentile(failed, 99):>7.0f}ms {recovered:>10}')
+
+
+def _fill_users(path, rows, offset=0, expires_shift=0, chunk=50_000):
+    now = int(time.time())
+    conn = sqlite3.connect(path)
+    for start in range(0, rows, chunk):
+        conn.executemany('INSERT OR REPLACE INTO users (user_id, access_token, token_type, scope, expires_at, valid, '
+                         'validated_at) VALUES (?, ?, ?, ?, ?, 1, ?)',
+                         ((10 ** 17 + offset + i, f'tok{offset + i:024d}', 'Bearer', 'identify guilds.join',
+                           now + ((offset + i) % 96 - 24) * 3600 + expires_shift, now) for i in range(start, min(rows, start + chunk))))
+        conn.commit()
+    conn.executemany('INSERT OR REPLACE INTO guild_config VALUES (?, ?, ?, ?)',
+                     ((g, g + 1, g + 2, None) for g in range(1, 101)))
+    conn.commit()
+    conn.close()
+
+
+@benchmark('transfer')
+def bench_transfer(args):
+    """Throughput and peak Python memory of NDJSON.gz export and import of the token store.
+
+    Exports `--rows` users, imports them into an empty store, then merges a second
+    store whose other half overlaps with newer `expires_at` (so every overlapping
+    row is replaced) into the same target. Peak memory is traced with tracemalloc
+    when `--memory` is set (which slows both directions down).
+    """
+    def run(label, fn):
+        if args.memory:
+            tracemalloc.start()
+        stats = fn()
+        peak = '-'
+        if args.memory:
+            peak = f'{tracemalloc.get_traced_memory()[1] / 1e6:.1f}MB'
+            tracemalloc.stop()
+        print(f'{label:<22} {stats.total:>10,} {stats.elapsed:>7.2f}s {stats.total / stats.elapsed:>10,.0f}/s {peak:>9}')
+        return stats
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source, other, target = (_fresh_db(tmp, name) for name in ('source.db', 'other.db', 'target.db'))
+        _fill_users(source, args.rows)
+        _fill_users(other, args.rows, offset=args.rows // 2, expires_shift=3600)
+        dump, other_dump = os.path.join(tmp, 'source.ndjson.gz'), os.path.join(tmp, 'other.ndjson.gz')
+        print(f'{"step":<22} {"rows":>10} {"time":>8} {"rate":>11} {"peak mem":>9}')
+        run('export', lambda: export_store(source, dump, batch_size=args.batch))
+        run('export (live only)', lambda: export_store(source, os.path.join(tmp, 'live.ndjson.gz'), live_only=True,
+                                                       batch_size=args.batch))
+        export_store(other, other_dump, batch_size=args.batch)
+        print(f'  {os.path.getsize(dump) / 1e6:.1f}MB compressed')
+        run('import (empty)', lambda: import_store(dump, target, args.batch))
+        stats = run('import (merge)', lambda: import_store(other_dump, target, args.batch))
+        conn = sqlite3.connect(target)
+        total = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+        conn.close()
+        print(f'  merge: {stats.summary()}')
+        print(f'  target now holds {total:,} users (expected {args.rows + args.rows // 2:,})')
+
+
+def _traced(fn):
+    """Run `fn()`; returns `(result, retained bytes, peak bytes, allocations retained, seconds)`."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    tracemalloc.stop()
+    return result, current, peak, blocks, elapsed
+
+
+@benchmark('records')
+def bench_records(args):
+    """Memory and allocations of a bulk join's working set: tuples and per-user dicts vs compact records.
+
+    `tuples` is the old shape: `(str user_id, token)` tuples, a token dict, a plan
+    list and a URL plus header dict built per user. `records` is what main.py now
+    uses: UserTokens columns (array-backed integer snowflakes), the plan as a
+    filtered UserTokens, and JoinRequests built once per job. Both start from the
+    same `(int, str)` rows a store returns; a third of the users are already
+    members and dropped from the plan.
+    """
+    rows = [(10 ** 17 + i * 7919, f'{i:030d}') for i in range(args.users)]
+    members = {10 ** 17 + i * 7919 for i in range(0, args.users, 3)}
+    api = 'https://discord.com/api'
+
+    def old_shape():
+        users = [(str(uid), token) for uid, token in rows]
+        tokens = dict(users)
+        plan = sorted(uid for uid, _ in users if int(uid) not in members)
+        sent = 0
+        for uid in plan:
+            url = f'{api}/guilds/1/members/{uid}'
+            headers = {'Authorization': 'Bot token'}
+            payload = {'access_token': tokens[uid]}
+            sent += len(url) + len(headers) + len(payload)
+        return users, tokens, plan
+
+    def new_shape():
+        users = UserTokens.from_rows(rows)
+        plan = users.without(members)
+        join_requests = JoinRequests(api, 1, 'token')
+        sent = 0
+        for uid, token in plan:
+            url = join_requests.member_url(uid)
+            payload = {'access_token': token}
+            sent += len(url) + len(join_requests.headers) + len(payload)
+        return users, plan
+
+    print(f'{args.users:,} stored users, {len(members):,} already members')
+    print(f'{"shape":<9} {"retained":>10} {"peak":>10} {"objects":>11} {"bytes/user":>11} {"time":>8}')
+    for label, fn in (('tuples', old_shape), ('records', new_shape)):
+        result, current, peak, blocks, elapsed = _traced(fn)
+        print(f'{label:<9} {current / 1e6:>8.1f}MB {peak / 1e6:>8.1f}MB {blocks:>11,} '
+              f'{current / args.users:>11.1f} {elapsed:>7.2f}s')
+        del result
+
+
+def _fake_oauth_api(sock, latency):
+    """Token exchange, /users/@me and member add, enough for main.py's /callback; codes are integers."""
+    app = Flask('fake-discord')
+
+    @app.route('/api/oauth2/token', methods=['POST'])
+    def token():
+        time.sleep(latency)
+        return {'access_token': 'tok-' + request.form['code'], 'token_type': 'Bearer',
+                'scope': 'identify guilds.join', 'expires_in': 604800}
+
+    @app.route('/api/users/@me')
+    def me():
+        time.sleep(latency)
+        return {'id': str(10 ** 17 + int(request.headers['Authorization'].rsplit('-', 1)[1]))}
+
+    @app.route('/api/guilds/<guild_id>/members/<user_id>', methods=['PUT'])
+    def add_member(guild_id, user_id):
+        time.sleep(latency)
+        return {}, 201
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    make_server('127.0.0.1', 0, app, threaded=True, fd=sock.fileno()).serve_forever()
+
+
+# Runs main.py's web tier the way `python main.py` does with WEB_WORKERS set, minus the bot
+_WEB_WORKER_BOOT = """
+import os, signal, time
+import main
+supervisor = main.start_web_workers(main.WEB_WORKERS)
+signal.signal(signal.SIGTERM, lambda *_: (main.stop_web_workers(supervisor), os._exit(0)))
+main.init_db()
+while True:
+    time.sleep(1)
+"""
+
+
+def _callback_client(port, first_code, threads, seconds, results):
+    deadline = time.monotonic() + seconds
+    counter = iter(range(first_code, first_code + 10 ** 8))
+    ok, errors, latencies = [0], [0], []
+
+    def run():
+        while time.monotonic() < deadline:
+            code = next(counter)
+            started = time.perf_counter()
+            # a new connection per callback, like browsers arriving from different users
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            try:
+                conn.request('GET', f'/callback?code={code}')
+                resp = conn.getresponse()
+                body = resp.read()
+                good = resp.status == 200 and b'joined' in body
+            except OSError:
+                good = False
+            finally:
+                conn.close()
+            latencies.append(time.perf_counter() - started)
+            if good:
+                ok[0] += 1
+            else:
+                errors[0] += 1
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put((ok[0], errors[0], latencies))
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+@benchmark('web-workers')
+def bench_web_workers(args):
+    """/callback throughput of main.py's web tier with 1, 2, 4... pre-forked web workers.
+
+    Each run boots main.py's web workers (SO_REUSEPORT, tokens.db in WAL mode,
+    post-join work queued for the bot process) against a fake Discord API served by
+    `--api-processes` processes with `--api-ms` latency per call. `--clients`
+    processes x `--threads` threads redeem unique codes in a closed loop for
+    `--seconds`, one connection per callback. Reported: successful callbacks per
+    second, latency, failures, and the work items waiting for the bot, which should
+    equal the successful callbacks. Scaling is bounded by the cores this host has.
+    """
+    ctx = multiprocessing.get_context('fork')
+    api_sock = socket.socket()
+    api_sock.bind(('127.0.0.1', 0))
+    api_sock.listen(256)
+    api_base = f'http://127.0.0.1:{api_sock.getsockname()[1]}/api'
+    apis = [ctx.Process(target=_fake_oauth_api, args=(api_sock, args.api_ms / 1000), daemon=True)
+            for _ in range(args.api_processes)]
+    for proc in apis:
+        proc.start()
+    print(f'{os.cpu_count()} CPUs; {args.clients}x{args.threads} clients for {args.seconds}s per run, '
+          f'fake API {args.api_ms:g}ms per call on {args.api_processes} processes')
+    print(f'{"workers":<8} {"callbacks/s":>12} {"p50":>9} {"p99":>9} {"failed":>7} {"queued":>7}')
+    try:
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as tmp:
+                port = _free_port()
+                env = dict(os.environ, WEB_WORKERS=str(workers), PORT=str(port), DISCORD_API_BASE=api_base,
+                           DB_PATH=os.path.join(tmp, 'tokens.db'), GUILD_ID='1', MEMBER_ROLE_ID='2',
+                           ADMISSION_ENABLED='0', RATE_LIMIT_GLOBAL_RPS='1000000', RULES_WEBHOOK_URL='',
+                           LEGACY_VERIFY_DB_PATH='')
+                log_path = os.path.join(tmp, 'web.log')
+                with open(log_path, 'w') as log:
+                    server = subprocess.Popen([sys.executable, '-c', _WEB_WORKER_BOOT], env=env, stdout=log,
+                                              stderr=subprocess.STDOUT, cwd=os.path.dirname(os.path.abspath(__file__)))
+                try:
+                    if not _wait_for_port(port):
+                        with open(log_path) as log:
+                            print(f'{workers} workers did not start:\n' + log.read()[-2000:])
+                        continue
+                    results = ctx.Queue()
+                    clients = [ctx.Process(target=_callback_client,
+                                           args=(port, n * 10 ** 8, args.threads, args.seconds, results))
+                               for n in range(args.clients)]
+                    for proc in clients:
+                        proc.start()
+                    ok = failed = 0
+                    latencies = []
+                    for _ in clients:
+                        o, f, l = results.get()
+                        ok, failed = ok + o, failed + f
+                        latencies.extend(l)
+                    for proc in clients:
+                        proc.join()
+                finally:
+                    server.send_signal(signal.SIGTERM)
+                    server.wait(30)
+                conn = sqlite3.connect(env['DB_PATH'])
+                queued = conn.execute('SELECT COUNT(*) FROM work_queue').fetchone()[0]
+                conn.close()
+                print(f'{workers:<8} {ok / args.seconds:>12,.0f} {_percentile(latencies, 50) * 1000:>7.1f}ms '
+                      f'{_percentile(latencies, 99) * 1000:>7.1f}ms {failed:>7} {queued:>7}')
+    finally:
+        for proc in apis:
+            proc.terminate()
+        api_sock.close()
+
+
+class _FakeMessage:
+    """Counts edits; refuses them like an expired interaction token once `expires_at` (monotonic) passes."""
+
+    def __init__(self, expires_at=None):
+        self.expires_at = expires_at
+        self.edits = self.refused = 0
+        self.content = None
+
+    async def edit(self, content):
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            self.refused += 1
+            raise discord.HTTPException(type('Response', (), {'status': 401, 'reason': 'Unauthorized'})(),
+                                        {'code': 50027, 'message': 'Invalid Webhook Token'})
+        self.edits += 1
+        self.content = content
+
+
+class _FakeChannel:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, content):
+        message = _FakeMessage()
+        message.content = content
+        self.messages.append(message)
+        return message
+
+
+@benchmark('progress')
+def bench_progress(args):
+    """Edits a throttled progress message costs over a long job, and its move to the channel on token expiry.
+
+    A simulated join of `--users` users updates progress after every user for
+    about `--seconds` (event-loop overhead stretches it; rates use the real duration). The interaction message stops accepting edits after `--expire-after`
+    seconds. `--margin 0` makes the reporter learn that from a refused edit;
+    otherwise it moves `--margin` seconds early.
+    """
+    async def run(margin):
+        board = ProgressBoard()
+        started = time.monotonic()
+        message = _FakeMessage(started + args.expire_after)
+        channel = _FakeChannel()
+        expires_at = started + args.expire_after - margin if margin else started + args.expire_after + 3600
+        reporter = ProgressReporter(message, channel, expires_at, min_interval=args.interval)
+        board.track(1, 'join_all job #1')
+        board.attach(1, reporter)
+        for done in range(1, args.users + 1):
+            board.publish(1, done, args.users, {'added': done, 'failed': 0})
+            await asyncio.sleep(args.seconds / args.users)
+        await board.finish(1)
+        return message, channel, time.monotonic() - started
+
+    print(f'{args.users:,} updates over {args.seconds}s, at most one edit per {args.interval}s, '
+          f'token expires after {args.expire_after}s')
+    print(f'{"margin":<8} {"took":>6} {"edits":>6} {"refused":>8} {"channel edits":>14} {"edits/min":>10}  final message')
+    for margin in (0, args.margin):
+        message, channel, took = asyncio.run(run(margin))
+        moved = channel.messages[0] if channel.messages else None
+        edits = message.edits + (1 + moved.edits if moved else 0)
+        final = (moved or message).content.splitlines()[1]
+        print(f'{margin:<8g} {took:>5.1f}s {message.edits:>6} {message.refused:>8} {moved.edits if moved else 0:>14} '
+              f'{edits / took * 60:>10.1f}  {"channel" if moved else "interaction"}: {final}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest='name', required=True)
+
+    p = sub.add_parser('member-cache', help=bench_member_cache.__doc__.splitlines()[0])
+    p.add_argument('--members', type=int, default=500_000)
+    p.add_argument('--holders', type=float, default=0.05, help='fraction of members holding a tracked role')
+    p.add_argument('--verifies', type=int, default=2_000, help='members touched in lazy mode')
+    p.add_argument('--modes', nargs='*', choices=MEMBER_CACHE_MODES)
+
+    p = sub.add_parser('write-behind', help=bench_write_behind.__doc__.splitlines()[0])
+    p.add_argument('--rows', type=int, default=5_000)
+    p.add_argument('--writers', type=int, default=32, help='concurrent callers')
+    p.add_argument('--batch', type=int, default=256)
+    p.add_argument('--delay', type=float, default=0.005, help='max seconds a write waits for its batch')
+
+    p = sub.add_parser('admission', help=bench_admission.__doc__.splitlines()[0])
+    p.add_argument('--clients', type=int, default=64)
+    p.add_argument('--backend-slots', type=int, default=8)
+    p.add_argument('--service-ms', type=float, default=50)
+    p.add_argument('--max-in-flight', type=int, default=0, help='default: 2x backend slots')
+    p.add_argument('--seconds', type=float, default=5)
+
+    p = sub.add_parser('storage', help=bench_storage.__doc__.splitlines()[0])
+    p.add_argument('--backends', nargs='*', choices=STORAGE_BACKENDS)
+    p.add_argument('--rows', type=int, default=5_000)
+    p.add_argument('--writers', type=int, default=16)
+    p.add_argument('--reads', type=int, default=20_000)
+    p.add_argument('--delay', type=float, default=0.005, help='write-behind max batch delay')
+
+    p = sub.add_parser('rate-limit', help=bench_rate_limit.__doc__.splitlines()[0])
+    p.add_argument('--processes', type=int, nargs='*', default=[1, 2, 4])
+    p.add_argument('--threads', type=int, default=8, help='sender threads per process')
+    p.add_argument('--seconds', type=float, default=3)
+    p.add_argument('--rate', type=float, default=50, help='global requests per second')
+    p.add_argument('--burst', type=float, default=10)
+    p.add_argument('--bucket-limit', type=int, default=5)
+    p.add_argument('--window', type=float, default=0.25)
+
+    p = sub.add_parser('api-faults', help=bench_api_faults.__doc__.splitlines()[0])
+    p.add_argument('--policies', nargs='*', choices=API_FAULT_POLICIES)
+    p.add_argument('--senders', type=int, default=16)
+    p.add_argument('--seconds', type=float, default=8)
+    p.add_argument('--outage-start', type=float, default=2)
+    p.add_argument('--outage-end', type=float, default=5)
+    p.add_argument('--hang', type=float, default=0, help='outage requests hang this long instead of failing fast')
+    p.add_argument('--error-rate', type=float, default=0.02)
+    p.add_argument('--attempts', type=int, default=4)
+    p.add_argument('--deadline', type=float, default=3)
+    p.add_argument('--timeout', type=float, default=0.5, help='per-attempt HTTP timeout')
+    p.add_argument('--breaker-failures', type=int, default=5)
+    p.add_argument('--open-for', type=float, default=1)
+
+    p = sub.add_parser('restore', help=bench_restore.__doc__.splitlines()[0])
+    p.add_argument('--roles', type=int, default=30)
+    p.add_argument('--categories', type=int, default=8)
+    p.add_argument('--channels', type=int, default=10, help='channels per category')
+    p.add_argument('--concurrency', type=int, nargs='*', default=[1, 2, 4, 8])
+    p.add_argument('--api-ms', type=float, default=20, help='fake Discord API latency per create')
+    p.add_argument('--error-rate', type=float, default=0.0)
+    p.add_argument('--bucket-limit', type=int, default=50, help='creates of one kind allowed per window')
+    p.add_argument('--window', type=float, default=1.0)
+
+    p = sub.add_parser('transfer', help=bench_transfer.__doc__.splitlines()[0])
+    p.add_argument('--rows', type=int, default=1_000_000)
+    p.add_argument('--batch', type=int, default=5000)
+    p.add_argument('--memory', action='store_true', help='trace peak Python memory (slower)')
+
+    p = sub.add_parser('records', help=bench_records.__doc__.splitlines()[0])
+    p.add_argument('--users', type=int, default=500_000)
+
+    p = sub.add_parser('web-workers', help=bench_web_workers.__doc__.splitlines()[0])
+    p.add_argument('--workers', type=int, nargs='*', default=[1, 2, 4])
+    p.add_argument('--clients', type=int, default=2, help='load generator processes')
+    p.add_argument('--threads', type=int, default=16, help='concurrent callbacks per client process')
+    p.add_argument('--seconds', type=float, default=5)
+    p.add_argument('--api-ms', type=float, default=5, help='fake Discord API latency per call')
+    p.add_argument('--api-processes', type=int, default=2)
+
+    p = sub.add_parser('progress', help=bench_progress.__doc__.splitlines()[0])
+    p.add_argument('--users', type=int, default=20_000)
+    p.add_argument('--seconds', type=float, default=12)
+    p.add_argument('--interval', type=float, default=1.0, help='minimum seconds between edits')
+    p.add_argument('--expire-after', type=float, default=6)
+    p.add_argument('--margin', type=float, default=1)
+
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args)
+
+
+if __name__ == '__main__':
+    main()
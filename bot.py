@@ -1,14 +1,20 @@
 import asyncio
 import os
+import sqlite3
 from typing import Optional
 from urllib.parse import quote_plus
 
-import aiosqlite
 import aiohttp
 from aiohttp import web
 import discord
 from discord import app_commands
-from discord.ext import commands
+
+import events
+from membercache import MemberCachePolicy
+from migrations import import_legacy_verification_db, migrate
+from notifier import WebhookNotifier
+from writebehind import WriteBehindBuffer
+from sharding import make_bot, owns_guild, parse_shard_ids
 
 # -----------------------------
 # CONFIG - LOAD FROM EN
@@ -22,21 +28,31 @@ VERIFY_ROLE_ID = int(os.getenv("VERIFY_ROLE_ID"))
 UNVERIFIED_ROLE_ID = int(os.getenv("UNVERIFIED_ROLE_ID"))
 RULES_WEBHOOK_URL = os.getenv("RULES_WEBHOOK_URL")
 OAUTH_SCOPES = ["identify", "guilds.join"]
+MEMBER_CACHE_MODE = os.getenv("MEMBER_CACHE_MODE") or "full"
+SHARD_COUNT = os.getenv("SHARD_COUNT") or ""
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS") or "")
 
 # OAuth endpoints
 TOKEN_URL = "https://discord.com/api/oauth2/token"
 USER_URL = "https://discord.com/api/users/@me"
 JOIN_MEMBER_URL_TEMPLATE = "https://discord.com/api/guilds/{guild_id}/members/{user_id}"
 
-# Database
-DB_PATH = "linked_users.db"
+# Database (shared with main.py; the old linked_users.db is imported on first start)
+DB_PATH = os.getenv("DB_PATH") or os.path.join(os.path.dirname(__file__), "tokens.db")
+LEGACY_DB_PATH = "linked_users.db"
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE") or 256)
+WRITE_BATCH_DELAY = float(os.getenv("WRITE_BATCH_DELAY") or 0.05)
+writer: Optional[WriteBehindBuffer] = None
+event_log = events.EventLog()
+notifier = WebhookNotifier(RULES_WEBHOOK_URL, flush_interval=float(os.getenv("NOTIFY_FLUSH_INTERVAL") or 5))
 
 # -----------------------------
 # BOT SETUP
 # -----------------------------
 intents = discord.Intents.default()
 intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+member_cache = MemberCachePolicy(MEMBER_CACHE_MODE, tracked_roles=lambda guild: {VERIFY_ROLE_ID, UNVERIFIED_ROLE_ID})
+bot = make_bot(SHARD_COUNT, SHARD_IDS, command_prefix="!", intents=intents, **member_cache.bot_options(intents))
 tree = bot.tree
 
 # ---------- OAuth URL generator ----------
@@ -92,13 +108,16 @@ async def handle_oauth_callback(request):
         join_headers = {"Authorization": f"Bot {BOT_TOKEN}", "Content-Type": "application/json"}
         async with sess.put(join_url, json=join_body, headers=join_headers) as join_resp:
             if join_resp.status in (201, 204):
-                async with aiosqlite.connect(DB_PATH) as db:
-                    await db.execute("CREATE TABLE IF NOT EXISTS oauth_links (discord_id INTEGER PRIMARY KEY, username TEXT)")
-                    await db.execute("INSERT OR REPLACE INTO oauth_links (discord_id, username) VALUES (?, ?)",
-                                     (user_id, f"{user_json.get('username')}#{user_json.get('discriminator')}"))
-                    await db.commit()
+                # durable: the success page promises the link is recorded
+                await writer.write("INSERT OR REPLACE INTO oauth_links (discord_id, username) VALUES (?, ?)",
+                                   (user_id, f"{user_json.get('username')}#{user_json.get('discriminator')}"))
+                notifier.notify("verified", f"<@{user_id}> linked through OAuth and joined")
+                event_log.record(events.VERIFIED, GUILD_ID, user_id, {"via": "oauth"})
+                event_log.record(events.JOINED, GUILD_ID, user_id)
                 return web.Response(text=f"Success! {user_json.get('username')} added.", content_type="text/html")
             else:
+                notifier.notify("join_failed", f"<@{user_id}> OAuth join failed: HTTP {join_resp.status}")
+                event_log.record(events.JOIN_FAILED, GUILD_ID, user_id, {"status": join_resp.status})
                 return web.Response(text=f"Failed to join guild: {join_resp.status}", status=500)
 
 def make_web_app():
@@ -117,13 +136,15 @@ class VerifyView(discord.ui.View):
         try:
             if give_role: await member.add_roles(give_role)
             if remove_role and remove_role in member.roles: await member.remove_roles(remove_role)
+            member_cache.remember(member, granted_role_ids=[give_role.id] if give_role else ())
         except Exception:
             await interaction.response.send_message("Role assignment failed", ephemeral=True)
             return
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("CREATE TABLE IF NOT EXISTS verified (discord_id INTEGER PRIMARY KEY, verified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
-            await db.execute("INSERT OR REPLACE INTO verified (discord_id) VALUES (?)", (member.id,))
-            await db.commit()
+        # the roles are already granted, so the record can follow in the next batch
+        await writer.write("INSERT OR REPLACE INTO verified (guild_id, discord_id) VALUES (?, ?)",
+                           (guild.id, member.id), durable=False)
+        notifier.notify("verified", f"<@{member.id}> verified with the rules button")
+        event_log.record(events.VERIFIED, guild.id, member.id, {"via": "button"})
         await interaction.response.send_message("✅ Verified!", ephemeral=True)
 
 # ---------- Slash Commands ----------
@@ -155,16 +176,45 @@ async def start_web_app():
 @bot.event
 async def on_ready():
     print(f"Bot logged in as {bot.user} ({bot.user.id})")
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("CREATE TABLE IF NOT EXISTS verified (discord_id INTEGER PRIMARY KEY)")
-        await db.execute("CREATE TABLE IF NOT EXISTS oauth_links (discord_id INTEGER PRIMARY KEY, username TEXT)")
-        await db.commit()
-    try: await tree.sync(guild=discord.Object(id=GUILD_ID)); print("Commands synced")
-    except Exception as e: print(e)
+    if owns_guild(bot, GUILD_ID):
+        try: await tree.sync(guild=discord.Object(id=GUILD_ID)); print("Commands synced")
+        except Exception as e: print(e)
+    if member_cache.uses_index:
+        for guild in bot.guilds:
+            asyncio.create_task(member_cache.warm(guild))
+
+@bot.event
+async def on_member_join(member):
+    member_cache.remember(member)
+
+@bot.event
+async def on_member_update(before, after):
+    member_cache.remember(after)
+
+@bot.event
+async def on_raw_member_remove(payload):
+    member_cache.forget(payload.guild_id, payload.user.id)
+
+def init_db():
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        migrate(conn)
+        import_legacy_verification_db(conn, LEGACY_DB_PATH, GUILD_ID)
+    finally:
+        conn.close()
 
 async def main():
-    await start_web_app()
-    await bot.start(BOT_TOKEN)
+    global writer
+    await asyncio.to_thread(init_db)
+    writer = WriteBehindBuffer(DB_PATH, max_batch=WRITE_BATCH_SIZE, max_delay=WRITE_BATCH_DELAY)
+    event_log.writer = writer
+    try:
+        await start_web_app()
+        await bot.start(BOT_TOKEN)
+    finally:
+        await asyncio.to_thread(notifier.close)
+        await asyncio.to_thread(writer.close)
 
 if __name__ == "__main__":
     asyncio.run(main())
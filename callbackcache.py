@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger('oauth-verify')
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries also expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedemptionCache:
+    """Remembers recently redeemed OAuth codes and recently joined (user, guild) pairs.
+
+    A repeated `/callback` for the same code gets the first request's outcome
+    without another token exchange; concurrent duplicates wait for the request
+    already in flight. After `share_via()`, outcomes are also written to the
+    `callback_redemptions` table so every web worker sharing tokens.db sees them.
+    Codes are stored hashed.
+    """
+
+    def __init__(self, maxsize=10000, ttl=600):
+        self.ttl = ttl
+        self._codes = TTLCache(maxsize, ttl)
+        self._joined = TTLCache(maxsize, ttl)
+        self._connect = None
+        self._writer = None
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def share_via(self, connect, writer):
+        """Also publish and look up outcomes in SQLite (for multi-worker deployments)."""
+        self._connect = connect
+        self._writer = writer
+
+    @staticmethod
+    def code_key(code):
+        return 'code:' + hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def join_key(user_id, guild_id):
+        return f'join:{int(user_id)}:{int(guild_id)}'
+
+    def _shared_get(self, key):
+        if self._connect is None:
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT outcome FROM callback_redemptions WHERE key = ? AND expires_at > ?',
+                               (key, int(time.time()))).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+    def _shared_set(self, key, value):
+        if self._connect is None or self._writer is None:
+            return
+        expires_at = int(time.time() + self.ttl)
+        self._writer.submit('INSERT OR REPLACE INTO callback_redemptions (key, outcome, expires_at) VALUES (?, ?, ?)',
+                            (key, json.dumps(value), expires_at))
+        self._writes += 1
+        if self._writes % 500 == 0:
+            self._writer.submit('DELETE FROM callback_redemptions WHERE expires_at <= ?', (int(time.time()),))
+
+    def outcome(self, code, wait=0.0):
+        """The cached outcome for `code`, or None. With `wait`, poll the shared table
+        for up to that many seconds (another worker may be finishing the redemption)."""
+        key = self.code_key(code)
+        value = self._codes.get(key)
+        if value is not None:
+            return value
+        deadline = time.monotonic() + wait
+        while True:
+            value = self._shared_get(key)
+            if value is not None:
+                self._codes.set(key, value)
+                return value
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.1)
+
+    @contextmanager
+    def redeeming(self, code):
+        """Serialise requests for the same code in this process.
+
+        Yields the outcome of a concurrent request for the same code if it finished
+        while waiting, or None if the caller should redeem the code itself.
+        """
+        key = self.code_key(code)
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+        if not owner:
+            event.wait(timeout=30)
+            yield self._codes.get(key)
+            return
+        try:
+            yield None
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def remember_outcome(self, code, messages):
+        key = self.code_key(code)
+        self._codes.set(key, messages)
+        self._shared_set(key, messages)
+
+    def recently_joined(self, user_id, guild_id, shared=True):
+        """With `shared=False` only this process's memory is checked (no database read)."""
+        key = self.join_key(user_id, guild_id)
+        if self._joined.get(key):
+            return True
+        if shared and self._shared_get(key):
+            self._joined.set(key, True)
+            return True
+        return False
+
+    def remember_join(self, user_id, guild_id):
+        key = self.join_key(user_id, guild_id)
+        self._joined.set(key, True)
+        self._shared_set(key, True)
@@ -0,0 +1,262 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from sharedlimits import route_key
+
+logger = logging.getLogger('oauth-verify')
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+def never_sent(error):
+    """True when `error` (a requests exception) happened while connecting, so the request never left this host.
+
+    requests also raises ConnectionError for a connection dropped after the body
+    was sent (RemoteDisconnected, ProtocolError); those may have been processed.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError):
+        return False
+    cause = error.args[0] if error.args else None
+    # urllib3 wraps the connect failure in MaxRetryError(reason=...)
+    return isinstance(getattr(cause, 'reason', cause), NewConnectionError)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose breaker is open."""
+
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f'{endpoint} is failing; retry in {retry_after:.0f}s')
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops calling one endpoint while it keeps failing.
+
+    `failure_threshold` consecutive failures (5xx or timeouts) within `window`
+    seconds open the breaker: calls fail fast with CircuitOpenError for `open_for`
+    seconds. After that the breaker half-opens and lets `probes` requests through;
+    a successful probe closes it, a failed one reopens it for twice as long (up to
+    `max_open_for`). A probe that reports no outcome within `probe_timeout`
+    seconds is written off and its slot handed to the next caller.
+    """
+
+    def __init__(self, name, failure_threshold=5, window=30.0, open_for=10.0, max_open_for=120.0, probes=1,
+                 probe_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.base_open_for = open_for
+        self.max_open_for = max_open_for
+        self.probes = probes
+        self.probe_timeout = probe_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._first_failure = 0.0
+        self._open_for = open_for
+        self._opened_at = 0.0
+        self._probes_out = 0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self._open_for - time.monotonic())
+
+    def check(self):
+        """Raise CircuitOpenError while the cooldown runs, without taking a probe slot."""
+        retry_after = self.retry_after()
+        if retry_after > 0:
+            raise CircuitOpenError(self.name, retry_after)
+
+    def allow(self):
+        """Return if a request may go out now; raise CircuitOpenError otherwise."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN:
+                remaining = self._opened_at + self._open_for - now
+                if remaining > 0:
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = HALF_OPEN
+                self._probes_out = 0
+                logger.info('Circuit %s half-open: probing', self.name)
+            if self._probes_out >= self.probes:
+                if now - self._probe_at < self.probe_timeout:
+                    raise CircuitOpenError(self.name, min(self.base_open_for, 1.0))
+                logger.warning('Circuit %s: probe reported no outcome in %.0fs; probing again', self.name, self.probe_timeout)
+                self._probes_out = 0
+            self._probes_out += 1
+            self._probe_at = now
+
+    def record_success(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                logger.info('Circuit %s closed: probe succeeded', self.name)
+                self._open_for = self.base_open_for
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self._open_for = min(self.max_open_for, self._open_for * 2)
+                self._trip(now)
+                return
+            if self.state == OPEN:
+                return
+            if not self.failures or now - self._first_failure > self.window:
+                self.failures = 0
+                self._first_failure = now
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self._trip(now)
+
+    def _trip(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self._probes_out = 0
+        logger.warning('Circuit %s open for %.0fs after %d failures', self.name, self._open_for, self.failures)
+
+
+class BreakerRegistry:
+    """One CircuitBreaker per endpoint, created on first use with shared settings."""
+
+    def __init__(self, **settings):
+        self.settings = settings
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(endpoint, CircuitBreaker(endpoint, **self.settings))
+        return breaker
+
+    def snapshot(self):
+        """`[(endpoint, state, failures, retry_after)]` for every breaker that is not closed."""
+        return [(b.name, b.state, b.failures, b.retry_after())
+                for b in list(self._breakers.values()) if b.state != CLOSED]
+
+
+class RetryPolicy:
+    """Up to `attempts` tries per request, with full-jitter exponential backoff, within `deadline` seconds."""
+
+    def __init__(self, attempts=4, base_delay=0.25, max_delay=4.0, deadline=15.0):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class ApiClient:
+    """Discord REST calls through per-endpoint circuit breakers and a retry policy.
+
+    Bot-token requests also reserve a slot from `limiter` (a SharedRateLimiter)
+    before they are sent and report the response's rate-limit headers back to it.
+    5xx responses, timeouts and connection errors count against the endpoint's
+    breaker and are retried after a jittered backoff while the per-request
+    deadline allows; non-idempotent requests are only retried when the connection
+    itself failed, so they cannot have reached Discord. When retries run out the last response is returned, or
+    the last error raised. An open breaker raises CircuitOpenError without
+    touching the network. The latency of the last `latency_samples` answered
+    requests per route is kept for estimates.
+    """
+
+    def __init__(self, session, breakers, retry, limiter=None, timeout=10.0, latency_samples=256):
+        self.session = session
+        self.breakers = breakers
+        self.retry = retry
+        self.limiter = limiter
+        self.timeout = timeout
+        self.latency_samples = latency_samples
+        self._latency = {}
+
+    def latency_stats(self, route):
+        """`(samples, p50, p90)` in seconds for `route`, or None before it has been answered."""
+        samples = sorted(self._latency.get(route, ()))
+        if not samples:
+            return None
+        return len(samples), samples[len(samples) // 2], samples[min(len(samples) - 1, len(samples) * 9 // 10)]
+
+    def request(self, method, url, max_wait=None, deadline=None, idempotent=True, **kwargs):
+        """`max_wait` bounds the wait for a rate-limit slot (None: as long as it takes)."""
+        route = route_key(method, url)
+        breaker = self.breakers.get(route)
+        limited = self.limiter is not None and (kwargs.get('headers') or {}).get('Authorization', '').startswith('Bot ')
+        deadline_at = time.monotonic() + (deadline if deadline is not None else self.retry.deadline)
+        resp = error = None
+        for attempt in range(self.retry.attempts):
+            breaker.check()
+            if limited:
+                self.limiter.acquire(route, timeout=max_wait)
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                if limited:
+                    self.limiter.refund(route)
+                break
+            # a half-open probe slot is only taken once nothing but the request stands between it and an outcome
+            try:
+                breaker.allow()
+            except CircuitOpenError:
+                if limited:
+                    self.limiter.refund(route)
+                raise
+            try:
+                sent = time.perf_counter()
+                resp = self.session.request(method, url, timeout=min(self.timeout, remaining), **kwargs)
+            except requests.RequestException as e:
+                unsent = never_sent(e)
+                if limited and unsent:
+                    # nothing reached Discord, so the slot goes back to the pool
+                    self.limiter.refund(route)
+                breaker.record_failure()
+                resp, error = None, e
+                if not idempotent and not unsent:
+                    raise
+                logger.debug('%s failed (attempt %d): %s', route, attempt + 1, e)
+            else:
+                samples = self._latency.get(route)
+                if samples is None:
+                    samples = self._latency.setdefault(route, deque(maxlen=self.latency_samples))
+                samples.append(time.perf_counter() - sent)
+                if limited:
+                    self.limiter.update(route, resp.status_code, resp.headers)
+                if resp.status_code == 429:
+                    # the API is up, it only wants us to slow down
+                    breaker.record_success()
+                    if not limited:
+                        time.sleep(min(float(resp.headers.get('Retry-After') or 1), max(0.0, deadline_at - time.monotonic())))
+                    continue
+                if resp.status_code < 500:
+                    breaker.record_success()
+                    return resp
+                breaker.record_failure()
+                if not idempotent:
+                    return resp
+                logger.debug('%s returned %d (attempt %d)', route, resp.status_code, attempt + 1)
+            delay = self.retry.backoff(attempt)
+            if attempt + 1 >= self.retry.attempts or time.monotonic() + delay >= deadline_at:
+                break
+            time.sleep(delay)
+        if resp is not None:
+            return resp
+        if error is not None:
+            raise error
+        raise TimeoutError(f'{route}: deadline exceeded')
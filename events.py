@@ -0,0 +1,80 @@
+import json
+import logging
+import time
+
+logger = logging.getLogger('oauth-verify')
+
+# Event kinds
+CALLBACK = 'callback'                  # /callback received a code
+EXCHANGE_FAILED = 'exchange_failed'    # the OAuth code could not be redeemed
+VERIFIED = 'verified'                  # a user completed verification (OAuth or button)
+JOINED = 'joined'                      # a stored user was added to a guild
+JOIN_FAILED = 'join_failed'
+ROLE_GRANTED = 'role_granted'
+ROLE_FAILED = 'role_failed'
+
+HOUR = 3600
+DAY = 86400
+
+_INSERT_EVENT = 'INSERT INTO events (ts, kind, guild_id, user_id, detail) VALUES (?, ?, ?, ?, ?)'
+_BUMP = '''INSERT INTO {table} (period_start, kind, guild_id, count) VALUES (?, ?, ?, ?)
+ON CONFLICT (period_start, kind, guild_id) DO UPDATE SET count = count + excluded.count'''
+_BUMP_HOURLY = _BUMP.format(table='events_hourly')
+_BUMP_DAILY = _BUMP.format(table='events_daily')
+
+
+class EventLog:
+    """Appends events through the write-behind buffer and keeps hourly/daily counts current.
+
+    Each event is three statements (the event row and one upsert per rollup) that
+    the buffer commits together with whatever else is queued, so logging never
+    waits on disk. Rollups are keyed by period, kind and guild; per-guild events
+    also count towards guild 0, the all-guilds total.
+    """
+
+    def __init__(self, writer=None):
+        self.writer = writer
+
+    def record(self, kind, guild_id=None, user_id=None, detail=None, ts=None):
+        if self.writer is None:
+            return
+        ts = int(ts if ts is not None else time.time())
+        if isinstance(detail, dict):
+            detail = json.dumps(detail, separators=(',', ':'))
+        try:
+            self.writer.submit(_INSERT_EVENT, (ts, kind, _id(guild_id), _id(user_id), detail))
+            for guild in {0, _id(guild_id) or 0}:
+                self.writer.submit(_BUMP_HOURLY, (ts - ts % HOUR, kind, guild, 1))
+                self.writer.submit(_BUMP_DAILY, (ts - ts % DAY, kind, guild, 1))
+        except RuntimeError:
+            # the writer is closed during shutdown; losing a late audit event is fine
+            logger.debug('Event %s dropped: writer closed', kind)
+
+
+def _id(value):
+    return int(value) if value is not None and str(value).isdigit() else None
+
+
+def read_stats(conn, guild_id=0, now=None):
+    """Counts per kind for the current UTC day, the last 24 hours and the last 7 days.
+
+    Reads at most 24 hourly and 7 daily rows per kind from the rollup tables, so
+    the cost does not depend on how many events have been logged.
+    """
+    now = int(now if now is not None else time.time())
+    guild_id = _id(guild_id) or 0
+    hour_start = now - now % HOUR
+    day_start = now - now % DAY
+    stats = {'today': {}, 'last_24h': {}, 'last_7d': {}}
+    rows = conn.execute('SELECT period_start, kind, count FROM events_daily '
+                        'WHERE period_start >= ? AND period_start <= ? AND guild_id = ?',
+                        (day_start - 6 * DAY, day_start, guild_id))
+    for period_start, kind, count in rows:
+        stats['last_7d'][kind] = stats['last_7d'].get(kind, 0) + count
+        if period_start == day_start:
+            stats['today'][kind] = count
+    rows = conn.execute('SELECT kind, SUM(count) FROM events_hourly '
+                        'WHERE period_start > ? AND period_start <= ? AND guild_id = ? GROUP BY kind',
+                        (hour_start - 24 * HOUR, hour_start, guild_id))
+    stats['last_24h'] = dict(rows.fetchall())
+    return stats
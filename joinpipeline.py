@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import discord
+
+logger = logging.getLogger('oauth-verify')
+
+
+class JoinPipeline:
+    """Coalesces `on_member_join` events and gives new members the Unverified role in batches.
+
+    Joins are queued per guild (deduplicated by member) and flushed every
+    `flush_interval` seconds. When a guild sees `burst_threshold` joins within
+    `burst_window` seconds it enters lockdown: flushes slow to `lockdown_interval`,
+    so a raid is handled as a few large batches with one log line each rather
+    than thousands of individual events. The guild leaves lockdown once its join
+    rate stays under half the threshold for a full window.
+
+    `role_for(guild)` returns the role to add (or None); it runs in a worker thread
+    once per batch, so it may read the database. `should_skip(member)` filters out
+    members who are already verified; it runs on the event loop for every member,
+    so it must not block, but it can use anything `role_for` just loaded.
+    Role adds go through discord.py, which queues them per rate-limit bucket, so
+    `concurrency` only bounds how many are in flight.
+    """
+
+    def __init__(self, role_for, should_skip=None, flush_interval=0.5, lockdown_interval=3.0,
+                 burst_threshold=30, burst_window=10.0, concurrency=4, reason='New member: awaiting verification'):
+        self.role_for = role_for
+        self.should_skip = should_skip or (lambda member: False)
+        self.flush_interval = flush_interval
+        self.lockdown_interval = lockdown_interval
+        self.burst_threshold = burst_threshold
+        self.burst_window = burst_window
+        self.concurrency = concurrency
+        self.reason = reason
+        self._pending = {}       # guild_id -> {member_id: member}
+        self._recent = {}        # guild_id -> deque of join timestamps inside the burst window
+        self._lockdown = {}      # guild_id -> monotonic time of the last burst-level join
+        self._wakeup = None
+        self._task = None
+        self.counters = {'queued': 0, 'applied': 0, 'skipped': 0, 'failed': 0, 'batches': 0,
+                         'lockdowns': 0, 'max_backlog': 0}
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name='join-pipeline')
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def in_lockdown(self, guild_id):
+        return int(guild_id) in self._lockdown
+
+    @property
+    def backlog(self):
+        return sum(len(members) for members in self._pending.values())
+
+    def enqueue(self, member):
+        guild_id = member.guild.id
+        self._pending.setdefault(guild_id, {})[member.id] = member
+        self.counters['queued'] += 1
+        self.counters['max_backlog'] = max(self.counters['max_backlog'], self.backlog)
+        self._track_rate(guild_id)
+        if self._task is None:
+            self.start()
+        self._wakeup.set()
+
+    def _track_rate(self, guild_id):
+        now = time.monotonic()
+        recent = self._recent.setdefault(guild_id, deque())
+        recent.append(now)
+        while recent and recent[0] < now - self.burst_window:
+            recent.popleft()
+        if len(recent) >= self.burst_threshold:
+            if guild_id not in self._lockdown:
+                self.counters['lockdowns'] += 1
+                logger.warning('Join burst in guild %s: %d joins in %.0fs, switching to lockdown batching',
+                               guild_id, len(recent), self.burst_window)
+            self._lockdown[guild_id] = now
+
+    def _update_lockdowns(self):
+        now = time.monotonic()
+        for guild_id, since in list(self._lockdown.items()):
+            recent = self._recent.get(guild_id, ())
+            while recent and recent[0] < now - self.burst_window:
+                recent.popleft()
+            if now - since >= self.burst_window and len(recent) < self.burst_threshold / 2:
+                del self._lockdown[guild_id]
+                logger.info('Join burst in guild %s is over, leaving lockdown', guild_id)
+        for guild_id in [g for g, recent in self._recent.items() if not recent]:
+            del self._recent[guild_id]
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.lockdown_interval if self._lockdown else self.flush_interval)
+            self._wakeup.clear()
+            batch, self._pending = self._pending, {}
+            for guild_id, members in batch.items():
+                try:
+                    await self._apply(guild_id, list(members.values()))
+                except Exception:
+                    logger.exception('Join pipeline: batch for guild %s failed', guild_id)
+            self._update_lockdowns()
+            if self._pending:
+                self._wakeup.set()
+
+    async def _apply(self, guild_id, members):
+        guild = members[0].guild
+        role = await asyncio.to_thread(self.role_for, guild)
+        if role is None:
+            self.counters['skipped'] += len(members)
+            return
+        todo = []
+        for member in members:
+            current = guild.get_member(member.id) or member
+            if role in current.roles or self.should_skip(current):
+                self.counters['skipped'] += 1
+            else:
+                todo.append(current)
+
+        sem = asyncio.Semaphore(self.concurrency)
+        results = {'applied': 0, 'skipped': 0, 'failed': 0}
+        forbidden = False
+
+        async def one(member):
+            nonlocal forbidden
+            if forbidden:
+                results['failed'] += 1
+                return
+            async with sem:
+                try:
+                    await member.add_roles(role, reason=self.reason)
+                    results['applied'] += 1
+                except discord.NotFound:
+                    # left again before the batch ran
+                    results['skipped'] += 1
+                except discord.Forbidden as e:
+                    forbidden = True
+                    results['failed'] += 1
+                    logger.error('Join pipeline: cannot add %s in guild %s: %s', role, guild_id, e)
+                except discord.HTTPException as e:
+                    results['failed'] += 1
+                    logger.warning('Join pipeline: failed to add %s to %s: %s', role, member.id, e)
+
+        started = time.monotonic()
+        await asyncio.gather(*(one(m) for m in todo))
+        for key, value in results.items():
+            self.counters[key] += value
+        self.counters['batches'] += 1
+        level = logging.INFO if self.in_lockdown(guild_id) or len(members) > 1 else logging.DEBUG
+        logger.log(level, 'Join pipeline: guild %s batch of %d joins -> %d roles added, %d skipped, %d failed in %.1fs%s',
+                   guild_id, len(members), results['applied'], len(members) - len(todo) + results['skipped'],
+                   results['failed'], time.monotonic() - started, ' (lockdown)' if self.in_lockdown(guild_id) else '')
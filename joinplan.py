@@ -0,0 +1,95 @@
+import logging
+
+logger = logging.getLogger('oauth-verify')
+
+# Used until this process has seen real responses for the route
+DEFAULT_LATENCY = 0.3
+
+
+class JoinPlan:
+    """Who a bulk join would try to add to one guild, and how long it should take.
+
+    `live_users` is a records.UserTokens of the live stored users; `users` keeps
+    those who are not in `member_ids`.
+    """
+
+    def __init__(self, guild_id, stored, live_users, member_ids):
+        self.guild_id = guild_id
+        self.stored = stored
+        self.live = len(live_users)
+        self.expired = stored - self.live
+        self.users = live_users.without(member_ids)
+        self.already_members = self.live - len(self.users)
+        self.per_user = None
+        self.per_user_high = None
+        self.basis = {}
+
+    @property
+    def size(self):
+        return len(self.users)
+
+    @property
+    def eta(self):
+        return self.size * self.per_user if self.per_user is not None else None
+
+    @property
+    def eta_high(self):
+        return self.size * self.per_user_high if self.per_user_high is not None else None
+
+    def summary(self):
+        lines = [f'{self.stored} stored users: {self.expired} expired or revoked, '
+                 f'{self.already_members} already members, **{self.size} to add**']
+        if self.size and self.eta is not None:
+            lines.append(f'Estimated time: {format_duration(self.eta)} (up to {format_duration(self.eta_high)}), '
+                         f'{self.per_user:.2f}s per user')
+            lines.append('Based on: ' + ', '.join(f'{k} {v}' for k, v in self.basis.items()))
+        return '\n'.join(lines)
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f'{seconds}s'
+    if seconds < 3600:
+        return f'{seconds // 60}m {seconds % 60:02d}s'
+    return f'{seconds // 3600}h {seconds % 3600 // 60:02d}m'
+
+
+def estimate(plan, routes, limiter, client):
+    """Fill in `plan.per_user` (typical) and `plan.per_user_high` from what this process has learned.
+
+    `routes` are the route keys a bulk join sends per user, one after another
+    (member add, then role grant). A job runs users sequentially, so each user
+    costs the larger of the summed request latencies (p50, and p90 for the high
+    estimate) and the spacing the rate limits force: `window / limit` per request
+    for each learned Discord bucket (routes sharing a bucket add up) and one slot
+    of the shared global budget per request. Assumes nothing else is spending the
+    same budget while the job runs.
+    """
+    typical = high = 0.0
+    learned = 0
+    for route in routes:
+        stats = client.latency_stats(route)
+        if stats is None:
+            typical += DEFAULT_LATENCY
+            high += DEFAULT_LATENCY * 2
+        else:
+            learned += 1
+            typical += stats[1]
+            high += stats[2]
+    buckets = {}
+    for route in routes:
+        bucket = limiter.bucket(route)
+        if bucket is not None:
+            key, limit, window = bucket
+            _, _, spent = buckets.get(key, (limit, window, 0))
+            buckets[key] = (limit, window, spent + 1)
+    spacing = len(routes) / limiter.global_rate
+    plan.basis['global limit'] = f'{limiter.global_rate:g}/s'
+    for key, (limit, window, per_user) in buckets.items():
+        spacing = max(spacing, per_user * window / limit)
+        plan.basis[f'bucket {key.split(":")[0][:8]}'] = f'{limit} per {window:g}s'
+    plan.basis['latency'] = f'{typical * 1000:.0f}ms per user ({"learned" if learned == len(routes) else "partly assumed"})'
+    plan.per_user = max(typical, spacing)
+    plan.per_user_high = max(high, spacing)
+    return plan
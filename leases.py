@@ -0,0 +1,172 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger('oauth-verify')
+
+
+def default_owner_id():
+    """Unique per process run, so a restarted replica never mistakes an old lease for its own."""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+class LeaseManager:
+    """Leader election over the `leases` table in a SQLite database shared by replicas.
+
+    Each lease name is owned by at most one replica at a time. A background thread
+    renews held leases every `renew_interval` seconds and tries to take over wanted
+    ones whose holder stopped renewing, so failover takes at most `ttl` plus one
+    renewal interval. Every change of ownership increments the lease's fencing
+    token; work that writes on behalf of a lease goes through `fenced()`, which
+    refuses the write once a newer holder exists, so a paused or partitioned
+    former leader cannot clobber the new one's rows.
+    """
+
+    def __init__(self, db_path, names, owner_id=None, ttl=15.0, renew_interval=5.0):
+        if renew_interval >= ttl:
+            raise ValueError('renew_interval must be shorter than ttl')
+        self.db_path = db_path
+        self.names = tuple(names)
+        self.owner_id = owner_id or default_owner_id()
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self._held = {}          # name -> (fencing_token, local monotonic expiry)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=self.ttl / 3, isolation_level=None)
+
+    def start(self):
+        """Make a first acquisition attempt synchronously, then keep leases alive in the background."""
+        self.tick()
+        self._thread = threading.Thread(target=self._run, name='lease-heartbeat', daemon=True)
+        self._thread.start()
+
+    def stop(self, release=True):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.renew_interval + 1)
+        if release:
+            for name in list(self._held):
+                self.release(name)
+
+    def _run(self):
+        while not self._stop.wait(self.renew_interval):
+            try:
+                self.tick()
+            except sqlite3.Error as e:
+                # can't reach the store: stop claiming leadership before the lease could pass to someone else
+                logger.warning('Lease heartbeat failed: %s', e)
+                self._expire_local()
+
+    def _expire_local(self):
+        now = time.monotonic()
+        with self._lock:
+            for name, (_, expires) in list(self._held.items()):
+                if expires <= now:
+                    del self._held[name]
+                    logger.warning('Lease %s lapsed locally (heartbeat failing)', name)
+
+    def tick(self):
+        """Renew or acquire every configured lease once."""
+        for name in self.names:
+            self.acquire(name)
+
+    def acquire(self, name):
+        """Take or renew `name`; returns the fencing token, or None when another replica holds it."""
+        started = time.monotonic()
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT owner, fencing_token, expires_at FROM leases WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                token = 1
+                conn.execute('INSERT INTO leases (name, owner, fencing_token, expires_at) VALUES (?, ?, ?, ?)',
+                             (name, self.owner_id, token, now + self.ttl))
+            elif row[0] == self.owner_id:
+                token = row[1]
+                conn.execute('UPDATE leases SET expires_at = ? WHERE name = ?', (now + self.ttl, name))
+            elif row[2] <= now:
+                token = row[1] + 1
+                conn.execute('UPDATE leases SET owner = ?, fencing_token = ?, expires_at = ? WHERE name = ?',
+                             (self.owner_id, token, now + self.ttl, name))
+            else:
+                conn.execute('COMMIT')
+                self._lose(name)
+                return None
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        with self._lock:
+            previous = self._held.get(name)
+            # measured from before the round trip, so the local view expires no later than the row
+            self._held[name] = (token, started + self.ttl)
+        if previous is None or previous[0] != token:
+            logger.info('Acquired lease %s (fencing token %d) as %s', name, token, self.owner_id)
+        return token
+
+    def _lose(self, name):
+        with self._lock:
+            lost = self._held.pop(name, None)
+        if lost is not None:
+            logger.warning('Lost lease %s to another replica', name)
+
+    def release(self, name):
+        with self._lock:
+            held = self._held.pop(name, None)
+        if held is None:
+            return
+        conn = self._connect()
+        try:
+            # expire it now so a standby takes over on its next heartbeat instead of after the ttl
+            conn.execute('UPDATE leases SET expires_at = 0 WHERE name = ? AND owner = ? AND fencing_token = ?',
+                         (name, self.owner_id, held[0]))
+        finally:
+            conn.close()
+        logger.info('Released lease %s', name)
+
+    def holds(self, name):
+        """True while this replica holds `name` (checked locally; no database access)."""
+        with self._lock:
+            held = self._held.get(name)
+            return held is not None and held[1] > time.monotonic()
+
+    def token(self, name):
+        with self._lock:
+            held = self._held.get(name)
+            return held[0] if held is not None and held[1] > time.monotonic() else None
+
+    def fenced(self, name, token, sql, params=()):
+        """Run one write only if `token` is still the current fencing token for `name`.
+
+        Returns False (writing nothing) when ownership has moved on since `token`
+        was issued.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT owner, fencing_token FROM leases WHERE name = ?', (name,)).fetchone()
+            if row is None or row[0] != self.owner_id or row[1] != token:
+                conn.execute('ROLLBACK')
+                self._lose(name)
+                return False
+            conn.execute(sql, params)
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
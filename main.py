@@ -1,20 +1,53 @@
 import os
+import io
+import gzip
+import json
+import signal
+import socket
+import sys
 import threading
 import asyncio
 import sqlite3
 import time
-import json
 import logging
+from bisect import bisect_right
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from urllib.parse import urlencode, quote
 
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from flask import Flask, redirect, request, render_template_string
+from flask import Flask, redirect, request, render_template_string, url_for
+from werkzeug.serving import make_server
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 
+import admission
+from backups import BackupStore
+import events
+from callbackcache import RedemptionCache, TTLCache
+from circuit import ApiClient, BreakerRegistry, CircuitOpenError, RetryPolicy
+from joinpipeline import JoinPipeline
+import joinplan
+import records
+from leases import LeaseManager
+from membercache import MemberCachePolicy
+from reconcile import Reconciler
+from restore import RestoreEngine, plan_restore
+from sampler import SamplingProfiler
+from tokencheck import validate_tokens
+from migrations import import_legacy_verification_db, migrate
+from notifier import WebhookNotifier
+from progress import ProgressBoard, ProgressReporter
+from writebehind import WriteBehindBuffer
+from storage import DONE, FAILED, PENDING, RUNNING, SQLiteStorage
+from sharedlimits import SharedRateLimiter, route_key
+from sharding import ShardMetrics, make_bot, owns_global_work, owns_guild, parse_shard_ids
+from workqueue import WorkQueue
+
 load_dotenv()
 
 # Logging setup
@@ -35,83 +68,341 @@ RULES_ROLE_ID = os.getenv('RULES_ROLE_ID') or ''
 RULES_CHANNEL_ID = os.getenv('RULES_CHANNEL_ID') or '1446650751865585694'
 VERIFY_CHANNEL_ID = os.getenv('VERIFY_CHANNEL_ID') or '1446115772307996723'
 MEMBER_ROLE_ID = os.getenv('MEMBER_ROLE_ID') or '1446133334068432936'
-
-DB_PATH = os.path.join(os.path.dirname(__file__), 'tokens.db')
+# full | lazy | roles | index — see membercache.py
+MEMBER_CACHE_MODE = os.getenv('MEMBER_CACHE_MODE') or 'full'
+# Sharding: SHARD_COUNT=<n>|auto enables AutoShardedBot; SHARD_IDS=0-3 runs a subset in this process
+SHARD_COUNT = os.getenv('SHARD_COUNT') or ''
+SHARD_IDS = parse_shard_ids(os.getenv('SHARD_IDS') or '')
+SHARD_METRICS_INTERVAL = float(os.getenv('SHARD_METRICS_INTERVAL', '30'))
+
+# Only sqlite (tokens.db): token validation, leases, the callback cache and bot.py read tokens.db directly,
+# so the in-process MemoryStorage would split the data; it is for bench.py and tests
+STORAGE_BACKEND = (os.getenv('STORAGE_BACKEND') or 'sqlite').lower()
+if STORAGE_BACKEND != 'sqlite':
+    raise SystemExit(f'STORAGE_BACKEND={STORAGE_BACKEND} is not supported by the bot; use sqlite')
+DB_PATH = os.getenv('DB_PATH') or os.path.join(os.path.dirname(__file__), 'tokens.db')
+# Verification store that bot.py kept before it moved into tokens.db; imported once if present
+LEGACY_VERIFY_DB_PATH = os.getenv('LEGACY_VERIFY_DB_PATH') or 'linked_users.db'
+BACKUP_DIR = os.getenv('BACKUP_DIR') or os.path.join(os.path.dirname(__file__), 'backups')
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '20'))
+BACKUP_MAX_AGE_DAYS = float(os.getenv('BACKUP_MAX_AGE_DAYS', '0')) or None
+RESTORE_CONCURRENCY = int(os.getenv('RESTORE_CONCURRENCY', '4'))
+TOKEN_VALIDATION_TTL = int(os.getenv('TOKEN_VALIDATION_TTL', '86400'))
+TOKEN_VALIDATION_RPS = float(os.getenv('TOKEN_VALIDATION_RPS', '20'))
+TOKEN_VALIDATION_CONCURRENCY = int(os.getenv('TOKEN_VALIDATION_CONCURRENCY', '8'))
+# Admission control on /login and /callback
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', '1') != '0'
+ADMISSION_PER_IP_RATE = float(os.getenv('ADMISSION_PER_IP_RATE', '1'))
+ADMISSION_PER_IP_BURST = int(os.getenv('ADMISSION_PER_IP_BURST', '5'))
+ADMISSION_GLOBAL_RATE = float(os.getenv('ADMISSION_GLOBAL_RATE', '50'))
+ADMISSION_GLOBAL_BURST = int(os.getenv('ADMISSION_GLOBAL_BURST', '100'))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '32'))
+ADMISSION_TRUST_FORWARDED = os.getenv('ADMISSION_TRUST_FORWARDED', '0') == '1'
+CALLBACK_CACHE_SIZE = int(os.getenv('CALLBACK_CACHE_SIZE', '10000'))
+CALLBACK_CACHE_TTL = int(os.getenv('CALLBACK_CACHE_TTL', '600'))
+# WEB_WORKERS > 1 forks that many web processes sharing PORT; they share callback outcomes through
+# tokens.db and hand post-join work (member role, audit posts) to the bot process through its work_queue
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '1'))
+WORK_QUEUE_POLL = float(os.getenv('WORK_QUEUE_POLL', '1'))
+WORK_QUEUE_BATCH = int(os.getenv('WORK_QUEUE_BATCH', '10'))
+# A web worker that exits is restarted after this many seconds (longer when it keeps crashing)
+WEB_WORKER_RESTART_DELAY = float(os.getenv('WEB_WORKER_RESTART_DELAY', '1'))
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '256'))
+WRITE_BATCH_DELAY = float(os.getenv('WRITE_BATCH_DELAY', '0.05'))
+GUILD_CONFIG_CACHE_TTL = int(os.getenv('GUILD_CONFIG_CACHE_TTL', '300'))
+# New members get the Unverified role through a batching pipeline (JOIN_PIPELINE=0 disables it)
+JOIN_PIPELINE_ENABLED = os.getenv('JOIN_PIPELINE', '1') != '0'
+JOIN_FLUSH_INTERVAL = float(os.getenv('JOIN_FLUSH_INTERVAL', '0.5'))
+JOIN_LOCKDOWN_INTERVAL = float(os.getenv('JOIN_LOCKDOWN_INTERVAL', '3'))
+JOIN_BURST_THRESHOLD = int(os.getenv('JOIN_BURST_THRESHOLD', '30'))
+JOIN_BURST_WINDOW = float(os.getenv('JOIN_BURST_WINDOW', '10'))
+JOIN_CONCURRENCY = int(os.getenv('JOIN_CONCURRENCY', '4'))
+# Role reconciler: seconds between runs (0 disables), members scanned per run, role edits per run
+RECONCILE_INTERVAL = float(os.getenv('RECONCILE_INTERVAL', '900'))
+RECONCILE_BATCH = int(os.getenv('RECONCILE_BATCH', '5000'))
+RECONCILE_MAX_CHANGES = int(os.getenv('RECONCILE_MAX_CHANGES', '200'))
+RECONCILE_REMOVE_EXTRA = os.getenv('RECONCILE_REMOVE_EXTRA', '0') == '1'
+# Leader election between replicas sharing tokens.db: one replica runs each singleton task
+LEADER_ELECTION = os.getenv('LEADER_ELECTION', '1') != '0'
+LEASE_TTL = float(os.getenv('LEASE_TTL', '15'))
+LEASE_RENEW_INTERVAL = float(os.getenv('LEASE_RENEW_INTERVAL', '5'))
+# Replicas compete only with processes running the same shards
+LEASE_SCOPE = os.getenv('LEASE_SCOPE') or ('shards-' + ','.join(map(str, SHARD_IDS)) if SHARD_IDS else 'all')
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '5'))
+JOB_CHECKPOINT_EVERY = int(os.getenv('JOB_CHECKPOINT_EVERY', '25'))
+# Live progress messages of bulk jobs are edited at most this often (seconds)
+PROGRESS_EDIT_INTERVAL = float(os.getenv('PROGRESS_EDIT_INTERVAL', '15'))
+# Audit events (verifications, join failures, bulk jobs) are posted here in batches
+RULES_WEBHOOK_URL = os.getenv('RULES_WEBHOOK_URL') or ''
+NOTIFY_FLUSH_INTERVAL = float(os.getenv('NOTIFY_FLUSH_INTERVAL', '5'))
+NOTIFY_BUFFER = int(os.getenv('NOTIFY_BUFFER', '1000'))
+# Bot-token REST calls from every thread and process on this host share one rate-limit budget kept here
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB') or os.path.join(os.path.dirname(DB_PATH), 'ratelimits.db')
+RATE_LIMIT_GLOBAL_RPS = float(os.getenv('RATE_LIMIT_GLOBAL_RPS', '45'))
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '10'))
+# Per-endpoint circuit breakers and retries for Discord REST calls
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', '5'))
+BREAKER_WINDOW = float(os.getenv('BREAKER_WINDOW', '30'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '10'))
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv('BREAKER_MAX_OPEN_SECONDS', '120'))
+RETRY_ATTEMPTS = int(os.getenv('RETRY_ATTEMPTS', '4'))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '0.25'))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '4'))
+DISCORD_REQUEST_DEADLINE = float(os.getenv('DISCORD_REQUEST_DEADLINE', '15'))
+# /profile: longest allowed run and the default sampling interval; below 5ms the sampler's
+# own stack walks become a noticeable share of the CPU it is measuring
+PROFILE_MAX_SECONDS = max(1, int(os.getenv('PROFILE_MAX_SECONDS', '60')))
+PROFILE_MIN_INTERVAL_MS = 5
+PROFILE_INTERVAL_MS = max(PROFILE_MIN_INTERVAL_MS, float(os.getenv('PROFILE_INTERVAL_MS', '5')))
 
 OAUTH_AUTHORIZE = 'https://discord.com/api/oauth2/authorize'
-OAUTH_TOKEN_URL = 'https://discord.com/api/oauth2/token'
-API_BASE = 'https://discord.com/api'
+# DISCORD_API_BASE points REST calls elsewhere, e.g. at the fake API in `bench.py api-faults`
+API_BASE = (os.getenv('DISCORD_API_BASE') or 'https://discord.com/api').rstrip('/')
+OAUTH_TOKEN_URL = f'{API_BASE}/oauth2/token'
+
+# Startup tuning
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))
+HTTP_WARM_CONNECTIONS = int(os.getenv('HTTP_WARM_CONNECTIONS', '2'))
+STARTUP_READY_TARGET = float(os.getenv('STARTUP_READY_TARGET', '3.0'))
 
 app = Flask(__name__)
 
+# Shared keep-alive pool for every Discord REST call made from the web tier and the bot
+http = requests.Session()
+http.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+
+
+def discord_request(method, url, max_wait=RATE_LIMIT_MAX_WAIT, **kwargs):
+    """Discord REST call through `discord_api`: breakers, retries and, for Bot-token calls, the shared budget.
+
+    Raises CircuitOpenError while the endpoint's breaker is open, TimeoutError when
+    no rate-limit slot frees up within `max_wait` (None waits as long as it takes),
+    and the last `requests` error when every attempt failed without a response.
+    """
+    return discord_api.request(method, url, max_wait=max_wait, **kwargs)
+
+
+# What a Discord call raises when the API is down, failing or out of budget
+DISCORD_UNAVAILABLE = (CircuitOpenError, TimeoutError, requests.RequestException)
+
+
+def outage_page(retry_after, restart=False):
+    """Friendly 503 while Discord is failing; `restart` sends the visitor back through /login (their code is spent)."""
+    retry_after = max(5, int(retry_after))
+    return admission.retry_response(retry_after, 'Discord is having trouble right now. Nothing was lost.',
+                                    url=url_for('login') if restart else None)
+
+
+class StartupProfiler:
+    """Records wall-clock durations of the startup phases and logs a one-off report.
+
+    Phases may overlap (they run concurrently), so offsets are reported relative to
+    process start rather than summed.
+    """
+
+    def __init__(self, ready_target):
+        self.ready_target = ready_target
+        self._t0 = time.perf_counter()
+        self._open = {}
+        self._phases = []
+        self._milestones = {}
+        self._lock = threading.Lock()
+        self._reported = False
+
+    def elapsed(self):
+        return time.perf_counter() - self._t0
+
+    def begin(self, name):
+        with self._lock:
+            self._open.setdefault(name, self.elapsed())
+
+    def end(self, name):
+        now = self.elapsed()
+        with self._lock:
+            start = self._open.pop(name, None)
+            if start is not None:
+                self._phases.append((name, start, now - start))
+
+    @contextmanager
+    def phase(self, name):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def timed(self, name, fn, *args):
+        """Wrap `fn(*args)` in a phase; handy for `asyncio.to_thread`."""
+        def _run():
+            with self.phase(name):
+                return fn(*args)
+        return _run
+
+    def mark(self, name):
+        with self._lock:
+            self._milestones.setdefault(name, self.elapsed())
+
+    def report(self):
+        with self._lock:
+            if self._reported:
+                return
+            self._reported = True
+            phases = sorted(self._phases, key=lambda p: p[1])
+            milestones = dict(self._milestones)
+        lines = ['Startup report (offsets relative to process start):']
+        for name, start, duration in phases:
+            lines.append(f'  {name:<16} start={start * 1000:8.1f}ms  took={duration * 1000:8.1f}ms')
+        for name, at in sorted(milestones.items(), key=lambda m: m[1]):
+            lines.append(f'  * {name:<14} at {at * 1000:8.1f}ms')
+        logger.info('\n'.join(lines))
+        ready = milestones.get('callbacks_ready')
+        if ready is None:
+            logger.warning('Startup: web tier never reported ready to serve callbacks')
+        elif ready > self.ready_target:
+            logger.warning('Startup: ready to serve callbacks after %.2fs (target %.2fs)', ready, self.ready_target)
+        else:
+            logger.info('Startup: ready to serve callbacks after %.2fs (target %.2fs)', ready, self.ready_target)
+
+
+profiler = StartupProfiler(STARTUP_READY_TARGET)
+
+backup_store = BackupStore(BACKUP_DIR)
+restore_engine = RestoreEngine(concurrency=RESTORE_CONCURRENCY)
+
+# Group-commit writer for per-callback rows; created by init_db() once the schema is current
+writer = None
+db_ready = threading.Event()
+# Singleton tasks: startup command sync, the role reconciler, bulk jobs and member-join handling
+SINGLETON_TASKS = ('startup', 'reconciler', 'bulk-jobs', 'member-events')
+leases = LeaseManager(DB_PATH, [f'{LEASE_SCOPE}:{task}' for task in SINGLETON_TASKS],
+                      ttl=LEASE_TTL, renew_interval=LEASE_RENEW_INTERVAL)
+leases_started = threading.Event()
+
+redemptions = RedemptionCache(maxsize=CALLBACK_CACHE_SIZE, ttl=CALLBACK_CACHE_TTL)
+# Persistence for tokens, guild config, jobs and events; SQLite writes use the write-behind buffer from init_db
+store = SQLiteStorage(DB_PATH, timeout=30)
+work_queue = WorkQueue(DB_PATH)
+POST_JOIN, AUDIT = 'post_join', 'audit'
+# Set in forked web worker processes (0..WEB_WORKERS-1); None in the bot process
+web_worker_index = None
+web_supervisor_pid = None
+rate_limits = SharedRateLimiter(RATE_LIMIT_DB, global_rate=RATE_LIMIT_GLOBAL_RPS)
+breakers = BreakerRegistry(failure_threshold=BREAKER_FAILURES, window=BREAKER_WINDOW,
+                           open_for=BREAKER_OPEN_SECONDS, max_open_for=BREAKER_MAX_OPEN_SECONDS)
+discord_api = ApiClient(http, breakers, RetryPolicy(attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                                                    max_delay=RETRY_MAX_DELAY, deadline=DISCORD_REQUEST_DEADLINE),
+                        limiter=rate_limits)
+notifier = WebhookNotifier(RULES_WEBHOOK_URL, max_buffer=NOTIFY_BUFFER, flush_interval=NOTIFY_FLUSH_INTERVAL)
+# guild_config only changes through save_guild_config in this process, which invalidates the entry
+guild_configs = TTLCache(maxsize=10000, ttl=GUILD_CONFIG_CACHE_TTL)
+
+admission_control = admission.AdmissionController(
+    per_ip_rate=ADMISSION_PER_IP_RATE, per_ip_burst=ADMISSION_PER_IP_BURST,
+    global_rate=ADMISSION_GLOBAL_RATE, global_burst=ADMISSION_GLOBAL_BURST,
+    max_in_flight=ADMISSION_MAX_IN_FLIGHT)
+if ADMISSION_ENABLED:
+    admission.install(app, admission_control, ('login', 'callback'), trust_forwarded=ADMISSION_TRUST_FORWARDED)
+
+
+def connect_db():
+    # Several shard processes may share tokens.db, so wait on locks instead of failing fast
+    return sqlite3.connect(DB_PATH, timeout=30)
+
 
 def init_db():
+    global writer
     logger.info('Initializing database at %s', DB_PATH)
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id TEXT PRIMARY KEY,
-        access_token TEXT,
-        token_type TEXT,
-        scope TEXT,
-        expires_at INTEGER
-    )
-    ''')
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS guild_config (
-        guild_id TEXT PRIMARY KEY,
-        verify_channel_id TEXT,
-        unverified_role_id TEXT,
-        rules_role_id TEXT
-    )
-    ''')
-    conn.commit()
-    conn.close()
-    logger.info('Database initialized (tables ensured)')
+    conn = connect_db()
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        applied = migrate(conn)
+        if GUILD_ID.isdigit():
+            import_legacy_verification_db(conn, LEGACY_VERIFY_DB_PATH, int(GUILD_ID))
+    finally:
+        conn.close()
+    if writer is None:
+        writer = WriteBehindBuffer(DB_PATH, max_batch=WRITE_BATCH_SIZE, max_delay=WRITE_BATCH_DELAY)
+        if WEB_WORKERS > 1:
+            redemptions.share_via(connect_db, writer)
+            work_queue.writer = writer
+        store.attach_writer(writer)
+    logger.info('Database initialized (schema migrations applied: %s)', applied or 'none')
+    db_ready.set()
+
+
+def start_leases():
+    """Join leader election once the leases table exists (blocking)."""
+    if LEADER_ELECTION:
+        db_ready.wait()
+        leases.start()
+    leases_started.set()
+
+
+def is_leader(task):
+    """True when this replica should run singleton `task` (always, without leader election)."""
+    return not LEADER_ELECTION or leases.holds(f'{LEASE_SCOPE}:{task}')
+
+
+def checkpoint_job(job_id, status, progress, token):
+    """Persist job progress, fenced by the bulk-jobs lease token; False if leadership moved on."""
+    if LEADER_ELECTION:
+        return leases.fenced(f'{LEASE_SCOPE}:bulk-jobs', token,
+                             'UPDATE jobs SET status = ?, progress = ?, updated_at = ? WHERE id = ?',
+                             (status, json.dumps(progress), int(time.time()), int(job_id)))
+    store.update_job(job_id, status=status, progress=progress)
+    return True
 
 
 def save_token(user_id, access_token, token_type, scope, expires_in):
     expires_at = int(time.time()) + int(expires_in)
     logger.debug('Saving token for user %s (expires in %s seconds)', user_id, expires_in)
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('REPLACE INTO users (user_id, access_token, token_type, scope, expires_at) VALUES (?,?,?,?,?)',
-                (str(user_id), access_token, token_type, scope, expires_at))
-    conn.commit()
-    conn.close()
+    # Concurrent callbacks share one commit; the store waits for it so the token is durable before we answer
+    # A token fresh from the OAuth exchange is known-good, so it starts validated
+    store.save_token(user_id, access_token, token_type, scope, expires_at, validated_at=int(time.time()))
     logger.info('Saved token for user %s', user_id)
 
 
 def get_all_users():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('SELECT user_id, access_token FROM users')
-    rows = cur.fetchall()
-    conn.close()
+    rows = store.all_users()
     logger.debug('Fetched %d stored authorized users', len(rows))
     return rows
 
 
+def get_live_users():
+    """Stored users whose token has not expired and has not failed validation."""
+    rows = store.live_users()
+    logger.debug('Fetched %d live authorized users', len(rows))
+    return rows
+
+
+def get_verified_ids(guild_id):
+    """IDs verified in `guild_id`: OAuth-linked users for the main guild plus `verified` rows."""
+    return store.verified_ids(guild_id, include_oauth_users=str(guild_id) == str(GUILD_ID))
+
+
+def count_live_tokens():
+    return store.count_live_tokens()
+
+
+def read_event_stats(guild_id):
+    return store.event_stats(guild_id)
+
+
 def save_guild_config(guild_id, verify_channel_id=None, unverified_role_id=None, rules_role_id=None):
     logger.info('Saving guild config for guild %s: verify=%s unverified=%s rules=%s', guild_id, verify_channel_id, unverified_role_id, rules_role_id)
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('REPLACE INTO guild_config (guild_id, verify_channel_id, unverified_role_id, rules_role_id) VALUES (?,?,?,?)',
-                (str(guild_id), verify_channel_id, unverified_role_id, rules_role_id))
-    conn.commit()
-    conn.close()
+    store.save_guild_config(guild_id, verify_channel_id, unverified_role_id, rules_role_id)
+    guild_configs.discard(int(guild_id))
     logger.debug('Guild config saved for %s', guild_id)
 
 
 def get_guild_config(guild_id):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('SELECT verify_channel_id, unverified_role_id, rules_role_id FROM guild_config WHERE guild_id = ?', (str(guild_id),))
-    row = cur.fetchone()
-    conn.close()
+    cached = guild_configs.get(int(guild_id))
+    if cached is not None:
+        return cached
+    row = store.get_guild_config(guild_id)
     logger.debug('Loaded guild config for %s: %s', guild_id, row)
-    return row or (None, None, None)
+    guild_configs.set(int(guild_id), row)
+    return row
 
 
 def make_oauth_url(state=None):
@@ -140,6 +431,8 @@ class ManualVerifyButton(discord.ui.Button):
         self.unverified_role_id = unverified_role_id
 
     async def callback(self, interaction: discord.Interaction):
+        # answer within Discord's 3 seconds; the role edits and the database write may take longer
+        await interaction.response.defer(ephemeral=True, thinking=True)
         guild = interaction.guild
         member = interaction.user
         # Resolve role ids: prefer db-config, then env MEMBER_ROLE_ID
@@ -180,9 +473,16 @@ class ManualVerifyButton(discord.ui.Button):
                 await member.add_roles(member_role, reason='Manual verify button')
             if unverified_role and unverified_role in member.roles:
                 await member.remove_roles(unverified_role, reason='Manual verify button')
-            await interaction.response.send_message('✅ Verified (manual).', ephemeral=True)
+            member_cache.remember(member, granted_role_ids=[member_role.id] if member_role else ())
+            # the reconciler treats member-role holders without a verified row as drift
+            await asyncio.to_thread(store.add_verified, guild.id, member.id)
+            notifier.notify('verified', f'<@{member.id}> verified with the manual button in {guild.name}')
+            store.record_event(events.VERIFIED, guild.id, member.id, {'via': 'button'})
+            if member_role:
+                store.record_event(events.ROLE_GRANTED, guild.id, member.id)
+            await interaction.followup.send('✅ Verified (manual).', ephemeral=True)
         except Exception as e:
-            await interaction.response.send_message(f'Failed to assign roles: {e}', ephemeral=True)
+            await interaction.followup.send(f'Failed to assign roles: {e}', ephemeral=True)
 
 
 @app.route('/')
@@ -404,6 +704,57 @@ def verify():
     return render_template_string(RULES_HTML, oauth_url=oauth_url)
 
 
+def render_callback_page(messages):
+    return f'''
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Verification Successful</title>
+        <style>
+            body {{
+                font-family: Arial, sans-serif;
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                display: flex;
+                align-items: center;
+                justify-content: center;
+                min-height: 100vh;
+                margin: 0;
+            }}
+            .box {{
+                background: white;
+                padding: 40px;
+                border-radius: 12px;
+                text-align: center;
+                box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
+            }}
+            .box h1 {{
+                color: #27ae60;
+                margin: 0 0 20px 0;
+            }}
+            .box p {{
+                color: #555;
+                line-height: 1.6;
+                margin: 10px 0;
+            }}
+            .checkmark {{
+                font-size: 48px;
+                color: #27ae60;
+                margin-bottom: 20px;
+            }}
+        </style>
+    </head>
+    <body>
+        <div class="box">
+            <div class="checkmark">✓</div>
+            <h1>Verification Successful!</h1>
+            {'<p>' + '</p><p>'.join(messages) + '</p>'}
+            <p>You can now close this window and enjoy the server!</p>
+        </div>
+    </body>
+    </html>
+    '''
+
+
 @app.route('/callback')
 def callback():
     error = request.args.get('error')
@@ -416,6 +767,20 @@ def callback():
         logger.warning('OAuth callback invoked with no code')
         return 'No code provided', 400
 
+    # Refreshes, double clicks and prefetchers replay the same code; answer them from cache
+    cached = redemptions.outcome(code)
+    if cached is not None:
+        logger.debug('Callback for an already redeemed code; serving cached outcome')
+        return render_callback_page(cached)
+
+    with redemptions.redeeming(code) as concurrent_outcome:
+        if concurrent_outcome is not None:
+            return render_callback_page(concurrent_outcome)
+        store.record_event(events.CALLBACK)
+        return redeem_code(code)
+
+
+def redeem_code(code):
     # Exchange code for token
     data = {
         'client_id': CLIENT_ID,
@@ -425,9 +790,22 @@ def callback():
         'redirect_uri': REDIRECT_URI
     }
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    r = requests.post(OAUTH_TOKEN_URL, data=data, headers=headers)
+    try:
+        # a code can only be redeemed once, so only retry attempts that never reached Discord
+        r = discord_request('POST', OAUTH_TOKEN_URL, idempotent=False, data=data, headers=headers)
+    except DISCORD_UNAVAILABLE as e:
+        logger.warning('Token exchange unavailable: %s', e)
+        return outage_page(getattr(e, 'retry_after', BREAKER_OPEN_SECONDS))
+    if r.status_code >= 500:
+        logger.warning('Token exchange failed with %s; showing the retry page', r.status_code)
+        return outage_page(BREAKER_OPEN_SECONDS)
     if r.status_code != 200:
+        # another worker may have redeemed this code a moment ago
+        cached = redemptions.outcome(code, wait=2.0 if WEB_WORKERS > 1 else 0.0)
+        if cached is not None:
+            return render_callback_page(cached)
         logger.error('Token exchange failed: %s', r.text)
+        store.record_event(events.EXCHANGE_FAILED, detail={'status': r.status_code})
         return f"Token exchange failed: {r.text}", 400
     token_data = r.json()
     access_token = token_data.get('access_token')
@@ -436,7 +814,13 @@ def callback():
     expires_in = token_data.get('expires_in', 0)
 
     # Get user identity
-    me = requests.get(f'{API_BASE}/users/@me', headers={'Authorization': f'Bearer {access_token}'})
+    try:
+        me = discord_request('GET', f'{API_BASE}/users/@me', headers={'Authorization': f'Bearer {access_token}'})
+    except DISCORD_UNAVAILABLE as e:
+        logger.warning('User lookup unavailable: %s', e)
+        return outage_page(getattr(e, 'retry_after', BREAKER_OPEN_SECONDS), restart=True)
+    if me.status_code >= 500:
+        return outage_page(BREAKER_OPEN_SECONDS, restart=True)
     if me.status_code != 200:
         logger.error('Failed to get user info: %s', me.text)
         return f"Failed to get user info: {me.text}", 400
@@ -448,88 +832,377 @@ def callback():
 
     messages = []
 
+    if redemptions.recently_joined(user_id, GUILD_ID):
+        logger.debug('User %s joined guild %s moments ago; skipping duplicate member add', user_id, GUILD_ID)
+        messages.append('✓ You have joined the server!')
+        redemptions.remember_outcome(code, messages)
+        return render_callback_page(messages)
+
     # Try to add user to guild using guilds.join scope
     add_url = f'{API_BASE}/guilds/{GUILD_ID}/members/{user_id}'
     add_payload = {'access_token': access_token}
     add_headers = {'Authorization': f'Bot {BOT_TOKEN}', 'Content-Type': 'application/json'}
-    add_resp = requests.put(add_url, json=add_payload, headers=add_headers)
+    try:
+        add_resp = discord_request('PUT', add_url, json=add_payload, headers=add_headers)
+    except DISCORD_UNAVAILABLE as e:
+        logger.warning('Member add for %s deferred: %s', user_id, e)
+        return outage_page(getattr(e, 'retry_after', BREAKER_OPEN_SECONDS), restart=True)
+    if add_resp.status_code >= 500:
+        logger.warning('Member add for %s failed with %s; showing the retry page', user_id, add_resp.status_code)
+        return outage_page(BREAKER_OPEN_SECONDS, restart=True)
     if add_resp.status_code in (201, 204):
         logger.info('User %s successfully added to guild %s via OAuth join', user_id, GUILD_ID)
         messages.append('✓ You have joined the server!')
 
-        # Assign member role (1446133334068432936)
-        if MEMBER_ROLE_ID:
-            role_url = f'{API_BASE}/guilds/{GUILD_ID}/members/{user_id}/roles/{MEMBER_ROLE_ID}'
-            role_resp = requests.put(role_url, headers={'Authorization': f'Bot {BOT_TOKEN}'})
-            if role_resp.status_code in (204,):
-                messages.append('✓ Member role assigned.')
+        if web_worker_index is not None:
+            # the bot process assigns the member role and posts the audit event
+            work_queue.put(POST_JOIN, {'guild_id': int(GUILD_ID), 'user_id': int(user_id)})
+            if MEMBER_ROLE_ID:
+                messages.append('✓ Your member role is being assigned.')
+        else:
+            # Assign member role (1446133334068432936)
+            if MEMBER_ROLE_ID:
+                role_status = grant_member_role(GUILD_ID, user_id)
+                if role_status == 204:
+                    messages.append('✓ Member role assigned.')
+                record_role_grant(GUILD_ID, user_id, role_status)
+            notifier.notify('verified', f'<@{user_id}> verified through OAuth and joined')
+        redemptions.remember_join(user_id, GUILD_ID)
+        store.record_event(events.VERIFIED, GUILD_ID, user_id, {'via': 'oauth'})
+        store.record_event(events.JOINED, GUILD_ID, user_id)
     else:
         logger.warning('Failed to add user %s to guild %s: %s %s', user_id, GUILD_ID, add_resp.status_code, add_resp.text)
+        audit('join_failed', f'<@{user_id}> OAuth join failed: HTTP {add_resp.status_code}')
+        store.record_event(events.JOIN_FAILED, GUILD_ID, user_id, {'status': add_resp.status_code})
         messages.append(f'Error joining server: {add_resp.status_code} {add_resp.text}')
 
-    success_html = f'''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Verification Successful</title>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                min-height: 100vh;
-                margin: 0;
-            }}
-            .box {{
-                background: white;
-                padding: 40px;
-                border-radius: 12px;
-                text-align: center;
-                box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
-            }}
-            .box h1 {{
-                color: #27ae60;
-                margin: 0 0 20px 0;
-            }}
-            .box p {{
-                color: #555;
-                line-height: 1.6;
-                margin: 10px 0;
-            }}
-            .checkmark {{
-                font-size: 48px;
-                color: #27ae60;
-                margin-bottom: 20px;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="box">
-            <div class="checkmark">✓</div>
-            <h1>Verification Successful!</h1>
-            {'<p>' + '</p><p>'.join(messages) + '</p>'}
-            <p>You can now close this window and enjoy the server!</p>
-        </div>
-    </body>
-    </html>
-    '''
-    return success_html
+    # the code is spent now, so any replay gets this outcome
+    redemptions.remember_outcome(code, messages)
+    return render_callback_page(messages)
+
+
+def grant_member_role(guild_id, user_id):
+    """Give `user_id` MEMBER_ROLE_ID; returns the HTTP status, or 0 when Discord could not be reached."""
+    role_url = f'{API_BASE}/guilds/{guild_id}/members/{user_id}/roles/{MEMBER_ROLE_ID}'
+    try:
+        return discord_request('PUT', role_url, headers={'Authorization': f'Bot {BOT_TOKEN}'}).status_code
+    except DISCORD_UNAVAILABLE as e:
+        # the role reconciler grants it on its next pass
+        logger.warning('Member role for %s not assigned: %s', user_id, e)
+        return 0
+
+
+def record_role_grant(guild_id, user_id, status):
+    if status == 204:
+        store.record_event(events.ROLE_GRANTED, guild_id, user_id)
+    else:
+        store.record_event(events.ROLE_FAILED, guild_id, user_id, {'status': status})
+
+
+def audit(kind, text):
+    """`notifier.notify()` from any process; web workers pass the event on to the bot process."""
+    if web_worker_index is None:
+        notifier.notify(kind, text)
+    elif notifier.enabled:
+        work_queue.put(AUDIT, {'kind': kind, 'text': text})
+
+
+def handle_work_item(kind, payload, attempt):
+    """Run one item queued by a web worker (in the bot process); False asks for a retry."""
+    if kind == AUDIT:
+        notifier.notify(payload['kind'], payload['text'])
+        return True
+    if kind == POST_JOIN:
+        guild_id, user_id = payload['guild_id'], payload['user_id']
+        if MEMBER_ROLE_ID:
+            status = grant_member_role(guild_id, user_id)
+            if (status == 0 or status >= 500) and attempt < work_queue.max_attempts:
+                return False
+            record_role_grant(guild_id, user_id, status)
+        notifier.notify('verified', f'<@{user_id}> verified through OAuth and joined')
+        return True
+    logger.error('Dropping work item of unknown kind %r', kind)
+    return True
 
 
 def run_flask():
-    init_db()
+    """Prepare the database, bind the web port and serve callbacks (blocking).
+
+    The socket accepts connections as soon as it is bound, so callbacks are served
+    while the gateway is still connecting.
+    """
+    with profiler.phase('db_init'):
+        init_db()
     port = int(os.getenv('PORT', '5000'))
     logger.info('Starting Flask webserver on port %s', port)
-    app.run(host='0.0.0.0', port=port)
+    with profiler.phase('web_bind'):
+        server = make_server('0.0.0.0', port, app, threaded=True)
+    profiler.mark('callbacks_ready')
+    server.serve_forever()
+
+
+def web_listen_socket(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(('0.0.0.0', port))
+    sock.listen(128)
+    return sock
+
+
+def run_web_worker(index, port, shared_socket, ready_fd):
+    """Body of a forked web worker: serve callbacks until SIGTERM, then flush buffered writes and exit."""
+    global web_worker_index
+    web_worker_index = index
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    code = 0
+    try:
+        init_db()
+        sock = shared_socket or web_listen_socket(port)
+        server = make_server('0.0.0.0', port, app, threaded=True, fd=sock.fileno())
+        if ready_fd is not None:
+            os.write(ready_fd, b'.')
+        server.serve_forever()
+    except SystemExit:
+        pass
+    except Exception:
+        logger.exception('Web worker %d crashed', index)
+        code = 1
+    finally:
+        if writer is not None:
+            writer.close()
+        os._exit(code)
+
+
+def start_web_workers(count):
+    """Fork the web supervisor, which runs `count` web worker processes on PORT; returns its pid.
+
+    Each worker binds its own SO_REUSEPORT socket so the kernel spreads new
+    connections across them (where SO_REUSEPORT is missing they all accept from one
+    socket bound by the supervisor). Must run before the bot and the write-behind
+    buffer start: a forked child keeps only the thread that forked it, which is
+    also why workers are forked, and re-forked, by the single-threaded supervisor
+    rather than by this process. `callbacks_ready` is marked once every worker is listening.
+    """
+    port = int(os.getenv('PORT', '5000'))
+    ready_r, ready_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(ready_r)
+        supervise_web_workers(count, port, ready_w)
+    os.close(ready_w)
+    threading.Thread(target=_await_web_workers, args=(ready_r, count), name='web-workers', daemon=True).start()
+    return pid
+
+
+def supervise_web_workers(count, port, ready_fd, stop_timeout=8.0):
+    """Body of the web supervisor: keep `count` workers running until SIGTERM, then stop them.
+
+    A worker that exits is logged with the capacity left and forked again after
+    WEB_WORKER_RESTART_DELAY seconds, doubling (up to a minute) while it keeps dying
+    within a minute of starting. On SIGTERM the workers get SIGTERM, and SIGKILL
+    after `stop_timeout` seconds. Ctrl-C is left to the bot process, which stops us.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    shared_socket = None if hasattr(socket, 'SO_REUSEPORT') else web_listen_socket(port)
+    workers = {}                         # pid -> (index, started)
+    delays = [WEB_WORKER_RESTART_DELAY] * count
+    stopping = []
+
+    def spawn(index, ready):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+            run_web_worker(index, port, shared_socket, ready)
+        workers[pid] = (index, time.monotonic())
+
+    def stop(*_):
+        stopping.append(True)
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        signal.alarm(max(1, int(stop_timeout)))
+
+    def kill(*_):
+        for pid in list(workers):
+            logger.warning('Web worker %s did not exit; killing it', pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGALRM, kill)
+    code = 0
+    try:
+        for index in range(count):
+            spawn(index, ready_fd)
+        # restarted workers don't report readiness
+        os.close(ready_fd)
+        logger.info('Started %d web workers on port %s (pids %s)', count, port, ', '.join(map(str, workers)))
+        while workers:
+            pid, status = os.wait()
+            index, started = workers.pop(pid, (None, None))
+            if index is None or stopping:
+                continue
+            logger.error('Web worker %d (pid %s) exited with status %s; %d of %d workers serving',
+                         index, pid, os.waitstatus_to_exitcode(status), len(workers), count)
+            lived = time.monotonic() - started
+            delays[index] = WEB_WORKER_RESTART_DELAY if lived >= 60 else min(60.0, delays[index] * 2)
+            restart_at = time.monotonic() + delays[index]
+            while not stopping and time.monotonic() < restart_at:
+                time.sleep(0.1)
+            if not stopping:
+                spawn(index, None)
+                logger.info('Restarted web worker %d', index)
+    except Exception:
+        logger.exception('Web supervisor failed')
+        kill()
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def _await_web_workers(ready_fd, count):
+    ready = 0
+    while ready < count:
+        chunk = os.read(ready_fd, count - ready)
+        if not chunk:
+            logger.error('Only %d of %d web workers started', ready, count)
+            break
+        ready += len(chunk)
+    else:
+        profiler.mark('callbacks_ready')
+    os.close(ready_fd)
+
+
+def stop_web_workers(supervisor_pid, timeout=10.0):
+    """SIGTERM the web supervisor (which stops its workers) and reap it; SIGKILL it after `timeout` seconds."""
+    try:
+        os.kill(supervisor_pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    deadline = time.monotonic() + timeout
+    try:
+        while os.waitpid(supervisor_pid, os.WNOHANG) == (0, 0):
+            if time.monotonic() >= deadline:
+                logger.warning('Web supervisor %s did not exit; killing it', supervisor_pid)
+                os.kill(supervisor_pid, signal.SIGKILL)
+                os.waitpid(supervisor_pid, 0)
+                break
+            time.sleep(0.05)
+    except ChildProcessError:
+        pass
+
+
+def warm_http_pool():
+    """Open a few keep-alive connections to Discord so the first callbacks skip the TLS handshake."""
+    def _touch(_):
+        try:
+            http.get(f'{API_BASE}/gateway', timeout=10)
+        except Exception as e:
+            logger.debug('HTTP warm-up request failed: %s', e)
+
+    with ThreadPoolExecutor(max_workers=max(1, HTTP_WARM_CONNECTIONS)) as pool:
+        list(pool.map(_touch, range(max(1, HTTP_WARM_CONNECTIONS))))
+
+
+# quick guild visibility check to provide clearer diagnostics
+def check_guild_visibility():
+    if not GUILD_ID or GUILD_ID.startswith('PLACEHOLDER'):
+        print('Skipping guild check: GUILD_ID is a placeholder or missing in .env')
+        return
+    if not BOT_TOKEN or BOT_TOKEN.startswith('PLACEHOLDER'):
+        print('Skipping guild check: BOT_TOKEN is a placeholder or missing in .env')
+        return
+    try:
+        resp = discord_request('GET', f'{API_BASE}/guilds/{GUILD_ID}', headers={'Authorization': f'Bot {BOT_TOKEN}'})
+    except Exception as e:
+        print(f'Guild check failed (network/error): {e}')
+        return
+    if resp.status_code == 200:
+        print(f'Bot can access guild {GUILD_ID} — OK.')
+    elif resp.status_code == 404:
+        print('\nERROR: 404 Unknown Guild — the bot cannot see the configured guild id.')
+        print('Possible causes:')
+        print('- `GUILD_ID` is incorrect (copy the server ID using Developer Mode).')
+        print('- The bot is not a member of that guild (invite the bot to the server).')
+        print('- The `BOT_TOKEN` used belongs to a different application than the `CLIENT_ID` you used for OAuth. Use the bot token for the same application.')
+        print('- The bot may have been removed from the server.')
+        print('\nTo test manually, run:')
+        print(f'  curl -H "Authorization: Bot <your bot token>" https://discord.com/api/guilds/{GUILD_ID}')
+        print('If that returns 404, fix the bot/guild membership or GUILD_ID before retrying.')
+    else:
+        print(f'Guild check returned {resp.status_code}: {resp.text}')
 
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.guilds = True
 intents.members = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+
+
+def configured_role_ids(guild):
+    """Roles whose holders stay cached in the `roles` member cache mode."""
+    ids = set()
+    try:
+        _, unverified_role_id, rules_role_id = get_guild_config(guild.id)
+    except Exception:
+        unverified_role_id, rules_role_id = None, None
+    for role_id in (unverified_role_id, rules_role_id, MEMBER_ROLE_ID):
+        if role_id and str(role_id).isdigit():
+            ids.add(int(role_id))
+    return ids
+
+
+def unverified_role_for(guild):
+    try:
+        _, unverified_role_id, _ = get_guild_config(guild.id)
+    except Exception:
+        logger.exception('Could not load guild config for %s', guild.id)
+        return None
+    return guild.get_role(int(unverified_role_id)) if unverified_role_id else None
+
+
+def already_verified(member):
+    """True for members the OAuth callback just added, or who already hold a verified role.
+
+    Runs on the event loop for every queued join, so it reads only the cached guild
+    config that `unverified_role_for` loaded for the batch, never the database.
+    """
+    if redemptions.recently_joined(member.id, member.guild.id, shared=False):
+        return True
+    _, unverified_role_id, rules_role_id = guild_configs.get(member.guild.id) or (None, None, None)
+    verified_ids = {int(role_id) for role_id in (rules_role_id, MEMBER_ROLE_ID)
+                    if role_id and str(role_id).isdigit() and str(role_id) != str(unverified_role_id)}
+    return any(role.id in verified_ids for role in member.roles)
+
+
+def verification_roles_for(guild):
+    """`(member_role, unverified_role)` for `guild`, as the manual verify button resolves them."""
+    try:
+        _, unverified_role_id, rules_role_id = get_guild_config(guild.id)
+    except Exception:
+        unverified_role_id, rules_role_id = None, None
+    member_role_id = rules_role_id or (MEMBER_ROLE_ID if str(MEMBER_ROLE_ID).isdigit() else None)
+    member_role = guild.get_role(int(member_role_id)) if member_role_id else None
+    unverified_role = guild.get_role(int(unverified_role_id)) if unverified_role_id else None
+    return member_role, unverified_role
+
+
+join_pipeline = JoinPipeline(
+    unverified_role_for, should_skip=already_verified, flush_interval=JOIN_FLUSH_INTERVAL,
+    lockdown_interval=JOIN_LOCKDOWN_INTERVAL, burst_threshold=JOIN_BURST_THRESHOLD,
+    burst_window=JOIN_BURST_WINDOW, concurrency=JOIN_CONCURRENCY)
+member_cache = MemberCachePolicy(MEMBER_CACHE_MODE, tracked_roles=configured_role_ids)
+bot = make_bot(SHARD_COUNT, SHARD_IDS, command_prefix='!', intents=intents, **member_cache.bot_options(intents))
+shard_metrics = ShardMetrics()
+reconciler = Reconciler(
+    member_cache, lambda guild: get_verified_ids(guild.id), verification_roles_for,
+    batch_size=RECONCILE_BATCH, max_changes=RECONCILE_MAX_CHANGES, remove_extra=RECONCILE_REMOVE_EXTRA)
 # Remove the default help command so we can register a custom `!help` command
 try:
     bot.remove_command('help')
@@ -537,9 +1210,20 @@ except Exception:
     pass
 
 
+@bot.event
+async def on_connect():
+    profiler.end('gateway_connect')
+    profiler.begin('cache_warmup')
+
+
 @bot.event
 async def on_ready():
     logger.info('Bot ready. Logged in as %s (ID: %s)', bot.user, bot.user.id)
+    profiler.end('cache_warmup')
+    profiler.mark('gateway_ready')
+    if member_cache.uses_index:
+        for guild in bot.guilds:
+            asyncio.create_task(member_cache.warm(guild))
 
     # Auto-setup verification system on first ready (DISABLED - use /setup command instead)
     # Uncomment the block below if you want auto-setup on every bot start
@@ -594,23 +1278,42 @@ async def on_ready():
 
 
     # Sync commands globally and to all guilds for instant updates
-    logger.info('Syncing global slash commands...')
-    try:
-        await bot.tree.sync()
-        logger.info('✓ Global commands synced.')
-    except Exception as e:
-        logger.exception('Global sync failed: %s', e)
+    if not sample_shard_metrics.is_running():
+        sample_shard_metrics.start()
+    if RECONCILE_INTERVAL > 0 and not reconcile_roles.is_running():
+        reconcile_roles.start()
+    if not run_pending_jobs.is_running():
+        run_pending_jobs.start()
+    if WEB_WORKERS > 1 and not drain_work_queue.is_running():
+        drain_work_queue.start()
+
+    profiler.begin('command_sync')
+    await asyncio.to_thread(leases_started.wait, LEASE_TTL)
+    if not is_leader('startup'):
+        logger.info('Skipping command sync: another replica holds the startup lease')
+    else:
+        if owns_global_work(bot):
+            logger.info('Syncing global slash commands...')
+            try:
+                await bot.tree.sync()
+                logger.info('✓ Global commands synced.')
+            except Exception as e:
+                logger.exception('Global sync failed: %s', e)
+        else:
+            logger.info('Skipping global command sync: shard 0 is owned by another process')
 
-    logger.info('Syncing instant per-guild commands...')
-    synced = 0
-    for guild in bot.guilds:
-        try:
-            await bot.tree.sync(guild=guild)
-            synced += 1
-            logger.info('Instant-synced commands to %s (%s)', guild.name, guild.id)
-        except Exception as e:
-            logger.exception('Failed to sync to guild %s: %s', guild.id, e)
-    logger.info('Finished syncing slash commands to %d guild(s).', synced)
+        logger.info('Syncing instant per-guild commands...')
+        synced = 0
+        for guild in bot.guilds:
+            try:
+                await bot.tree.sync(guild=guild)
+                synced += 1
+                logger.info('Instant-synced commands to %s (%s)', guild.name, guild.id)
+            except Exception as e:
+                logger.exception('Failed to sync to guild %s: %s', guild.id, e)
+        logger.info('Finished syncing slash commands to %d guild(s).', synced)
+    profiler.end('command_sync')
+    profiler.report()
 
     # Auto-grant startup task is DISABLED
     # If you want to restore roles for a specific user on startup, uncomment below and set AUTOGRANT_ID env var
@@ -643,6 +1346,79 @@ async def on_ready():
     #     bot.loop.create_task(_auto_grant())
 
 
+@bot.event
+async def on_shard_ready(shard_id):
+    logger.info('Shard %s ready (%d guilds)', shard_id, sum(1 for g in bot.guilds if g.shard_id == shard_id))
+
+
+@bot.event
+async def on_shard_disconnect(shard_id):
+    logger.warning('Shard %s disconnected', shard_id)
+
+
+@bot.event
+async def on_shard_resumed(shard_id):
+    logger.info('Shard %s resumed', shard_id)
+
+
+@tasks.loop(seconds=SHARD_METRICS_INTERVAL)
+async def sample_shard_metrics():
+    shard_metrics.sample()
+
+
+@bot.event
+async def on_socket_event_type(event_type):
+    shard_metrics.record_event()
+
+
+@tasks.loop(seconds=max(RECONCILE_INTERVAL, 60))
+async def reconcile_roles():
+    if not is_leader('reconciler'):
+        return
+    for guild in list(bot.guilds):
+        try:
+            report = await reconciler.run(guild)
+            if report.fixed or report.failed:
+                notifier.notify('bulk_job', f'Role reconcile in {guild.name}: {report.summary()}')
+        except Exception:
+            logger.exception('Role reconcile failed for guild %s', guild.id)
+
+
+@reconcile_roles.before_loop
+async def _before_reconcile():
+    await bot.wait_until_ready()
+    # let the startup member cache warm-up finish first
+    await asyncio.sleep(60)
+
+
+@bot.event
+async def on_member_join(member):
+    member_cache.remember(member)
+    if JOIN_PIPELINE_ENABLED and not member.bot and is_leader('member-events'):
+        join_pipeline.enqueue(member)
+
+
+@bot.event
+async def on_member_update(before, after):
+    member_cache.remember(after)
+
+
+@bot.event
+async def on_socket_raw_receive(msg):
+    # only enabled (enable_debug_events) in the `roles` member cache mode
+    update = member_cache.member_update_from_gateway(msg)
+    if update is not None:
+        guild_id, user_id, role_ids = update
+        guild = bot.get_guild(guild_id)
+        if guild is not None:
+            await member_cache.member_updated(guild, user_id, role_ids)
+
+
+@bot.event
+async def on_raw_member_remove(payload):
+    member_cache.forget(payload.guild_id, payload.user.id)
+
+
 # Slash Commands
 
 @bot.tree.command(name="setup", description="Create or configure verification channels and roles")
@@ -745,77 +1521,214 @@ async def verify_cmd(interaction: discord.Interaction):
 
 
 
+def capture_guild_records(guild):
+    """Snapshot roles and channels of `guild` as plain dicts (runs on the event loop, no I/O)."""
+    records = []
+    for role in guild.roles:
+        if role == guild.default_role:
+            continue
+        records.append({
+            "kind": "role",
+            "id": role.id,
+            "name": role.name,
+            "permissions": role.permissions.value,
+            "color": role.color.value,
+            "position": role.position,
+            "hoist": role.hoist,
+            "mentionable": role.mentionable
+        })
+
+    for channel in guild.channels:
+        channel_data = {
+            "kind": "channel",
+            "id": channel.id,
+            "name": channel.name,
+            "type": str(channel.type),
+            "position": channel.position,
+            "parent_id": channel.category_id,
+            "permissions": {}
+        }
+        # Store permission overwrites
+        for target, overwrite in channel.overwrites.items():
+            target_type = "role" if isinstance(target, discord.Role) else "user"
+            channel_data["permissions"][f"{target_type}_{target.id}"] = {
+                "allow": overwrite.pair()[0].value,
+                "deny": overwrite.pair()[1].value
+            }
+        records.append(channel_data)
+    return records
+
+
 @bot.tree.command(name="backup", description="Backup server data (roles, channels, permissions)")
 async def backup_server(interaction: discord.Interaction):
-    """Backup all server roles, channels, and permissions to a JSON file."""
+    """Write a compressed, deduplicated snapshot of the server's roles, channels and permissions."""
     await interaction.response.defer(thinking=True)
-    
+
     try:
         guild = interaction.guild
         if not guild:
             await interaction.followup.send("This command can only be used in a server.", ephemeral=True)
             return
-        
-        backup_data = {
-            "guild_name": guild.name,
-            "guild_id": guild.id,
-            "backup_date": datetime.now().isoformat(),
-            "roles": [],
-            "channels": []
-        }
-        
-        # Backup roles
-        for role in guild.roles:
-            if role == guild.default_role:
-                continue
-            role_data = {
-                "id": role.id,
-                "name": role.name,
-                "permissions": role.permissions.value,
-                "color": role.color.value,
-                "position": role.position,
-                "hoist": role.hoist,
-                "mentionable": role.mentionable
-            }
-            backup_data["roles"].append(role_data)
-        
-        # Backup channels and their permissions
-        for channel in guild.channels:
-            channel_data = {
-                "id": channel.id,
-                "name": channel.name,
-                "type": str(channel.type),
-                "position": channel.position,
-                "permissions": {}
-            }
-            
-            # Store permission overwrites
-            for target, overwrite in channel.overwrites.items():
-                target_type = "role" if isinstance(target, discord.Role) else "user"
-                channel_data["permissions"][f"{target_type}_{target.id}"] = {
-                    "allow": overwrite.pair()[0].value,
-                    "deny": overwrite.pair()[1].value
-                }
-            
-            backup_data["channels"].append(channel_data)
-        
-        # Save to file
-        backup_filename = f"backup_{guild.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        with open(backup_filename, 'w') as f:
-            json.dump(backup_data, f, indent=2)
-        
+
+        header = {"guild_name": guild.name, "guild_id": guild.id, "backup_date": datetime.now().isoformat()}
+        records = capture_guild_records(guild)
+        # hashing, compression and file I/O stay off the event loop
+        info = await asyncio.to_thread(backup_store.write_snapshot, guild.id, header, records)
+        removed, _ = await asyncio.to_thread(backup_store.apply_retention, guild.id, BACKUP_KEEP, BACKUP_MAX_AGE_DAYS)
+
         await interaction.followup.send(
-            f"✓ Backup created: {backup_filename}\n"
-            f"- Roles backed up: {len(backup_data['roles'])}\n"
-            f"- Channels backed up: {len(backup_data['channels'])}",
+            f"✓ Backup created: {info['name']} ({info['bytes']:,} bytes compressed)\n"
+            f"- Roles backed up: {info['counts'].get('role', 0)}\n"
+            f"- Channels backed up: {info['counts'].get('channel', 0)}\n"
+            f"- New objects stored: {info['new_objects']} (unchanged since earlier backups: {info['reused_objects']})"
+            + (f"\n- Old backups pruned: {removed}" if removed else ""),
             ephemeral=True
         )
-        print(f"Backup saved: {backup_filename}")
+        logger.info('Backup saved for guild %s: %s (%d new objects)', guild.id, info['name'], info['new_objects'])
     except Exception as e:
         await interaction.followup.send(f"Backup failed: {e}", ephemeral=True)
 
 
- 
+@bot.tree.command(name="backups", description="List stored server backups")
+@app_commands.default_permissions(administrator=True)
+async def backups_cmd(interaction: discord.Interaction):
+    """List this server's snapshots, newest first."""
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    guild = interaction.guild
+    if not guild:
+        await interaction.followup.send("This command can only be used in a server.", ephemeral=True)
+        return
+
+    def _describe_all():
+        return [backup_store.describe(guild.id, name) for name in reversed(backup_store.list_snapshots(guild.id))]
+
+    snapshots = await asyncio.to_thread(_describe_all)
+    if not snapshots:
+        await interaction.followup.send("No backups stored for this server.", ephemeral=True)
+        return
+    lines = [f"Backups for {guild.name} (keeping {BACKUP_KEEP}):"]
+    for snap in snapshots[:20]:
+        lines.append(f"- `{snap['name']}` — {snap['counts'].get('role', 0)} roles, "
+                     f"{snap['counts'].get('channel', 0)} channels, {snap['bytes']:,} bytes")
+    await interaction.followup.send("\n".join(lines), ephemeral=True)
+
+
+@bot.tree.command(name="backup_diff", description="Show what changed between two backups")
+@app_commands.describe(older="Older snapshot name (default: second newest)", newer="Newer snapshot name (default: newest)")
+@app_commands.default_permissions(administrator=True)
+async def backup_diff_cmd(interaction: discord.Interaction, older: str = None, newer: str = None):
+    """Compare two snapshots of this server by role/channel id."""
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    guild = interaction.guild
+    if not guild:
+        await interaction.followup.send("This command can only be used in a server.", ephemeral=True)
+        return
+
+    names = await asyncio.to_thread(backup_store.list_snapshots, guild.id)
+    newer = newer or (names[-1] if names else None)
+    older = older or (names[-2] if len(names) > 1 else None)
+    if not older or not newer:
+        await interaction.followup.send("Need at least two backups to compare.", ephemeral=True)
+        return
+    if older not in names or newer not in names:
+        await interaction.followup.send("Unknown snapshot name; see `/backups`.", ephemeral=True)
+        return
+
+    diff = await asyncio.to_thread(backup_store.diff, guild.id, older, newer)
+    lines = [f"Changes from `{older}` to `{newer}`:"]
+    for label, symbol in (("added", "+"), ("removed", "-"), ("changed", "~")):
+        for entry in diff[label][:25]:
+            lines.append(f"{symbol} {entry['kind']} {entry['name']} ({entry['id']})")
+        if len(diff[label]) > 25:
+            lines.append(f"{symbol} ... and {len(diff[label]) - 25} more {label}")
+    if len(lines) == 1:
+        lines.append("No differences.")
+    await interaction.followup.send("\n".join(lines)[:2000], ephemeral=True)
+
+
+async def is_admin_of(guild_id, user_id):
+    """True when `user_id` is a member with Administrator in guild `guild_id` (which the bot must be in)."""
+    source = bot.get_guild(guild_id)
+    if source is None:
+        return False
+    member = source.get_member(user_id)
+    if member is None:
+        try:
+            member = await source.fetch_member(user_id)
+        except discord.HTTPException:
+            return False
+    return member.guild_permissions.administrator
+
+
+@bot.tree.command(name="restore", description="Restore roles and channels from a backup")
+@app_commands.describe(snapshot="Snapshot name from /backups (default: newest)", dry_run="Only show the plan and time estimate", source_guild_id="Guild the backup was taken from (default: this server)")
+@app_commands.default_permissions(administrator=True)
+async def restore_cmd(interaction: discord.Interaction, snapshot: str = None, dry_run: bool = True, source_guild_id: str = None):
+    """Recreate missing roles, categories and channels from a snapshot, in dependency order."""
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    guild = interaction.guild
+    if not guild:
+        await interaction.followup.send("This command can only be used in a server.", ephemeral=True)
+        return
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.followup.send("You need Administrator to restore backups.", ephemeral=True)
+        return
+
+    source_id = int(source_guild_id) if source_guild_id and source_guild_id.isdigit() else guild.id
+    if source_id != guild.id and not await is_admin_of(source_id, interaction.user.id):
+        # backups hold another server's roles, channels and permissions
+        await interaction.followup.send("You need Administrator in the source server to restore its backups.", ephemeral=True)
+        return
+    names = await asyncio.to_thread(backup_store.list_snapshots, source_id)
+    snapshot = snapshot or (names[-1] if names else None)
+    if snapshot not in names:
+        await interaction.followup.send("No such backup; see `/backups`.", ephemeral=True)
+        return
+
+    records = await asyncio.to_thread(lambda: list(backup_store.iter_records(source_id, snapshot)))
+    plan = plan_restore(guild, source_id, records)
+    eta = plan.estimate_seconds(restore_engine.costs, restore_engine.concurrency)
+    lines = [f"Restore plan from `{snapshot}`: {plan.summary()}.",
+             f"Estimated time: ~{eta:.0f}s ({plan.operations} create calls, up to {restore_engine.concurrency} in flight)."]
+    for record, why in plan.skipped[:10]:
+        lines.append(f"- skipped {record['name']}: {why}")
+    if dry_run or not plan.operations:
+        lines.append("Dry run: nothing was changed." if dry_run else "Nothing to restore.")
+        await interaction.followup.send("\n".join(lines), ephemeral=True)
+        return
+
+    await interaction.followup.send("\n".join(lines) + "\nStarting restore...", ephemeral=True)
+    logger.info('Restore of %s into guild %s started by %s: %s', snapshot, guild.id, interaction.user, plan.summary())
+    results = await restore_engine.execute(guild, plan, reason=f'Restore of {snapshot} by {interaction.user}')
+    created = results['created']
+    summary = (f"✓ Restore finished in {results['seconds']:.0f}s: {created['role']} roles, "
+               f"{created['category']} categories, {created['channel']} channels created; "
+               f"{len(results['failed'])} failures.")
+    if results['failed']:
+        summary += "\n" + "\n".join(f"- {kind} {name}: {err}" for kind, name, err in results['failed'][:10])
+    logger.info('Restore of %s into guild %s finished: %s', snapshot, guild.id, created)
+    notifier.notify('bulk_job', f"Restore of {snapshot} into {guild.name} by {interaction.user}: "
+                                f"{sum(created.values())} created, {len(results['failed'])} failed")
+    try:
+        await interaction.followup.send(summary[:2000], ephemeral=True)
+    except discord.HTTPException:
+        # the interaction token may have expired during a long restore
+        await interaction.channel.send(summary[:2000])
+
+
+@bot.tree.command(name="shards", description="Show per-shard latency and guild count, and the gateway event rate")
+@app_commands.default_permissions(manage_guild=True)
+async def shards_cmd(interaction: discord.Interaction):
+    """Report gateway health for the shards run by this process."""
+    rows = shard_metrics.snapshot(bot)
+    lines = [f'Shards in this process (total shard count: {bot.shard_count or 1}), '
+             f'{shard_metrics.events_per_sec:.2f} gateway events/s:']
+    for row in rows:
+        latency = f"{row['latency_ms']}ms" if row['latency_ms'] is not None else 'n/a'
+        state = 'closed' if row['closed'] else 'open'
+        lines.append(f"Shard {row['shard_id']}: {state}, latency {latency}, {row['guilds']} guilds")
+    await interaction.response.send_message('\n'.join(lines), ephemeral=True)
+
 
 @bot.tree.command(name="grantall", description="Assign all roles to a user")
 @app_commands.describe(user="The user to grant roles to")
@@ -824,8 +1737,10 @@ async def grantall_cmd(interaction: discord.Interaction, user: discord.User):
     await interaction.response.defer(thinking=True)
     
     try:
-        member = await interaction.guild.fetch_member(user.id)
-    except:
+        member = await member_cache.get_member(interaction.guild, user.id)
+    except Exception:
+        member = None
+    if member is None:
         await interaction.followup.send("User not found in this server.", ephemeral=True)
         return
     
@@ -838,42 +1753,416 @@ async def grantall_cmd(interaction: discord.Interaction, user: discord.User):
         f'✗ Failures: {len(summary["failures"])}'
     ]
     if summary['failures']:
-        summary_lines.append('Failures: ' + ', '.join([f'{n}' for n, _ in summary['failures']]))
+        summary_lines.append('Failures: ' + ', '.join(f'{o.name} ({o.reason})' for o in summary['failures']))
     
     await interaction.followup.send('\n'.join(summary_lines), ephemeral=True)
 
 
+def join_stored_user(join_requests, user_id, access_token):
+    """Add one stored user to the guild of `join_requests` (a records.JoinRequests) and give them the
+    member role (blocking). Returns the HTTP status.
+
+    Raises CircuitOpenError while member adds to the guild are failing.
+    """
+    # bulk jobs have no user waiting on them, so they queue for the shared budget as long as needed
+    add_resp = discord_request('PUT', join_requests.member_url(user_id), max_wait=None,
+                               json={'access_token': access_token}, headers=join_requests.headers)
+    if add_resp.status_code in (201, 204) and join_requests.role_suffix:
+        try:
+            discord_request('PUT', join_requests.role_url(user_id), max_wait=None, headers=join_requests.headers)
+        except DISCORD_UNAVAILABLE:
+            pass
+    return add_resp.status_code
+
+
+# ids of jobs running in this process
+active_jobs = set()
+# Live progress messages of jobs, fed by run_join_job here or by watch_job from another replica's checkpoints
+progress_board = ProgressBoard()
+watched_jobs = set()
+
+
+def job_title(job):
+    return f"{job['payload'].get('via', job['kind'])} job #{job['id']} for guild {job['guild_id']}"
+
+
+def publish_join_progress(job_id, progress, note=None):
+    if note is None and progress.get('paused_until'):
+        note = f"Paused until <t:{progress['paused_until']}:T>: Discord API failing"
+    progress_board.publish(job_id, progress.get('added', 0) + progress.get('failed', 0), progress.get('total', 0),
+                           {'added': progress.get('added', 0), 'failed': progress.get('failed', 0),
+                            'already members': progress.get('already_members', 0)}, note)
+
+
+async def watch_job(job_id):
+    """Report a job running elsewhere (another replica, or not started yet) from its checkpoints.
+
+    Stops once the job finishes, nobody watches it any more, or it starts running
+    in this process, whose run_join_job then reports it directly.
+    """
+    if job_id in watched_jobs:
+        return
+    watched_jobs.add(job_id)
+    try:
+        while progress_board.watched(job_id) and job_id not in active_jobs:
+            job = await asyncio.to_thread(store.get_job, job_id)
+            if job is None:
+                await progress_board.finish(job_id, 'The job no longer exists.', f'Job #{job_id}')
+                return
+            progress_board.track(job_id, job_title(job))
+            publish_join_progress(job_id, job['progress'],
+                                  'Queued; the replica running bulk jobs will start it.' if job['status'] == PENDING else None)
+            if job['status'] in (DONE, FAILED):
+                await progress_board.finish(job_id, None if job['status'] == DONE else 'The job failed.')
+                return
+            await asyncio.sleep(PROGRESS_EDIT_INTERVAL)
+    finally:
+        watched_jobs.discard(job_id)
+
+
+async def start_reporter(interaction, text):
+    """Post the progress message for `interaction` and return its reporter."""
+    message = await interaction.followup.send(text, ephemeral=True, wait=True)
+    return ProgressReporter.for_interaction(interaction, message, min_interval=PROGRESS_EDIT_INTERVAL)
+
+
+def join_routes(guild_id):
+    """Route keys a bulk join sends per user, as the rate limiter and latency stats know them."""
+    member_url = f'{API_BASE}/guilds/{guild_id}/members/{"1" * 18}'
+    routes = [route_key('PUT', member_url)]
+    if MEMBER_ROLE_ID and MEMBER_ROLE_ID.isdigit():
+        routes.append(route_key('PUT', f'{member_url}/roles/{MEMBER_ROLE_ID}'))
+    return routes
+
+
+async def plan_join(guild_id, count_stored=False):
+    """JoinPlan of the live stored users a bulk join into `guild_id` would add (those not members yet).
+
+    Only reads: the member list comes from the member cache (streaming it
+    if needed), nothing is sent to the members endpoint.
+    """
+    guild = bot.get_guild(int(guild_id))
+    member_ids = await member_cache.member_ids(guild) if guild is not None else set()
+    live = await asyncio.to_thread(lambda: records.UserTokens.from_rows(get_live_users()))
+    stored = len(await asyncio.to_thread(get_all_users)) if count_stored else len(live)
+    return joinplan.JoinPlan(int(guild_id), stored, live, member_ids)
+
+
+async def run_join_job(job):
+    """Add every live stored user to the job's guild, in user-id order.
+
+    Progress (`last_user_id` and counters) is checkpointed every JOB_CHECKPOINT_EVERY
+    users under the bulk-jobs fencing token, so after a failover the new leader
+    resumes where the last checkpoint left off. Users who are already members are
+    skipped (re-adding one would be a no-op that still costs rate budget). While the member-add circuit breaker is open the job pauses
+    (checkpointing `paused_until`) and retries the same user once it half-opens.
+    Returns the final progress, or None if leadership was lost.
+    """
+    token = leases.token(f'{LEASE_SCOPE}:bulk-jobs') if LEADER_ELECTION else 0
+    guild_id = job['guild_id']
+    via = job['payload'].get('via', 'join_all')
+    progress = dict({'added': 0, 'failed': 0, 'last_user_id': 0}, **job['progress'])
+    plan = await plan_join(guild_id)
+    # fixed on the first run: on resume, users this job already added are members and drop out of the plan
+    progress.setdefault('total', plan.size)
+    progress.setdefault('already_members', plan.already_members)
+    if progress['last_user_id']:
+        left = len(plan.users) - bisect_right(plan.users.ids, progress['last_user_id'])
+        logger.info('Resuming job %s (%s) for guild %s: %d of %d users left', job['id'], via, guild_id, left, progress['total'])
+    requests_for_job = records.JoinRequests(API_BASE, guild_id, BOT_TOKEN,
+                                            MEMBER_ROLE_ID if MEMBER_ROLE_ID and MEMBER_ROLE_ID.isdigit() else None)
+    if not await asyncio.to_thread(checkpoint_job, job['id'], RUNNING, progress, token):
+        return None
+    progress_board.track(job['id'], job_title(job))
+    publish_join_progress(job['id'], progress)
+
+    for i, (user_id, access_token) in enumerate(plan.users.after(progress['last_user_id']), 1):
+        while True:
+            try:
+                status = await asyncio.to_thread(join_stored_user, requests_for_job, user_id, access_token)
+                break
+            except CircuitOpenError as e:
+                pause = e.retry_after
+            except (TimeoutError, requests.RequestException) as e:
+                status = 0
+                logger.warning('%s: adding user %s to guild %s failed: %s', via, user_id, guild_id, e)
+                break
+            if 'paused_until' not in progress:
+                logger.warning('Job %s paused: Discord member adds are failing', job['id'])
+                notifier.notify('bulk_job', f"{via} job #{job['id']} for guild {guild_id} paused: Discord API failing")
+            progress['paused_until'] = int(time.time() + pause)
+            if not await asyncio.to_thread(checkpoint_job, job['id'], RUNNING, progress, token):
+                return None
+            publish_join_progress(job['id'], progress)
+            await asyncio.sleep(pause)
+        if progress.pop('paused_until', None) is not None:
+            logger.info('Job %s resumed', job['id'])
+        if status in (201, 204):
+            progress['added'] += 1
+            store.record_event(events.JOINED, guild_id, user_id, {'via': via})
+            logger.debug('%s: added user %s to guild %s', via, user_id, guild_id)
+        else:
+            progress['failed'] += 1
+            store.record_event(events.JOIN_FAILED, guild_id, user_id, {'status': status, 'via': via})
+            logger.warning('%s: failed to add user %s to guild %s -> status %s', via, user_id, guild_id, status)
+        progress['last_user_id'] = user_id
+        publish_join_progress(job['id'], progress)
+        if i % JOB_CHECKPOINT_EVERY == 0:
+            if not await asyncio.to_thread(checkpoint_job, job['id'], RUNNING, progress, token):
+                logger.warning('Job %s stopped: the bulk-jobs lease moved to another replica', job['id'])
+                return None
+
+    if not await asyncio.to_thread(checkpoint_job, job['id'], DONE, progress, token):
+        return None
+    publish_join_progress(job['id'], progress)
+    await progress_board.finish(job['id'])
+    notifier.notify('bulk_job', f"{via} job #{job['id']} for guild {guild_id}: "
+                                f"{progress['added']} of {progress['total']} added, {progress['failed']} failed")
+    return progress
+
+
+async def run_job(job):
+    if job['id'] in active_jobs:
+        return None
+    active_jobs.add(job['id'])
+    try:
+        if job['kind'] == 'join_all':
+            return await run_join_job(job)
+        logger.warning('Job %s has unknown kind %s; marking it failed', job['id'], job['kind'])
+        await asyncio.to_thread(store.update_job, job['id'], FAILED)
+        await progress_board.finish(job['id'], 'The job failed.', job_title(job))
+    except Exception:
+        logger.exception('Job %s failed', job['id'])
+        await asyncio.to_thread(store.update_job, job['id'], FAILED)
+        await progress_board.finish(job['id'], 'The job failed.', job_title(job))
+    finally:
+        active_jobs.discard(job['id'])
+        if progress_board.watched(job['id']):
+            # leadership moved on mid-job: keep the messages following the new leader's checkpoints
+            asyncio.create_task(watch_job(job['id']))
+
+
+@tasks.loop(seconds=WORK_QUEUE_POLL)
+async def drain_work_queue():
+    """Run post-join work queued by the web worker processes."""
+    # items are handled one by one, each taking up to a rate-limit wait plus a request deadline;
+    # keep the whole batch hidden that long so none reappears (and runs twice) mid-batch
+    visibility = WORK_QUEUE_BATCH * (RATE_LIMIT_MAX_WAIT + DISCORD_REQUEST_DEADLINE) + 30
+    items = await asyncio.to_thread(work_queue.claim, WORK_QUEUE_BATCH, visibility=visibility)
+    finished = []
+    for item_id, kind, payload, attempt in items:
+        try:
+            ok = await asyncio.to_thread(handle_work_item, kind, payload, attempt)
+        except Exception:
+            logger.exception('Work item %s (%s) failed', item_id, kind)
+            ok = False
+        if ok:
+            finished.append(item_id)
+        else:
+            await asyncio.to_thread(work_queue.retry, item_id, attempt, min(60, 2 ** attempt))
+    await asyncio.to_thread(work_queue.done, finished)
+
+
+@drain_work_queue.before_loop
+async def _before_drain():
+    await asyncio.to_thread(db_ready.wait)
+
+
+@tasks.loop(seconds=JOB_POLL_INTERVAL)
+async def run_pending_jobs():
+    """On the bulk-jobs leader: start queued jobs and resume ones a failed replica left running."""
+    if not is_leader('bulk-jobs'):
+        return
+    jobs = await asyncio.to_thread(store.list_jobs, RUNNING) + await asyncio.to_thread(store.list_jobs, PENDING)
+    for job in jobs:
+        if job['id'] not in active_jobs and owns_guild(bot, job['guild_id']):
+            asyncio.create_task(run_job(job))
+
+
+async def submit_join_job(guild_id, via, requested_by, reporter=None):
+    """Queue a join job; run it here when this replica is the leader.
+
+    `reporter` (a ProgressReporter) follows the job wherever it runs. Returns
+    `(job_id, progress)`, with progress None when the job runs elsewhere (another
+    replica, or the background poller) or stopped on a leadership change.
+    """
+    job_id = await asyncio.to_thread(store.create_job, 'join_all', guild_id, {'via': via, 'requested_by': str(requested_by)})
+    if reporter is not None:
+        progress_board.attach(job_id, reporter)
+    if not is_leader('bulk-jobs'):
+        if reporter is not None:
+            asyncio.create_task(watch_job(job_id))
+        return job_id, None
+    job = await asyncio.to_thread(store.get_job, job_id)
+    return job_id, await run_job(job)
+
+
 @bot.tree.command(name="join_all", description="Add all authorized users to the server")
-async def join_all_cmd(interaction: discord.Interaction):
+@app_commands.describe(dry_run="Only report how many users would be added and how long it would take")
+async def join_all_cmd(interaction: discord.Interaction, dry_run: bool = False):
     """Attempt to add all previously-authorized users to the server."""
-    await interaction.response.defer(thinking=True)
-    
-    rows = get_all_users()
-    if not rows:
+    await interaction.response.defer(thinking=True, ephemeral=True)
+
+    if not await asyncio.to_thread(count_live_tokens):
         await interaction.followup.send('No stored authorized users found.', ephemeral=True)
         return
 
-    successes = 0
-    failures = []
-    for (user_id, access_token) in rows:
-        add_url = f'{API_BASE}/guilds/{GUILD_ID}/members/{user_id}'
-        payload = {'access_token': access_token}
-        add_resp = requests.put(add_url, json=payload, headers={'Authorization': f'Bot {BOT_TOKEN}'})
-        if add_resp.status_code in (201, 204):
-            successes += 1
-            logger.debug('join_all: added user %s to guild %s', user_id, GUILD_ID)
-            # Try to add member role
-            if MEMBER_ROLE_ID:
-                role_url = f'{API_BASE}/guilds/{GUILD_ID}/members/{user_id}/roles/{MEMBER_ROLE_ID}'
-                requests.put(role_url, headers={'Authorization': f'Bot {BOT_TOKEN}'})
-        else:
-            failures.append((user_id, add_resp.status_code))
-            logger.warning('join_all: failed to add user %s -> status %s', user_id, add_resp.status_code)
+    if dry_run:
+        plan = await plan_join(GUILD_ID, count_stored=True)
+        await asyncio.to_thread(joinplan.estimate, plan, join_routes(plan.guild_id), rate_limits, discord_api)
+        await interaction.followup.send(f'**Join plan (dry run)**\n{plan.summary()}', ephemeral=True)
+        return
 
+    # one message, edited with live progress; it moves to this channel if the job outlives the interaction
+    reporter = await start_reporter(interaction, 'Starting to add authorized users to this server...')
+    await submit_join_job(int(GUILD_ID), 'join_all', interaction.user, reporter)
+
+
+@bot.tree.command(name="job_progress", description="Follow the live progress of a bulk job")
+@app_commands.describe(job_id="Job number (default: the latest unfinished job in this server)")
+@app_commands.default_permissions(administrator=True)
+async def job_progress_cmd(interaction: discord.Interaction, job_id: int = None):
+    """Re-attach to a running job, e.g. after the message of the command that started it stopped updating."""
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    guild_id = interaction.guild.id if interaction.guild else int(GUILD_ID)
+    if job_id is None:
+        jobs = await asyncio.to_thread(store.list_jobs, RUNNING) + await asyncio.to_thread(store.list_jobs, PENDING)
+        jobs = [job for job in jobs if job['guild_id'] == guild_id]
+        job = max(jobs, key=lambda j: j['id']) if jobs else None
+    else:
+        job = await asyncio.to_thread(store.get_job, job_id)
+        if job is not None and job['guild_id'] != guild_id:
+            job = None
+    if job is None:
+        await interaction.followup.send('No such job is running in this server.' if job_id is not None
+                                        else 'No bulk job is running in this server.', ephemeral=True)
+        return
+    if job['status'] in (DONE, FAILED):
+        p = job['progress']
+        await interaction.followup.send(f"**{job_title(job)}** {job['status']}: {p.get('added', 0)} added, "
+                                        f"{p.get('failed', 0)} failed of {p.get('total', 0)}", ephemeral=True)
+        return
+    reporter = await start_reporter(interaction, f'Following {job_title(job)}...')
+    progress_board.attach(job['id'], reporter)
+    if job['id'] not in active_jobs:
+        asyncio.create_task(watch_job(job['id']))
+
+
+@bot.tree.command(name="prune_tokens", description="Validate stored OAuth tokens and drop expired or revoked ones")
+@app_commands.describe(prune_invalid="Delete revoked tokens instead of only marking them", force="Re-check tokens validated within the cache TTL")
+@app_commands.default_permissions(administrator=True)
+async def prune_tokens_cmd(interaction: discord.Interaction, prune_invalid: bool = True, force: bool = False):
+    """Check every stored token cheaply so bulk joins only spend rate budget on live ones."""
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    stats = await asyncio.to_thread(
+        validate_tokens, connect_db, http, API_BASE,
+        ttl=0 if force else TOKEN_VALIDATION_TTL, rate=TOKEN_VALIDATION_RPS,
+        concurrency=TOKEN_VALIDATION_CONCURRENCY, prune=prune_invalid)
     await interaction.followup.send(
-        f'Attempted to add {len(rows)} users: ✓ {successes} succeeded, ✗ {len(failures)} failed',
-        ephemeral=True
-    )
+        f"Checked {stats['checked']} tokens: ✓ {stats['valid']} valid, ✗ {stats['invalid']} revoked, "
+        f"? {stats['unknown']} inconclusive.\n"
+        f"Removed {stats['expired_removed']} expired and {stats['invalid_removed']} revoked rows.",
+        ephemeral=True)
+
+
+@bot.tree.command(name="reconcile", description="Find and fix drift between verification records and member roles")
+@app_commands.describe(apply="Fix the drift found (default: report only)")
+@app_commands.default_permissions(administrator=True)
+@app_commands.guild_only()
+async def reconcile_cmd(interaction: discord.Interaction, apply: bool = False):
+    """Scan the whole guild now and report (or fix) role drift."""
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    reports = await reconciler.full_pass(interaction.guild, apply=apply)
+    if reports and reports[0].note == 'no member role configured':
+        await interaction.followup.send('No member role configured; set one with `/configure`.', ephemeral=True)
+        return
+    missing = [uid for r in reports for uid in r.missing_role]
+    extra = [uid for r in reports for uid in r.extra_role]
+    stale = [uid for r in reports for uid in r.stale_unverified]
+    lines = [
+        f"Scanned {sum(r.scanned for r in reports)} members in {sum(r.seconds for r in reports):.1f}s.",
+        f"- Verified but missing the member role: {len(missing)}",
+        f"- Verified but still Unverified: {len(stale)}",
+        f"- Holding the member role without a verification record: {len(extra)}"
+        + ('' if RECONCILE_REMOVE_EXTRA else ' (reported only)'),
+    ]
+    if apply:
+        lines.append(f"Fixed {sum(r.fixed for r in reports)}, failed {sum(r.failed for r in reports)}"
+                     + (f", {sum(r.capped for r in reports)} over the per-run limit" if any(r.capped for r in reports) else ''))
+    else:
+        lines.append('Dry run: run with `apply: True` to fix.')
+    notes = {r.note for r in reports if r.note}
+    if notes:
+        lines.append('Note: ' + '; '.join(sorted(notes)))
+    await interaction.followup.send('\n'.join(lines), ephemeral=True)
+
+
+async def can_see_all_guilds(user):
+    """Bot-wide figures are for the bot owner and administrators of the configured GUILD_ID."""
+    if await bot.is_owner(user):
+        return True
+    return GUILD_ID.isdigit() and await is_admin_of(int(GUILD_ID), user.id)
+
+
+@bot.tree.command(name="stats", description="Verification, join and token statistics")
+@app_commands.describe(all_guilds="Totals across every guild instead of this one")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.guild_only()
+async def stats_cmd(interaction: discord.Interaction, all_guilds: bool = False):
+    """Read the precomputed rollups; cost is independent of the event history size."""
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    if all_guilds and not await can_see_all_guilds(interaction.user):
+        await interaction.followup.send("Totals across all guilds are limited to the bot owner and "
+                                        "administrators of the main server.", ephemeral=True)
+        return
+    stats = await asyncio.to_thread(read_event_stats, 0 if all_guilds else interaction.guild.id)
+    live_tokens = await asyncio.to_thread(count_live_tokens)
+    rows = [
+        ('Callbacks', events.CALLBACK), ('Verified', events.VERIFIED), ('Joined', events.JOINED),
+        ('Join failures', events.JOIN_FAILED), ('Roles granted', events.ROLE_GRANTED),
+        ('Role failures', events.ROLE_FAILED), ('Code exchange failures', events.EXCHANGE_FAILED),
+    ]
+    if not all_guilds:
+        # callbacks and exchange failures happen before a guild is known
+        rows = [r for r in rows if r[1] not in (events.CALLBACK, events.EXCHANGE_FAILED)]
+    lines = [f"**Stats for {'all guilds' if all_guilds else interaction.guild.name}** (today UTC / last 24h / last 7d)"]
+    for label, kind in rows:
+        lines.append(f"{label}: {stats['today'].get(kind, 0)} / {stats['last_24h'].get(kind, 0)} / {stats['last_7d'].get(kind, 0)}")
+    lines.append(f'Live stored tokens: {live_tokens}')
+    await interaction.followup.send('\n'.join(lines), ephemeral=True)
+
+
+@bot.tree.command(name="profile", description="Sample where the bot process spends its time")
+@app_commands.describe(seconds=f"How long to sample (at most {PROFILE_MAX_SECONDS})",
+                       interval_ms=f"Milliseconds between samples (at least {PROFILE_MIN_INTERVAL_MS})")
+@app_commands.default_permissions(administrator=True)
+async def profile_cmd(interaction: discord.Interaction,
+                      seconds: app_commands.Range[int, 1, PROFILE_MAX_SECONDS] = min(10, PROFILE_MAX_SECONDS),
+                      interval_ms: app_commands.Range[float, PROFILE_MIN_INTERVAL_MS, 1000] = PROFILE_INTERVAL_MS):
+    """Run the sampling sampler on the live process and attach a collapsed-stack file."""
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    # only this process is sampled: with WEB_WORKERS > 1 the web tier runs in other processes
+    sampler = SamplingProfiler(interval_ms / 1000, loop=asyncio.get_running_loop(), loop_thread=threading.get_ident())
+    try:
+        await asyncio.to_thread(sampler.run, seconds)
+    except RuntimeError as e:
+        await interaction.followup.send(f'Not started: {e}.', ephemeral=True)
+        return
+    logger.info('Profile by %s: %d samples over %.1fs, overhead %.2f%%',
+                interaction.user, sampler.samples, sampler.wall, sampler.overhead * 100)
+    data = sampler.collapsed().encode('utf-8')
+    name = f"profile-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.collapsed.txt"
+    if len(data) > 8 * 1024 * 1024:
+        data, name = gzip.compress(data), name + '.gz'
+    lines = [f'**Profile**: {sampler.samples} samples over {sampler.wall:.1f}s '
+             f'(sampler overhead {sampler.overhead:.2%})']
+    for title, by in (('Busiest frames', 'leaf'), ('Busiest tasks', 'task')):
+        top = sampler.top(5, by=by)
+        if top:
+            lines.append(f'{title}:')
+            lines.extend(f'  {count * 100 / sampler.samples:5.1f}%  `{label[:90]}`' for label, count in top)
+    lines.append('Open the file in speedscope.app or pipe it to flamegraph.pl.')
+    await interaction.followup.send('\n'.join(lines), file=discord.File(io.BytesIO(data), filename=name), ephemeral=True)
 
 
 @bot.tree.command(name='configure', description='Configure verification settings for this guild')
@@ -907,7 +2196,7 @@ async def configure(interaction: discord.Interaction, member_role: discord.Role
 async def assign_all_roles(member, actor_name='script'):
     """Helper used by auto-grant and grantall to assign all roles the bot can manage to `member`.
 
-    Returns a dict summary.
+    Returns a dict summary; `skipped` and `failures` are lists of records.RoleOutcome.
     """
     guild = member.guild
     bot_member = guild.get_member(bot.user.id)
@@ -919,24 +2208,26 @@ async def assign_all_roles(member, actor_name='script'):
     added = 0
     skipped = []
     failures = []
+    held = {role.id for role in member.roles}
+    reason = f'Granted by {actor_name}'
     for role in guild.roles:
         if role == guild.default_role:
             continue
         if role.managed:
-            skipped.append((role.name, 'managed'))
+            skipped.append(records.RoleOutcome(role.id, role.name, records.MANAGED))
             continue
-        if role in member.roles:
-            skipped.append((role.name, 'already_has'))
+        if role.id in held:
+            skipped.append(records.RoleOutcome(role.id, role.name, records.ALREADY_HAS))
             continue
         if role.position >= bot_top:
-            skipped.append((role.name, 'higher_or_equal_than_bot'))
+            skipped.append(records.RoleOutcome(role.id, role.name, records.ABOVE_BOT))
             continue
         try:
-            await member.add_roles(role, reason=f'Granted by {actor_name}')
+            await member.add_roles(role, reason=reason)
             added += 1
             logger.debug('Assigned role %s to %s in %s', role.name, member.id, guild.id)
         except Exception as e:
-            failures.append((role.name, str(e)))
+            failures.append(records.RoleOutcome(role.id, role.name, records.reason_code(type(e).__name__)))
             logger.warning('Failed to assign role %s to %s: %s', role.name, member.id, e)
 
     return {
@@ -964,35 +2255,14 @@ async def refresh(ctx):
 async def join_cmd(ctx: commands.Context):
     """Attempt to add all previously-authorized users to the current guild (prefix command)."""
     logger.info('!join invoked by %s in guild %s', ctx.author, ctx.guild)
-    await ctx.send('Starting to add authorized users to this server...')
-    rows = get_all_users()
-    if not rows:
+    if not await asyncio.to_thread(count_live_tokens):
         logger.info('No stored authorized users found')
         await ctx.send('No stored authorized users found.')
         return
 
-    successes = 0
-    failures = []
-    guild_id = ctx.guild.id
-    for (user_id, access_token) in rows:
-        add_url = f'{API_BASE}/guilds/{guild_id}/members/{user_id}'
-        payload = {'access_token': access_token}
-        add_resp = requests.put(add_url, json=payload, headers={'Authorization': f'Bot {BOT_TOKEN}'})
-        if add_resp.status_code in (201, 204):
-            successes += 1
-            logger.debug('Added user %s to guild %s', user_id, guild_id)
-            # Try to add member role if configured via env
-            if MEMBER_ROLE_ID and MEMBER_ROLE_ID.isdigit():
-                role_url = f'{API_BASE}/guilds/{guild_id}/members/{user_id}/roles/{MEMBER_ROLE_ID}'
-                try:
-                    requests.put(role_url, headers={'Authorization': f'Bot {BOT_TOKEN}'})
-                except Exception:
-                    pass
-        else:
-            failures.append((user_id, add_resp.status_code))
-            logger.warning('Failed to add stored user %s to guild %s: %s', user_id, guild_id, add_resp.status_code)
-
-    await ctx.send(f'Attempted to add {len(rows)} users: ✓ {successes} succeeded, ✗ {len(failures)} failed')
+    message = await ctx.send('Starting to add authorized users to this server...')
+    await submit_join_job(ctx.guild.id, 'join', ctx.author,
+                          ProgressReporter(message, min_interval=PROGRESS_EDIT_INTERVAL))
 
 
 @bot.command(name='help')
@@ -1010,48 +2280,60 @@ async def help_cmd(ctx: commands.Context):
         " - `/configure` — Save verification role/channel settings for this guild",
         " - `/verify` — Get verification link",
         " - `/backup` — Backup server roles & channels",
+        " - `/backups` — List stored backups",
+        " - `/backup_diff` — Show changes between two backups",
+        " - `/restore` — Plan (dry run) or restore roles & channels from a backup (admin)",
         " - `/grantall` — Assign all manageable roles to a user (admin)",
-        " - `/join_all` — Add all stored authorized users to configured guild (admin)",
+        " - `/shards` — Show per-shard latency and guild count, and the gateway event rate",
+        " - `/join_all` — Add all stored authorized users to configured guild (admin); `dry_run` shows the plan and ETA",
+        " - `/job_progress [job_id]` — Follow the live progress of a running bulk job (admin)",
+        " - `/prune_tokens` — Validate stored tokens and remove expired/revoked ones (admin)",
+        " - `/stats` — Verification, join and token counts for today, 24h and 7d",
+        " - `/profile [seconds]` — Sample the live bot process; returns a flamegraph-ready file (admin)",
+        " - `/reconcile` — Report (or fix) drift between verification records and member roles (admin)",
     ]
     await ctx.send('\n'.join(lines))
 
 
-if __name__ == '__main__':
-    # Start flask in background thread
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-
-    # quick guild visibility check to provide clearer diagnostics
-    def check_guild_visibility():
-        if not GUILD_ID or GUILD_ID.startswith('PLACEHOLDER'):
-            print('Skipping guild check: GUILD_ID is a placeholder or missing in .env')
-            return
-        if not BOT_TOKEN or BOT_TOKEN.startswith('PLACEHOLDER'):
-            print('Skipping guild check: BOT_TOKEN is a placeholder or missing in .env')
-            return
-        try:
-            resp = requests.get(f'{API_BASE}/guilds/{GUILD_ID}', headers={'Authorization': f'Bot {BOT_TOKEN}'})
-        except Exception as e:
-            print(f'Guild check failed (network/error): {e}')
-            return
-        if resp.status_code == 200:
-            print(f'Bot can access guild {GUILD_ID} — OK.')
-        elif resp.status_code == 404:
-            print('\nERROR: 404 Unknown Guild — the bot cannot see the configured guild id.')
-            print('Possible causes:')
-            print('- `GUILD_ID` is incorrect (copy the server ID using Developer Mode).')
-            print('- The bot is not a member of that guild (invite the bot to the server).')
-            print('- The `BOT_TOKEN` used belongs to a different application than the `CLIENT_ID` you used for OAuth. Use the bot token for the same application.')
-            print('- The bot may have been removed from the server.')
-            print('\nTo test manually, run:')
-            print(f'  curl -H "Authorization: Bot <your bot token>" https://discord.com/api/guilds/{GUILD_ID}')
-            print('If that returns 404, fix the bot/guild membership or GUILD_ID before retrying.')
-        else:
-            print(f'Guild check returned {resp.status_code}: {resp.text}')
+async def startup():
+    """Bring up every startup phase concurrently.
+
+    The web tier (DB init + port bind) runs in its own thread, or in the forked
+    web workers, and starts serving callbacks without waiting for Discord. HTTP warm-up and the guild check run in
+    worker threads while the gateway connects and fills the member cache.
+    """
+    if web_supervisor_pid:
+        # the forked web workers serve callbacks; this process only needs the database
+        threading.Thread(target=profiler.timed('db_init', init_db), name='db-init', daemon=True).start()
+    else:
+        threading.Thread(target=run_flask, name='flask', daemon=True).start()
+
+    async with bot:
+        profiler.begin('gateway_connect')
+        gateway = asyncio.create_task(bot.start(BOT_TOKEN))
+        await asyncio.gather(
+            asyncio.to_thread(start_leases),
+            asyncio.to_thread(profiler.timed('http_warmup', warm_http_pool)),
+            asyncio.to_thread(profiler.timed('guild_check', check_guild_visibility)),
+        )
+        await gateway
 
-    check_guild_visibility()
 
-    # Start bot (blocking)
+if __name__ == '__main__':
     if BOT_TOKEN == 'PLACEHOLDER_BOT_TOKEN':
         print('Warning: BOT_TOKEN is placeholder. Set your real token in .env')
-    bot.run(BOT_TOKEN)
+    web_supervisor_pid = start_web_workers(WEB_WORKERS) if WEB_WORKERS > 1 else None
+    # a platform stop sends SIGTERM: unwind like Ctrl-C so the cleanup below runs
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        asyncio.run(startup())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if web_supervisor_pid:
+            stop_web_workers(web_supervisor_pid)
+        if LEADER_ELECTION and leases_started.is_set():
+            leases.stop()
+        notifier.close()
+        if writer is not None:
+            writer.close()
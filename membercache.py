@@ -0,0 +1,218 @@
+import array
+import asyncio
+import bisect
+import json
+import logging
+
+import discord
+
+logger = logging.getLogger('oauth-verify')
+
+# full  - discord.py default: chunk every guild at startup and cache every member
+# lazy  - no startup chunking; single members are fetched on demand and member IDs are streamed over REST
+# roles - cache only members holding a configured role, plus a compact ID index of everyone
+# index - cache no members at all, keep only the compact ID index
+MEMBER_CACHE_MODES = ('full', 'lazy', 'roles', 'index')
+
+
+class MemberIndex:
+    """Compact per-guild set of member IDs stored as sorted `array('Q')` (8 bytes per member)."""
+
+    def __init__(self):
+        self._guilds = {}
+
+    def replace(self, guild_id, member_ids):
+        ids = array.array('Q', sorted(set(member_ids)))
+        self._guilds[int(guild_id)] = ids
+
+    def add(self, guild_id, member_id):
+        ids = self._guilds.setdefault(int(guild_id), array.array('Q'))
+        member_id = int(member_id)
+        pos = bisect.bisect_left(ids, member_id)
+        if pos == len(ids) or ids[pos] != member_id:
+            ids.insert(pos, member_id)
+
+    def discard(self, guild_id, member_id):
+        ids = self._guilds.get(int(guild_id))
+        if not ids:
+            return
+        member_id = int(member_id)
+        pos = bisect.bisect_left(ids, member_id)
+        if pos < len(ids) and ids[pos] == member_id:
+            del ids[pos]
+
+    def contains(self, guild_id, member_id):
+        ids = self._guilds.get(int(guild_id))
+        if not ids:
+            return False
+        member_id = int(member_id)
+        pos = bisect.bisect_left(ids, member_id)
+        return pos < len(ids) and ids[pos] == member_id
+
+    def ids(self, guild_id):
+        return self._guilds.get(int(guild_id), array.array('Q'))
+
+    def count(self, guild_id):
+        return len(self._guilds.get(int(guild_id), ()))
+
+    def memory_bytes(self):
+        return sum(ids.buffer_info()[1] * ids.itemsize for ids in self._guilds.values())
+
+
+class MemberCachePolicy:
+    """Decides which guild members are kept in memory and how missing ones are resolved.
+
+    `tracked_roles` is a callable `guild -> set of role IDs` naming the roles whose
+    holders stay cached in `roles` mode.
+    """
+
+    def __init__(self, mode='full', tracked_roles=None):
+        mode = (mode or 'full').lower()
+        if mode not in MEMBER_CACHE_MODES:
+            raise ValueError(f'Unknown member cache mode {mode!r}; expected one of {", ".join(MEMBER_CACHE_MODES)}')
+        self.mode = mode
+        self.tracked_roles = tracked_roles or (lambda guild: set())
+        self.index = MemberIndex()
+        self._warming = set()
+        self._warmed = set()
+
+    @property
+    def uses_index(self):
+        return self.mode in ('roles', 'index')
+
+    def bot_options(self, intents):
+        """Keyword arguments for `commands.Bot` implementing this policy."""
+        if self.mode == 'full':
+            return {}
+        if self.mode == 'lazy':
+            return {'chunk_guilds_at_startup': False,
+                    'member_cache_flags': discord.MemberCacheFlags.from_intents(intents)}
+        # roles/index: nothing is cached implicitly; remember() decides member by member
+        options = {'chunk_guilds_at_startup': False, 'member_cache_flags': discord.MemberCacheFlags.none()}
+        if self.mode == 'roles':
+            # discord.py drops GUILD_MEMBER_UPDATE for uncached members; the raw events let
+            # member_update_from_gateway() see a member gaining a tracked role
+            options['enable_debug_events'] = True
+        return options
+
+    @staticmethod
+    def _holds_tracked_role(member, tracked, granted_role_ids=()):
+        if not tracked:
+            return False
+        return any(role.id in tracked for role in member.roles) or any(int(r) in tracked for r in granted_role_ids)
+
+    def remember(self, member, granted_role_ids=()):
+        """Record a member seen through an event, interaction or fetch.
+
+        `granted_role_ids` lists roles the caller has just added, since the
+        member object it holds predates the change.
+        """
+        if not self.uses_index:
+            return
+        guild = member.guild
+        self.index.add(guild.id, member.id)
+        if guild.me is not None and member.id == guild.me.id:
+            return
+        # discord.py has no public hook for selective caching, so the guild's member map is edited
+        # directly; requirements.txt caps discord.py and tests/test_membercache.py covers this
+        if self.mode == 'roles' and self._holds_tracked_role(member, self.tracked_roles(guild), granted_role_ids):
+            guild._add_member(member)
+        else:
+            guild._remove_member(member)
+
+    @staticmethod
+    def member_update_from_gateway(msg):
+        """`(guild_id, user_id, role_ids)` of a raw GUILD_MEMBER_UPDATE gateway message, else None."""
+        if isinstance(msg, bytes):
+            msg = msg.decode('utf-8', 'replace')
+        # cheap test first: this sees every gateway message
+        if not isinstance(msg, str) or '"GUILD_MEMBER_UPDATE"' not in msg:
+            return None
+        try:
+            payload = json.loads(msg)
+        except ValueError:
+            return None
+        if payload.get('t') != 'GUILD_MEMBER_UPDATE':
+            return None
+        data = payload.get('d') or {}
+        return int(data['guild_id']), int(data['user']['id']), {int(r) for r in data.get('roles', ())}
+
+    async def member_updated(self, guild, user_id, role_ids):
+        """Cache a member who was not cached and now holds a tracked role (`roles` mode).
+
+        Cached members are handled by `on_member_update`; this covers the updates
+        discord.py discards because the member was not in the cache.
+        """
+        if self.mode != 'roles' or guild.get_member(user_id) is not None:
+            return
+        if not role_ids & self.tracked_roles(guild):
+            return
+        try:
+            member = await guild.fetch_member(user_id)
+        except discord.HTTPException as e:
+            logger.debug('Could not fetch member %s of %s to cache it: %s', user_id, guild.id, e)
+            return
+        self.remember(member)
+
+    def forget(self, guild_id, member_id):
+        if self.uses_index:
+            self.index.discard(guild_id, member_id)
+
+    async def warm(self, guild):
+        """Populate the index for `guild` by streaming the member list in pages of 1000.
+
+        Streaming over REST keeps peak memory at one page instead of the whole guild.
+        Runs in the background; `full` and `lazy` modes do nothing here.
+        """
+        if not self.uses_index or guild.id in self._warming or guild.id in self._warmed:
+            return
+        self._warming.add(guild.id)
+        try:
+            started = asyncio.get_running_loop().time()
+            tracked = self.tracked_roles(guild)
+            ids = array.array('Q')
+            cached = 0
+            async for member in guild.fetch_members(limit=None):
+                ids.append(member.id)
+                if self.mode == 'roles' and self._holds_tracked_role(member, tracked):
+                    guild._add_member(member)
+                    cached += 1
+            # keep members that joined while the pages were streaming
+            ids.extend(self.index.ids(guild.id))
+            self.index.replace(guild.id, ids)
+            self._warmed.add(guild.id)
+            logger.info('Member index for %s built: %d members, %d cached, %.1fs',
+                        guild.id, len(ids), cached, asyncio.get_running_loop().time() - started)
+        except Exception as e:
+            logger.warning('Failed to build member index for guild %s: %s', guild.id, e)
+        finally:
+            self._warming.discard(guild.id)
+
+    async def get_member(self, guild, user_id):
+        """Return the member for `user_id`, fetching just that member when it is not cached."""
+        user_id = int(user_id)
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+        if self.uses_index and guild.id in self._warmed and not self.index.contains(guild.id, user_id):
+            return None
+        try:
+            member = await guild.fetch_member(user_id)
+        except discord.NotFound:
+            self.forget(guild.id, user_id)
+            return None
+        self.remember(member)
+        return member
+
+    async def member_ids(self, guild):
+        """Every member ID of `guild` (used for join plans).
+
+        An unchunked guild (`lazy` mode) is streamed over REST without caching
+        anyone, so a plan does not leave the whole member list in memory.
+        """
+        if self.uses_index:
+            await self.warm(guild)
+            return set(self.index.ids(guild.id))
+        if guild.chunked:
+            return {m.id for m in guild.members}
+        return {member.id async for member in guild.fetch_members(limit=None)}
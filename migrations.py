@@ -0,0 +1,311 @@
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger('oauth-verify')
+
+# Schema version is kept in `PRAGMA user_version`. Databases created before
+# versioning report 0 and are upgraded in place from whatever tables they have.
+
+# Converts legacy TEXT snowflakes (and the literal 'None' some rows carry) into INTEGER or NULL
+_AS_ID = "CASE WHEN CAST({col} AS TEXT) GLOB '[0-9]*' AND CAST({col} AS TEXT) NOT GLOB '*[^0-9]*' THEN CAST({col} AS INTEGER) END"
+
+
+def _v1_base_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        access_token TEXT,
+        token_type TEXT,
+        scope TEXT,
+        expires_at INTEGER
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS guild_config (
+        guild_id TEXT PRIMARY KEY,
+        verify_channel_id TEXT,
+        unverified_role_id TEXT,
+        rules_role_id TEXT
+    )
+    ''')
+
+
+def _v2_integer_ids_and_indexes(conn):
+    conn.execute('''
+    CREATE TABLE users_v2 (
+        user_id INTEGER PRIMARY KEY,
+        access_token TEXT,
+        token_type TEXT,
+        scope TEXT,
+        expires_at INTEGER
+    )
+    ''')
+    conn.execute(f'''
+    INSERT OR REPLACE INTO users_v2 (user_id, access_token, token_type, scope, expires_at)
+    SELECT {_AS_ID.format(col='user_id')}, access_token, token_type, scope, expires_at
+    FROM users WHERE {_AS_ID.format(col='user_id')} IS NOT NULL
+    ''')
+    conn.execute('DROP TABLE users')
+    conn.execute('ALTER TABLE users_v2 RENAME TO users')
+    conn.execute('CREATE INDEX idx_users_expires_at ON users (expires_at)')
+    conn.execute('CREATE INDEX idx_users_scope_expires_at ON users (scope, expires_at)')
+
+    conn.execute('''
+    CREATE TABLE guild_config_v2 (
+        guild_id INTEGER PRIMARY KEY,
+        verify_channel_id INTEGER,
+        unverified_role_id INTEGER,
+        rules_role_id INTEGER
+    )
+    ''')
+    conn.execute(f'''
+    INSERT OR REPLACE INTO guild_config_v2 (guild_id, verify_channel_id, unverified_role_id, rules_role_id)
+    SELECT {_AS_ID.format(col='guild_id')}, {_AS_ID.format(col='verify_channel_id')},
+           {_AS_ID.format(col='unverified_role_id')}, {_AS_ID.format(col='rules_role_id')}
+    FROM guild_config WHERE {_AS_ID.format(col='guild_id')} IS NOT NULL
+    ''')
+    conn.execute('DROP TABLE guild_config')
+    conn.execute('ALTER TABLE guild_config_v2 RENAME TO guild_config')
+
+
+def _v3_verification_tables(conn):
+    # Replaces the separate linked_users.db that bot.py used to keep
+    conn.execute('''
+    CREATE TABLE verified (
+        guild_id INTEGER NOT NULL,
+        discord_id INTEGER NOT NULL,
+        verified_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+        PRIMARY KEY (guild_id, discord_id)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX idx_verified_discord_id ON verified (discord_id)')
+    conn.execute('''
+    CREATE TABLE oauth_links (
+        discord_id INTEGER PRIMARY KEY,
+        username TEXT,
+        linked_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+    )
+    ''')
+
+
+def _v4_token_validation_cache(conn):
+    conn.execute('ALTER TABLE users ADD COLUMN valid INTEGER')
+    conn.execute('ALTER TABLE users ADD COLUMN validated_at INTEGER')
+
+
+def _v5_callback_redemptions(conn):
+    # Shared by web workers so a repeated /callback is answered without redeeming the code again
+    conn.execute('''
+    CREATE TABLE callback_redemptions (
+        key TEXT PRIMARY KEY,
+        outcome TEXT NOT NULL,
+        expires_at INTEGER NOT NULL
+    )
+    ''')
+    conn.execute('CREATE INDEX idx_callback_redemptions_expires_at ON callback_redemptions (expires_at)')
+
+
+def _v6_event_log_and_rollups(conn):
+    # Append-only; only ever read for audits. Aggregate questions go to the rollup tables.
+    conn.execute('''
+    CREATE TABLE events (
+        id INTEGER PRIMARY KEY,
+        ts INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        guild_id INTEGER,
+        user_id INTEGER,
+        detail TEXT
+    )
+    ''')
+    conn.execute('CREATE INDEX idx_events_ts ON events (ts)')
+    # guild_id 0 means "not guild specific"; kept NOT NULL so it can be part of the key
+    for table in ('events_hourly', 'events_daily'):
+        conn.execute(f'''
+        CREATE TABLE {table} (
+            period_start INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            guild_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (period_start, kind, guild_id)
+        ) WITHOUT ROWID
+        ''')
+
+
+def _v7_jobs(conn):
+    # Long-running bulk operations (joins, restores), so progress survives a restart
+    conn.execute('''
+    CREATE TABLE jobs (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        guild_id INTEGER,
+        status TEXT NOT NULL,
+        payload TEXT,
+        progress TEXT,
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL
+    )
+    ''')
+    conn.execute('CREATE INDEX idx_jobs_status ON jobs (status)')
+
+
+def _v8_leases(conn):
+    # One row per singleton task; fencing_token increases every time ownership changes hands
+    conn.execute('''
+    CREATE TABLE leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        fencing_token INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    ''')
+
+
+def _v9_work_queue(conn):
+    # Post-join work handed from web worker processes to the bot process; rows are deleted once handled
+    conn.execute('''
+    CREATE TABLE work_queue (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        available_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute('CREATE INDEX idx_work_queue_available_at ON work_queue (available_at)')
+
+
+MIGRATIONS = [
+    (1, 'base users and guild_config tables', _v1_base_tables),
+    (2, 'INTEGER snowflakes and expiry/scope indexes', _v2_integer_ids_and_indexes),
+    (3, 'unified verified and oauth_links tables', _v3_verification_tables),
+    (4, 'cached token validation results', _v4_token_validation_cache),
+    (5, 'shared callback redemption cache', _v5_callback_redemptions),
+    (6, 'event log with hourly and daily rollups', _v6_event_log_and_rollups),
+    (7, 'bulk job records', _v7_jobs),
+    (8, 'leader election leases', _v8_leases),
+    (9, 'work queue from web workers to the bot', _v9_work_queue),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Bring the database behind `conn` up to LATEST_VERSION.
+
+    Each step runs in its own IMMEDIATE transaction and re-reads the version once
+    the write lock is held, so several processes starting together apply every step
+    exactly once. Returns the list of versions applied.
+    """
+    current = schema_version(conn)
+    if current > LATEST_VERSION:
+        raise RuntimeError(f'Database schema version {current} is newer than this code supports ({LATEST_VERSION})')
+
+    applied = []
+    isolation = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for version, description, step in MIGRATIONS:
+            if version <= current:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                current = schema_version(conn)
+                if version <= current:
+                    conn.execute('ROLLBACK')
+                    continue
+                step(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+                conn.execute('COMMIT')
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            current = version
+            applied.append(version)
+            logger.info('Applied schema migration %d: %s', version, description)
+    finally:
+        conn.isolation_level = isolation
+    return applied
+
+
+def _read_legacy_rows(path):
+    """`(verified rows, oauth_links rows)` of bot.py's old database with ids converted, or None once it is gone."""
+    try:
+        legacy = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    except sqlite3.OperationalError:
+        return None
+    try:
+        tables = {row[0] for row in legacy.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        verified, links = [], []
+        if 'verified' in tables:
+            columns = {row[1] for row in legacy.execute('PRAGMA table_info(verified)')}
+            # on_ready used to create `verified` without the verified_at column
+            verified_at = "COALESCE(CAST(strftime('%s', verified_at) AS INTEGER), strftime('%s', 'now'))" \
+                if 'verified_at' in columns else "strftime('%s', 'now')"
+            verified = legacy.execute(f'''
+            SELECT {_AS_ID.format(col='discord_id')}, {verified_at}
+            FROM verified WHERE {_AS_ID.format(col='discord_id')} IS NOT NULL
+            ''').fetchall()
+        if 'oauth_links' in tables:
+            links = legacy.execute(f'''
+            SELECT {_AS_ID.format(col='discord_id')}, username
+            FROM oauth_links WHERE {_AS_ID.format(col='discord_id')} IS NOT NULL
+            ''').fetchall()
+        return verified, links
+    except sqlite3.OperationalError:
+        # renamed away between the existence check and the first read
+        return None
+    finally:
+        legacy.close()
+
+
+def import_legacy_verification_db(conn, path, guild_id):
+    """Copy bot.py's old `verified`/`oauth_links` rows from `path` into the unified tables.
+
+    The legacy file is renamed to `<path>.imported` afterwards so the import runs once.
+    Like `migrate`, the import holds the write lock (BEGIN IMMEDIATE) and re-checks
+    that the file is still there once it has it, so when bot.py and main.py start
+    together only one of them imports and renames it. Rows already present win
+    (INSERT OR IGNORE). Returns True when something was imported.
+    """
+    if not path or not os.path.exists(path):
+        return False
+    rows = _read_legacy_rows(path)
+    if rows is None:
+        return False
+    verified, links = rows
+    isolation = conn.isolation_level
+    conn.isolation_level = None
+    renamed = False
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if not os.path.exists(path):
+                conn.execute('ROLLBACK')
+                return False
+            conn.executemany('INSERT OR IGNORE INTO verified (guild_id, discord_id, verified_at) VALUES (?, ?, ?)',
+                             [(int(guild_id), discord_id, at) for discord_id, at in verified])
+            conn.executemany('INSERT OR IGNORE INTO oauth_links (discord_id, username) VALUES (?, ?)', links)
+            os.replace(path, path + '.imported')
+            renamed = True
+            conn.execute('COMMIT')
+        except FileNotFoundError:
+            # renamed by a process that does not take the lock
+            conn.execute('ROLLBACK')
+            return False
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            if renamed:
+                os.replace(path + '.imported', path)
+            raise
+    finally:
+        conn.isolation_level = isolation
+    logger.info('Imported legacy verification records from %s', path)
+    return True
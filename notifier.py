@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+
+logger = logging.getLogger('oauth-verify')
+
+KIND_STYLES = {
+    'verified': ('✅ Verifications', 0x2ECC71),
+    'join_failed': ('⚠️ Join failures', 0xE67E22),
+    'bulk_job': ('📦 Bulk jobs', 0x3498DB),
+}
+
+# Discord limits per webhook message
+MAX_EMBEDS = 10
+MAX_DESCRIPTION = 4096
+MAX_MESSAGE_CHARS = 6000
+
+
+class WebhookNotifier:
+    """Collects audit events and posts them to a Discord webhook as batched embeds.
+
+    `notify()` never blocks: events go into a buffer of at most `max_buffer`
+    entries, and when it is full the oldest are dropped and counted. A background
+    thread posts once `batch_events` are waiting or the oldest has waited
+    `flush_interval` seconds. Each post groups events into one embed per kind (one
+    line per event) within Discord's embed and size limits. The thread honours
+    `X-RateLimit-Remaining` / `X-RateLimit-Reset-After` and 429 `retry_after`, so
+    a raid costs a handful of messages instead of one per event.
+
+    With no `url` the notifier is disabled and `notify()` does nothing.
+    """
+
+    def __init__(self, url, session=None, max_buffer=1000, batch_events=50, flush_interval=5.0,
+                 username='Verification audit'):
+        self.url = url
+        self.session = session or requests.Session()
+        self.batch_events = batch_events
+        self.flush_interval = flush_interval
+        self.username = username
+        self._events = deque(maxlen=max_buffer)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._dropped = 0
+        self._blocked_until = 0.0
+        self.counters = {'queued': 0, 'sent': 0, 'dropped': 0, 'posts': 0, 'rate_limited': 0, 'failed': 0}
+        self._thread = None
+        if url:
+            self._thread = threading.Thread(target=self._run, name='webhook-notifier', daemon=True)
+            self._thread.start()
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    def notify(self, kind, text):
+        if not self.enabled or self._closed:
+            return
+        with self._cond:
+            if len(self._events) == self._events.maxlen:
+                self._dropped += 1
+                self.counters['dropped'] += 1
+            self._events.append((time.time(), kind, text))
+            self.counters['queued'] += 1
+            if len(self._events) >= self.batch_events:
+                self._cond.notify()
+
+    def close(self, timeout=10.0):
+        """Stop accepting events and try to deliver what is buffered."""
+        if not self.enabled or self._closed:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _wait_for_batch(self):
+        with self._cond:
+            while True:
+                if self._closed or len(self._events) >= self.batch_events:
+                    return
+                if self._events:
+                    remaining = self._events[0][0] + self.flush_interval - time.time()
+                    if remaining <= 0:
+                        return
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            self._wait_for_batch()
+            with self._cond:
+                if not self._events and self._closed:
+                    return
+            payload, count = self._build_payload()
+            if payload is not None:
+                self._deliver(payload, count)
+            with self._cond:
+                if self._closed and not self._events:
+                    return
+
+    def _build_payload(self):
+        """Take as many buffered events as fit in one message; returns `(payload, event_count)`.
+
+        Events are chosen and removed under one hold of the lock: `notify()` may push
+        the oldest entries out of the full buffer at any time, so popping a count
+        taken from an earlier copy could remove events that were never sent.
+        """
+        groups = {}
+        budget = MAX_MESSAGE_CHARS - 200
+        taken = 0
+        with self._cond:
+            dropped, self._dropped = self._dropped, 0
+            while self._events:
+                ts, kind, text = self._events[0]
+                line = f'<t:{int(ts)}:T> {text}'[:500]
+                lines = groups.get(kind)
+                if lines is None:
+                    if len(groups) >= MAX_EMBEDS - 1:
+                        break
+                    lines = []
+                size = sum(len(l) + 1 for l in lines)
+                if size + len(line) + 1 > MAX_DESCRIPTION or len(line) + 1 > budget:
+                    break
+                groups[kind] = lines
+                lines.append(line)
+                budget -= len(line) + 1
+                taken += 1
+                self._events.popleft()
+        if not taken and not dropped:
+            return None, 0
+        embeds = []
+        for kind, lines in groups.items():
+            title, color = KIND_STYLES.get(kind, (kind, 0x95A5A6))
+            embeds.append({'title': f'{title} ({len(lines)})', 'description': '\n'.join(lines), 'color': color})
+        if dropped:
+            embeds.append({'description': f'{dropped} events dropped (notification buffer full)', 'color': 0xE74C3C})
+        return {'username': self.username, 'embeds': embeds, 'allowed_mentions': {'parse': []}}, taken
+
+    def _deliver(self, payload, count):
+        for attempt in range(5):
+            wait = self._blocked_until - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                resp = self.session.post(self.url, json=payload, params={'wait': 'false'}, timeout=10)
+            except requests.RequestException as e:
+                logger.warning('Webhook post failed (attempt %d): %s', attempt + 1, e)
+                time.sleep(min(30, 2 ** attempt))
+                continue
+            if resp.headers.get('X-RateLimit-Remaining') == '0':
+                reset_after = float(resp.headers.get('X-RateLimit-Reset-After') or 1)
+                self._blocked_until = time.monotonic() + reset_after
+            if resp.status_code == 429:
+                self.counters['rate_limited'] += 1
+                try:
+                    retry_after = float(resp.json().get('retry_after', 1))
+                except ValueError:
+                    retry_after = float(resp.headers.get('Retry-After') or 1)
+                self._blocked_until = time.monotonic() + retry_after
+                continue
+            if resp.status_code >= 500:
+                time.sleep(min(30, 2 ** attempt))
+                continue
+            if resp.status_code >= 400:
+                logger.error('Webhook rejected %d events: %s %s', count, resp.status_code, resp.text[:200])
+                self.counters['failed'] += count
+                return
+            self.counters['sent'] += count
+            self.counters['posts'] += 1
+            return
+        logger.error('Giving up on webhook post of %d events', count)
+        self.counters['failed'] += count
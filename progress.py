@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import discord
+
+from joinplan import format_duration
+
+logger = logging.getLogger('oauth-verify')
+
+# Interaction tokens (and the followup messages edited through them) expire after 15 minutes
+INTERACTION_TOKEN_LIFETIME = 15 * 60
+# Leave the interaction message this long before its token expires
+EXPIRY_MARGIN = 60
+
+
+class JobProgress:
+    """The latest numbers of one running job and a short history of them for the rate and ETA.
+
+    The rate is measured over the last `rate_window` seconds, so it follows pauses
+    and speed-ups instead of averaging over the whole run.
+    """
+
+    def __init__(self, title, rate_window=60.0):
+        self.title = title
+        self.rate_window = rate_window
+        self.done = 0
+        self.total = 0
+        self.counts = {}
+        self.note = None
+        self.finished = False
+        self.started = time.monotonic()
+        self._samples = deque()      # (monotonic, done), at least a second apart
+
+    def update(self, done, total, counts=None, note=None):
+        now = time.monotonic()
+        self.done, self.total = done, total
+        self.counts = counts or {}
+        self.note = note
+        if not self._samples or now - self._samples[-1][0] >= 1.0:
+            self._samples.append((now, done))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= self.rate_window:
+            self._samples.popleft()
+
+    @property
+    def rate(self):
+        """Items per second over the recent window, or None until there is a second of history."""
+        if not self._samples:
+            return None
+        at, done = self._samples[0]
+        elapsed = time.monotonic() - at
+        return (self.done - done) / elapsed if elapsed >= 1.0 else None
+
+    @property
+    def eta(self):
+        rate = self.rate
+        if not rate:
+            return None
+        return max(0, self.total - self.done) / rate
+
+    def render(self):
+        pct = f' ({self.done / self.total:.0%})' if self.total else ''
+        lines = [f'**{self.title}**', f'{self.done:,} of {self.total:,} done{pct}']
+        if self.counts:
+            lines[-1] += ': ' + ', '.join(f'{value:,} {label}' for label, value in self.counts.items())
+        if self.finished:
+            lines.append(f'Finished in {format_duration(time.monotonic() - self.started)}')
+        else:
+            rate, eta = self.rate, self.eta
+            lines.append(f'Rate {rate:.1f}/s, about {format_duration(eta)} left' if eta is not None
+                         else 'Rate: measuring...')
+        if self.note:
+            lines.append(self.note)
+        return '\n'.join(lines)
+
+
+class ProgressReporter:
+    """One progress message, edited at most every `min_interval` seconds.
+
+    `show()` never waits for Discord: it schedules an edit for as soon as the
+    throttle allows, and the edit renders whatever the job's numbers are by then,
+    so a burst of updates costs one edit. A message sent through an interaction
+    (`for_interaction()`) can only be edited while the interaction token lives;
+    shortly before it expires, or when an edit is refused for an expired token,
+    reporting moves to a new message in `fallback_channel`. Without a fallback
+    channel the reporter goes quiet instead.
+    """
+
+    def __init__(self, message, fallback_channel=None, expires_at=None, min_interval=15.0):
+        self.message = message
+        self.fallback_channel = fallback_channel
+        self.expires_at = expires_at
+        self.min_interval = min_interval
+        self.closed = False
+        self.edits = 0
+        self._progress = None
+        self._last_edit = 0.0
+        self._task = None
+
+    @classmethod
+    def for_interaction(cls, interaction, message, min_interval=15.0):
+        """Reporter for a followup `message` of `interaction`, falling back to the interaction's channel."""
+        age = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        expires_at = time.monotonic() + INTERACTION_TOKEN_LIFETIME - EXPIRY_MARGIN - age
+        return cls(message, interaction.channel, expires_at, min_interval)
+
+    def show(self, progress):
+        """Schedule an edit showing `progress` (a JobProgress); must be called on the event loop."""
+        self._progress = progress
+        if not self.closed and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._edit_when_allowed())
+
+    async def close(self, progress):
+        """Show the final state of `progress` now, past the throttle, and stop reporting."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if not self.closed:
+            await self._edit(progress.render())
+        self.closed = True
+
+    async def _edit_when_allowed(self):
+        wait = self._last_edit + self.min_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await self._edit(self._progress.render())
+
+    async def _edit(self, text):
+        self._last_edit = time.monotonic()
+        if self.expires_at is not None and self._last_edit >= self.expires_at:
+            await self._fall_back(text)
+            return
+        try:
+            await self.message.edit(content=text)
+            self.edits += 1
+        except discord.HTTPException as e:
+            # 401 / 50027: Invalid Webhook Token; 404: the message or interaction is gone
+            if self.expires_at is not None and (e.status in (401, 404) or e.code == 50027):
+                await self._fall_back(text)
+            else:
+                logger.warning('Progress message edit failed: %s', e)
+
+    async def _fall_back(self, text):
+        self.expires_at = None
+        if self.fallback_channel is None:
+            logger.info('Interaction token expired and there is no channel to report progress in')
+            self.closed = True
+            return
+        try:
+            self.message = await self.fallback_channel.send(text)
+            self.edits += 1
+        except discord.HTTPException as e:
+            logger.warning('Could not post progress to #%s: %s', getattr(self.fallback_channel, 'name', '?'), e)
+            self.closed = True
+
+
+class ProgressBoard:
+    """Progress of the jobs running (or watched) in this process and the messages reporting it."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.reporters = {}
+
+    def track(self, job_id, title):
+        """The JobProgress of `job_id`, created on first use."""
+        progress = self.jobs.get(job_id)
+        if progress is None:
+            progress = self.jobs[job_id] = JobProgress(title)
+        return progress
+
+    def watched(self, job_id):
+        return bool(self.reporters.get(job_id))
+
+    def attach(self, job_id, reporter):
+        self.reporters.setdefault(job_id, []).append(reporter)
+        if job_id in self.jobs:
+            reporter.show(self.jobs[job_id])
+
+    def publish(self, job_id, done, total, counts=None, note=None):
+        progress = self.jobs.get(job_id)
+        if progress is None:
+            return
+        progress.update(done, total, counts, note)
+        for reporter in self.reporters.get(job_id, ()):
+            reporter.show(progress)
+
+    async def finish(self, job_id, note=None, title=None):
+        """Mark `job_id` finished, show the final numbers everywhere and forget it.
+
+        A job that failed before anything tracked it is shown under `title` with no numbers.
+        """
+        progress = self.jobs.pop(job_id, None)
+        reporters = self.reporters.pop(job_id, [])
+        if progress is None:
+            progress = JobProgress(title or f'Job #{job_id}')
+        progress.finished = True
+        progress.note = note
+        await asyncio.gather(*(reporter.close(progress) for reporter in reporters))
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+
+import discord
+
+logger = logging.getLogger('oauth-verify')
+
+
+class ReconcileReport:
+    """Drift found (and fixed) by one reconciler run over one slice of a guild."""
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.started_at = time.time()
+        self.scanned = 0
+        self.pass_complete = False
+        self.missing_role = []       # verified members without the member role
+        self.extra_role = []         # members holding the member role with no verification record
+        self.stale_unverified = []   # verified members still holding the Unverified role
+        self.fixed = 0
+        self.failed = 0
+        self.capped = 0
+        self.seconds = 0.0
+        self.note = ''
+
+    @property
+    def drift(self):
+        return len(self.missing_role) + len(self.extra_role) + len(self.stale_unverified)
+
+    def summary(self):
+        text = (f'scanned {self.scanned} members{" (pass complete)" if self.pass_complete else ""}: '
+                f'{len(self.missing_role)} missing member role, {len(self.extra_role)} unverified holders, '
+                f'{len(self.stale_unverified)} verified still Unverified; '
+                f'{self.fixed} fixed, {self.failed} failed')
+        if self.capped:
+            text += f', {self.capped} left for later runs'
+        if self.note:
+            text += f' ({self.note})'
+        return text
+
+
+class Reconciler:
+    """Compares guild membership with stored verification state and repairs role drift.
+
+    Each run scans the next `batch_size` member IDs of a guild (in ID order, from
+    the gateway cache or the member index), so a large guild is covered over
+    several runs without one long pause. Within the slice, drift is three set
+    differences between verified IDs and role holders:
+
+    - verified members missing the member role get it added
+    - verified members still holding the Unverified role get it removed
+    - members holding the member role with no verification record are reported,
+      and only have the role removed when `remove_extra` is set (manual grants
+      are not recorded, so this is opt-in)
+
+    At most `max_changes` role edits are made per run; the rest are picked up by
+    the next pass.
+
+    `load_verified(guild)` returns the set of verified user IDs (blocking; run in
+    a thread) and `roles_for(guild)` returns `(member_role, unverified_role)`.
+    """
+
+    def __init__(self, member_cache, load_verified, roles_for, batch_size=5000, max_changes=200,
+                 remove_extra=False, concurrency=4):
+        self.member_cache = member_cache
+        self.load_verified = load_verified
+        self.roles_for = roles_for
+        self.batch_size = batch_size
+        self.max_changes = max_changes
+        self.remove_extra = remove_extra
+        self.concurrency = concurrency
+        self._cursors = {}
+        self.last_reports = {}
+
+    async def _holders(self, guild, role, candidates):
+        """IDs among `candidates` holding `role`. Uses the cache when the guild is
+        fully chunked, otherwise resolves the candidates one by one."""
+        if role is None or not candidates:
+            return set()
+        if guild.chunked:
+            return {m.id for m in role.members} & candidates
+        holders = set()
+        for user_id in candidates:
+            member = await self.member_cache.get_member(guild, user_id)
+            if member is not None and role in member.roles:
+                holders.add(user_id)
+        return holders
+
+    async def run(self, guild, apply=True):
+        started = time.monotonic()
+        report = ReconcileReport(guild.id)
+        member_role, unverified_role = self.roles_for(guild)
+        if member_role is None:
+            report.note = 'no member role configured'
+            self.last_reports[guild.id] = report
+            return report
+
+        all_ids = sorted(await self.member_cache.member_ids(guild))
+        cursor = self._cursors.get(guild.id, 0)
+        if cursor >= len(all_ids):
+            cursor = 0
+        chunk = set(all_ids[cursor:cursor + self.batch_size])
+        cursor += self.batch_size
+        report.pass_complete = cursor >= len(all_ids)
+        self._cursors[guild.id] = 0 if report.pass_complete else cursor
+        report.scanned = len(chunk)
+
+        verified = await asyncio.to_thread(self.load_verified, guild)
+        verified_here = verified & chunk
+        me = guild.me.id if guild.me is not None else None
+        if not guild.chunked:
+            # the cache misses some holders (lazy/roles/index modes), and finding them all would
+            # mean fetching everyone, so only verified members are checked
+            holders = await self._holders(guild, member_role, verified_here)
+            report.note = f'{self.member_cache.mode} mode: unverified holders not detected'
+        else:
+            holders = {m.id for m in member_role.members if not m.bot} & chunk
+        unverified_holders = await self._holders(guild, unverified_role, verified_here)
+
+        report.missing_role = sorted(verified_here - holders)
+        report.stale_unverified = sorted(unverified_holders)
+        report.extra_role = sorted(holders - verified - {me})
+
+        if apply:
+            changes = [(uid, 'add', member_role) for uid in report.missing_role]
+            changes += [(uid, 'remove', unverified_role) for uid in report.stale_unverified]
+            if self.remove_extra:
+                changes += [(uid, 'remove', member_role) for uid in report.extra_role]
+            report.capped = max(0, len(changes) - self.max_changes)
+            await self._apply(guild, changes[:self.max_changes], report)
+        report.seconds = time.monotonic() - started
+        self.last_reports[guild.id] = report
+        level = logging.INFO if report.drift else logging.DEBUG
+        logger.log(level, 'Reconcile %s: %s in %.1fs', guild.id, report.summary(), report.seconds)
+        return report
+
+    async def full_pass(self, guild, apply=True):
+        """Scan the whole guild from the start, one slice after another."""
+        self._cursors[guild.id] = 0
+        reports = []
+        while True:
+            report = await self.run(guild, apply=apply)
+            reports.append(report)
+            if report.pass_complete or report.scanned == 0:
+                return reports
+            await asyncio.sleep(0)
+
+    async def _apply(self, guild, changes, report):
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def one(user_id, action, role):
+            async with sem:
+                member = await self.member_cache.get_member(guild, user_id)
+                if member is None:
+                    return
+                try:
+                    if action == 'add':
+                        await member.add_roles(role, reason='Role reconciler: verified member')
+                    else:
+                        await member.remove_roles(role, reason='Role reconciler: verification state')
+                    report.fixed += 1
+                except discord.HTTPException as e:
+                    report.failed += 1
+                    logger.warning('Reconcile %s: failed to %s %s for %s: %s', guild.id, action, role, user_id, e)
+
+        await asyncio.gather(*(one(*change) for change in changes))
@@ -0,0 +1,89 @@
+import sys
+from array import array
+from bisect import bisect_right
+from itertools import islice
+
+# Reason codes for role grants; interned so every outcome shares one string object per code
+MANAGED = sys.intern('managed')
+ALREADY_HAS = sys.intern('already_has')
+ABOVE_BOT = sys.intern('higher_or_equal_than_bot')
+
+
+def reason_code(text):
+    """Intern a dynamic reason (e.g. an exception class name) so repeats cost no extra memory."""
+    return sys.intern(str(text))
+
+
+class UserTokens:
+    """Stored users as two parallel columns, sorted by user ID.
+
+    Snowflakes live unboxed in an `array('Q')` (8 bytes each) and access tokens in
+    a plain list, instead of one tuple plus one int object per user. Iterating
+    yields `(user_id, access_token)` pairs built on the fly.
+    """
+
+    __slots__ = ('ids', 'tokens')
+
+    def __init__(self, ids=None, tokens=None):
+        self.ids = ids if ids is not None else array('Q')
+        self.tokens = tokens if tokens is not None else []
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from `(user_id, access_token)` rows in any order."""
+        users = cls()
+        for user_id, token in sorted(rows, key=lambda row: int(row[0])):
+            users.ids.append(int(user_id))
+            users.tokens.append(token)
+        return users
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return zip(self.ids, self.tokens)
+
+    def without(self, exclude):
+        """A new UserTokens minus the IDs in the set `exclude`."""
+        kept = UserTokens()
+        for user_id, token in zip(self.ids, self.tokens):
+            if user_id not in exclude:
+                kept.ids.append(user_id)
+                kept.tokens.append(token)
+        return kept
+
+    def after(self, user_id):
+        """`(user_id, access_token)` pairs with IDs greater than `user_id` (for resuming a job)."""
+        return islice(zip(self.ids, self.tokens), bisect_right(self.ids, user_id), None)
+
+
+class JoinRequests:
+    """URLs and headers of one bulk join, built once per job instead of once per user."""
+
+    __slots__ = ('member_prefix', 'role_suffix', 'headers')
+
+    def __init__(self, api_base, guild_id, bot_token, member_role_id=None):
+        self.member_prefix = f'{api_base}/guilds/{int(guild_id)}/members/'
+        self.role_suffix = f'/roles/{member_role_id}' if member_role_id else None
+        # shared by every request of the job; requests merges it into a new dict and never mutates it
+        self.headers = {'Authorization': f'Bot {bot_token}'}
+
+    def member_url(self, user_id):
+        return self.member_prefix + str(user_id)
+
+    def role_url(self, user_id):
+        return self.member_prefix + str(user_id) + self.role_suffix
+
+
+class RoleOutcome:
+    """Why one role was skipped or failed in a bulk grant."""
+
+    __slots__ = ('role_id', 'name', 'reason')
+
+    def __init__(self, role_id, name, reason):
+        self.role_id = role_id
+        self.name = name
+        self.reason = reason
+
+    def __repr__(self):
+        return f'RoleOutcome({self.role_id}, {self.name!r}, {self.reason!r})'
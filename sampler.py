@@ -0,0 +1,132 @@
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# Worker threads are numbered per request ("Thread-57 (process_request_thread)"); fold them together
+_THREAD_NUMBER = re.compile(r'-\d+')
+MAX_STACKS = 50_000
+# Leaf frames of threads blocked waiting (locks, selectors, queues); kept in the profile, left out of top()
+IDLE_LEAF = re.compile(r'^(\w+\.)?(wait|_wait_for_tstate_lock|select|poll|accept|get|sleep|_worker|readinto|recv_into|'
+                       r'serve_forever|_run_once) \(')
+
+
+def _frame_label(code, lineno):
+    return f'{code.co_qualname if hasattr(code, "co_qualname") else code.co_name} ' \
+           f'({os.path.basename(code.co_filename)}:{lineno})'
+
+
+class SamplingProfiler:
+    """Statistical profiler for the whole process: every thread, plus the running asyncio task.
+
+    `run()` (called on a worker thread) wakes every `interval` seconds, reads
+    `sys._current_frames()` and counts every other thread's stack. Nothing is installed in the profiled code
+    (no tracing hooks), so the cost is one stack walk per thread per sample,
+    taken while the sampler holds the GIL; `overhead` reports the share of wall
+    time that took. On the event-loop thread the stack is prefixed with the name
+    of the task running at that moment, so coroutines are attributed to the
+    command, loop or handler that started them.
+
+    Output is in collapsed-stack format (`thread;task;frame;...;leaf count`), which
+    flamegraph.pl, speedscope and inferno read directly. Only one profile runs at a
+    time per process.
+    """
+
+    _running = threading.Lock()
+
+    def __init__(self, interval=0.005, loop=None, loop_thread=None, max_depth=128):
+        self.interval = max(0.001, interval)
+        self.loop = loop
+        self.loop_thread = loop_thread
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.dropped = 0
+        self.wall = 0.0
+        self.sampling = 0.0
+
+    @property
+    def overhead(self):
+        return self.sampling / self.wall if self.wall else 0.0
+
+    def run(self, seconds):
+        """Profile for `seconds` (blocking; call it from a worker thread). Raises RuntimeError if one is already running."""
+        if not SamplingProfiler._running.acquire(blocking=False):
+            raise RuntimeError('a profile is already running')
+        try:
+            own = threading.get_ident()
+            started = time.perf_counter()
+            deadline = started + seconds
+            next_at = started
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                if now < next_at:
+                    time.sleep(next_at - now)
+                sample_started = time.perf_counter()
+                self._sample(own)
+                self.sampling += time.perf_counter() - sample_started
+                # fixed schedule, but never try to catch up on samples missed while the process was busy
+                next_at = max(next_at + self.interval, time.perf_counter())
+            self.wall = time.perf_counter() - started
+        finally:
+            SamplingProfiler._running.release()
+        return self
+
+    def _sample(self, own):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        frames = sys._current_frames()
+        for ident, frame in frames.items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(_frame_label(frame.f_code, frame.f_lineno))
+                frame = frame.f_back
+            stack.append(_THREAD_NUMBER.sub('', names.get(ident, f'thread {ident}')))
+            if ident == self.loop_thread:
+                stack.insert(-1, self._task_label())
+            self._count(';'.join(reversed(stack)))
+        self.samples += 1
+
+    def _task_label(self):
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            task = None
+        if task is None:
+            return 'task: (event loop)'
+        coro = task.get_coro()
+        name = getattr(coro, '__qualname__', None) or type(coro).__name__
+        return f'task: {name}'
+
+    def _count(self, key):
+        if key in self.stacks or len(self.stacks) < MAX_STACKS:
+            self.stacks[key] += 1
+        else:
+            self.dropped += 1
+            self.stacks['[distinct stack limit reached]'] += 1
+
+    def collapsed(self):
+        """The profile as collapsed-stack text, one `stack count` line per distinct stack."""
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()))
+
+    def top(self, n=5, by='leaf'):
+        """`[(label, samples)]` of the busiest leaf frames (`by='leaf'`) or asyncio tasks (`by='task'`), idle waits excluded."""
+        totals = Counter()
+        for stack, count in self.stacks.items():
+            parts = stack.split(';')
+            if IDLE_LEAF.match(parts[-1]):
+                continue
+            if by == 'task':
+                label = next((p for p in parts if p.startswith('task: ')), None)
+                if label is None:
+                    continue
+            else:
+                label = parts[-1]
+            totals[label] += count
+        return totals.most_common(n)
@@ -0,0 +1,104 @@
+import logging
+import time
+
+import discord
+from discord.ext import commands
+
+logger = logging.getLogger('oauth-verify')
+
+
+def parse_shard_ids(spec):
+    """Parse `"0-3,7"` into `[0, 1, 2, 3, 7]`; an empty spec means all shards (None)."""
+    if not spec or not spec.strip():
+        return None
+    ids = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            lo, hi = part.split('-', 1)
+            ids.update(range(int(lo), int(hi) + 1))
+        else:
+            ids.add(int(part))
+    return sorted(ids)
+
+
+def shard_for_guild(guild_id, shard_count):
+    """The shard Discord routes `guild_id` to (https://discord.com/developers/docs/topics/gateway#sharding)."""
+    return (int(guild_id) >> 22) % max(1, int(shard_count))
+
+
+def make_bot(shard_count=None, shard_ids=None, **options):
+    """Build a plain `commands.Bot`, or an `AutoShardedBot` when sharding is configured.
+
+    `shard_count` may be an int, `'auto'` (let Discord recommend one) or None (not sharded).
+    `shard_ids` limits this process to a subset so several processes can split the shards.
+    """
+    if not shard_count:
+        return commands.Bot(**options)
+    count = None if str(shard_count).lower() == 'auto' else int(shard_count)
+    if shard_ids is not None and count is None:
+        raise ValueError('SHARD_IDS requires an explicit SHARD_COUNT')
+    logger.info('Starting in sharded mode: shard_count=%s shard_ids=%s', count or 'auto', shard_ids or 'all')
+    return commands.AutoShardedBot(shard_count=count, shard_ids=shard_ids, **options)
+
+
+def owns_guild(bot, guild_id):
+    """True when per-guild work for `guild_id` belongs to a shard run by this process."""
+    if bot.shard_count is None or guild_id is None:
+        return True
+    shard_id = shard_for_guild(guild_id, bot.shard_count)
+    owned = getattr(bot, 'shard_ids', None)
+    return owned is None or shard_id in owned
+
+
+def owns_global_work(bot):
+    """Process-wide singleton work (e.g. global command sync) runs on the process holding shard 0."""
+    return owns_guild(bot, 0)
+
+
+class ShardMetrics:
+    """Per-shard latency and guild count, plus this process's gateway event rate.
+
+    Only public API is used: latencies come from `bot.get_shard()`, and events are
+    counted through `on_socket_event_type` (`record_event()`), which discord.py
+    dispatches without saying which shard received the event, so the rate is per
+    process. `sample()` turns the count into a rate on a timer.
+    """
+
+    def __init__(self):
+        self.events = 0
+        self.events_per_sec = 0.0
+        self._last = None
+
+    def record_event(self):
+        self.events += 1
+
+    def sample(self):
+        now = time.monotonic()
+        if self._last is not None and now > self._last[0]:
+            self.events_per_sec = (self.events - self._last[1]) / (now - self._last[0])
+        self._last = (now, self.events)
+
+    @staticmethod
+    def _shard_ids(bot):
+        if isinstance(bot, discord.AutoShardedClient):
+            return sorted(bot.shards)
+        return [bot.shard_id or 0]
+
+    def snapshot(self, bot):
+        guild_counts = {}
+        for guild in bot.guilds:
+            guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+        rows = []
+        for shard_id in self._shard_ids(bot):
+            info = bot.get_shard(shard_id) if isinstance(bot, discord.AutoShardedClient) else None
+            latency = info.latency if info is not None else bot.latency
+            rows.append({
+                'shard_id': shard_id,
+                'latency_ms': round(latency * 1000, 1) if latency == latency and latency != float('inf') else None,
+                'closed': info.is_closed() if info is not None else bot.is_closed(),
+                'guilds': guild_counts.get(shard_id, 0),
+            })
+        return rows
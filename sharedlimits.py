@@ -0,0 +1,194 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('oauth-verify')
+
+# Path segments whose id is a "major parameter": Discord rate-limits each value separately
+_MAJOR = ('channels', 'guilds', 'webhooks')
+_ID = re.compile(r'^\d{5,}$')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS global_limit (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    blocked_until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS routes (
+    route TEXT PRIMARY KEY,
+    bucket TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS buckets (
+    bucket TEXT PRIMARY KEY,
+    lim INTEGER NOT NULL,
+    remaining INTEGER NOT NULL,
+    reset_at REAL NOT NULL,
+    window REAL NOT NULL
+) WITHOUT ROWID;
+'''
+
+
+def route_key(method, url):
+    """`'PUT /guilds/123/members/{id}'`: ids of major parameters kept, all other ids folded."""
+    path = url.split('://', 1)[-1].split('?', 1)[0]
+    parts = path.split('/')[1:]
+    if parts[:1] == ['api']:
+        parts = parts[1:]
+    if parts and re.match(r'^v\d+$', parts[0]):
+        parts = parts[1:]
+    out = []
+    for i, part in enumerate(parts):
+        if _ID.match(part) and not (i and parts[i - 1] in _MAJOR):
+            out.append('{id}')
+        else:
+            out.append(part)
+    return f'{method.upper()} /' + '/'.join(out)
+
+
+def _major(route):
+    match = re.search(r'/(?:channels|guilds|webhooks)/(\d+)', route)
+    return match.group(1) if match else ''
+
+
+class SharedRateLimiter:
+    """Discord REST rate-limit state shared by every thread and process using one bot token.
+
+    State lives in a small SQLite file (WAL, no fsync; it is rebuilt from response
+    headers if lost), so the web workers, the callback thread and the bot's bulk
+    jobs on one host all draw from the same budget:
+
+    - a global token bucket (`global_rate` requests per second) plus any global
+      block announced by a 429
+    - per-bucket `remaining`/`reset_at` learned from `X-RateLimit-*` headers, with
+      routes mapped to buckets through `X-RateLimit-Bucket`
+
+    `reserve()` atomically takes one request from the global and route budgets (one
+    IMMEDIATE transaction) or reports how long to wait; `refund()` returns a
+    reservation that was never sent, and `update()` folds a response back in.
+    """
+
+    def __init__(self, path, global_rate=50.0, global_burst=None, timeout=5.0):
+        self.path = path
+        self.global_rate = float(global_rate)
+        self.global_burst = float(global_burst or global_rate)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._ready = False
+        self._ready_lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            with self._ready_lock:
+                if not self._ready:
+                    # created on first use, so importing the module never touches the disk
+                    conn.executescript(_SCHEMA)
+                    conn.execute('INSERT OR IGNORE INTO global_limit (id, tokens, updated_at, blocked_until) '
+                                 'VALUES (1, ?, ?, 0)', (self.global_burst, time.time()))
+                    self._ready = True
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, fn):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn, time.time())
+            conn.execute('COMMIT')
+            return result
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def reserve(self, route):
+        """Take one request for `route`; returns 0.0 on success or the seconds to wait first."""
+        def _reserve(conn, now):
+            tokens, updated_at, blocked_until = conn.execute(
+                'SELECT tokens, updated_at, blocked_until FROM global_limit WHERE id = 1').fetchone()
+            if blocked_until > now:
+                return blocked_until - now
+            tokens = min(self.global_burst, tokens + (now - updated_at) * self.global_rate)
+            if tokens < 1:
+                return (1 - tokens) / self.global_rate
+            row = conn.execute('SELECT b.bucket, b.lim, b.remaining, b.reset_at, b.window FROM routes r '
+                               'JOIN buckets b ON b.bucket = r.bucket WHERE r.route = ?', (route,)).fetchone()
+            if row is not None:
+                bucket, lim, remaining, reset_at, window = row
+                if reset_at <= now:
+                    # a new window opens with this request; its length is the longest seen for the bucket
+                    remaining, reset_at = lim, now + window
+                if remaining < 1:
+                    return reset_at - now
+                conn.execute('UPDATE buckets SET remaining = ?, reset_at = ? WHERE bucket = ?',
+                             (remaining - 1, reset_at, bucket))
+            conn.execute('UPDATE global_limit SET tokens = ?, updated_at = ? WHERE id = 1', (tokens - 1, now))
+            return 0.0
+        return self._transaction(_reserve)
+
+    def acquire(self, route, timeout=None):
+        """Block until a request for `route` is reserved; returns seconds waited.
+
+        Raises TimeoutError if that would take longer than `timeout`.
+        """
+        started = time.monotonic()
+        while True:
+            wait = self.reserve(route)
+            if wait <= 0:
+                return time.monotonic() - started
+            if timeout is not None and time.monotonic() - started + wait > timeout:
+                raise TimeoutError(f'rate limit for {route} would need {wait:.1f}s more')
+            time.sleep(min(wait, 5.0))
+
+    def bucket(self, route):
+        """`(bucket, limit, window_seconds)` learned for `route`, or None before its first response."""
+        return self._conn().execute('SELECT b.bucket, b.lim, b.window FROM routes r JOIN buckets b ON b.bucket = r.bucket '
+                                    'WHERE r.route = ?', (route,)).fetchone()
+
+    def refund(self, route):
+        """Give back a reservation whose request was never sent."""
+        def _refund(conn, now):
+            conn.execute('UPDATE global_limit SET tokens = MIN(?, tokens + 1) WHERE id = 1', (self.global_burst,))
+            conn.execute('UPDATE buckets SET remaining = MIN(lim, remaining + 1) WHERE reset_at > ? AND bucket = '
+                         '(SELECT bucket FROM routes WHERE route = ?)', (now, route))
+        self._transaction(_refund)
+
+    def update(self, route, status, headers):
+        """Fold a response's rate-limit headers (and 429s) into the shared state."""
+        bucket_hash = headers.get('X-RateLimit-Bucket')
+        limit = headers.get('X-RateLimit-Limit')
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset_after = headers.get('X-RateLimit-Reset-After')
+        retry_after = headers.get('Retry-After')
+        is_global = headers.get('X-RateLimit-Global', '').lower() == 'true' or headers.get('X-RateLimit-Scope') == 'global'
+        if status != 429 and not (bucket_hash and limit and remaining and reset_after):
+            return
+
+        def _update(conn, now):
+            if status == 429 and is_global:
+                conn.execute('UPDATE global_limit SET blocked_until = MAX(blocked_until, ?) WHERE id = 1',
+                             (now + float(retry_after or reset_after or 1),))
+                logger.warning('Global rate limit hit; all senders paused for %ss', retry_after)
+                return
+            if not bucket_hash:
+                return
+            bucket = f'{bucket_hash}:{_major(route)}'
+            conn.execute('INSERT OR REPLACE INTO routes (route, bucket) VALUES (?, ?)', (route, bucket))
+            new_remaining = 0 if status == 429 else int(remaining)
+            reset_in = float(reset_after or retry_after or 1)
+            new_reset = now + reset_in
+            window = reset_in
+            row = conn.execute('SELECT remaining, reset_at, window FROM buckets WHERE bucket = ?', (bucket,)).fetchone()
+            if row is not None:
+                window = max(window, row[2])
+                if row[1] > now and abs(row[1] - new_reset) < 1.0:
+                    # same window: other senders' reservations may not be reflected in this header yet
+                    new_remaining = min(new_remaining, row[0])
+            conn.execute('INSERT OR REPLACE INTO buckets (bucket, lim, remaining, reset_at, window) '
+                         'VALUES (?, ?, ?, ?, ?)', (bucket, int(limit or 1), new_remaining, new_reset, window))
+        self._transaction(_update)
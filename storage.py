@@ -0,0 +1,393 @@
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import events
+
+# Job states
+PENDING, RUNNING, DONE, FAILED, CANCELLED = 'pending', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class Storage(ABC):
+    """Persistence used by the bot and web tier: tokens, guild config, jobs and events.
+
+    Methods are blocking; call them from async code through `asyncio.to_thread`.
+    IDs are taken as int or digit strings and returned as int. Backends must pass
+    tests/test_storage.py.
+    """
+
+    # tokens
+    @abstractmethod
+    def save_token(self, user_id, access_token, token_type, scope, expires_at, validated_at=None):
+        ...
+
+    @abstractmethod
+    def get_token(self, user_id):
+        """`(access_token, token_type, scope, expires_at)` or None."""
+
+    @abstractmethod
+    def delete_token(self, user_id):
+        ...
+
+    @abstractmethod
+    def all_users(self):
+        """`[(user_id, access_token)]` for every stored token."""
+
+    @abstractmethod
+    def live_users(self, now=None):
+        """`[(user_id, access_token)]` for tokens that have not expired or failed validation."""
+
+    @abstractmethod
+    def count_live_tokens(self, now=None):
+        ...
+
+    @abstractmethod
+    def add_verified(self, guild_id, user_id):
+        """Record that `user_id` verified in `guild_id` (durable)."""
+
+    @abstractmethod
+    def verified_ids(self, guild_id, include_oauth_users=False):
+        """IDs with a verification record in `guild_id`, plus every token holder if asked."""
+
+    # guild config
+    @abstractmethod
+    def save_guild_config(self, guild_id, verify_channel_id=None, unverified_role_id=None, rules_role_id=None):
+        ...
+
+    @abstractmethod
+    def get_guild_config(self, guild_id):
+        """`(verify_channel_id, unverified_role_id, rules_role_id)`, all None when unset."""
+
+    # jobs
+    @abstractmethod
+    def create_job(self, kind, guild_id=None, payload=None):
+        """Store a new PENDING job and return its id."""
+
+    @abstractmethod
+    def update_job(self, job_id, status=None, progress=None):
+        ...
+
+    @abstractmethod
+    def get_job(self, job_id):
+        """A dict with id, kind, guild_id, status, payload, progress, created_at, updated_at; or None."""
+
+    @abstractmethod
+    def list_jobs(self, status=None, kind=None):
+        """Jobs (as `get_job` dicts) filtered by status and kind, oldest first."""
+
+    # events
+    @abstractmethod
+    def record_event(self, kind, guild_id=None, user_id=None, detail=None, ts=None):
+        ...
+
+    @abstractmethod
+    def event_stats(self, guild_id=0, now=None):
+        """Per-kind counts for `today`, `last_24h` and `last_7d`; see `events.read_stats`."""
+
+    def flush(self):
+        """Wait until fire-and-forget writes (events) are visible to reads."""
+
+    def close(self):
+        pass
+
+
+def _id(value):
+    if value is None or not str(value).isdigit():
+        return None
+    return int(value)
+
+
+def _now(now):
+    return int(now if now is not None else time.time())
+
+
+class SQLiteStorage(Storage):
+    """The tokens.db backend. Reads use a short-lived connection per call (WAL allows
+    them alongside the writer); writes go through `writer` (a WriteBehindBuffer)
+    once one is attached, waiting for the group commit where durability matters."""
+
+    def __init__(self, path, writer=None, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self.writer = writer
+        self._events = events.EventLog(writer)
+
+    def attach_writer(self, writer):
+        self.writer = writer
+        self._events.writer = writer
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=self.timeout)
+
+    def _read(self, sql, params=()):
+        conn = self.connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def _write(self, sql, params=()):
+        """Durable write: returns once the statement is committed."""
+        if self.writer is not None:
+            self.writer.submit(sql, params).result()
+            return
+        conn = self.connect()
+        try:
+            conn.execute(sql, params)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def save_token(self, user_id, access_token, token_type, scope, expires_at, validated_at=None):
+        self._write('REPLACE INTO users (user_id, access_token, token_type, scope, expires_at, valid, validated_at) '
+                    'VALUES (?,?,?,?,?,?,?)',
+                    (int(user_id), access_token, token_type, scope, int(expires_at),
+                     1 if validated_at else None, validated_at))
+
+    def get_token(self, user_id):
+        rows = self._read('SELECT access_token, token_type, scope, expires_at FROM users WHERE user_id = ?',
+                          (int(user_id),))
+        return tuple(rows[0]) if rows else None
+
+    def delete_token(self, user_id):
+        self._write('DELETE FROM users WHERE user_id = ?', (int(user_id),))
+
+    def all_users(self):
+        return self._read('SELECT user_id, access_token FROM users')
+
+    def live_users(self, now=None):
+        return self._read('SELECT user_id, access_token FROM users WHERE expires_at > ? AND (valid IS NULL OR valid = 1)',
+                          (_now(now),))
+
+    def count_live_tokens(self, now=None):
+        # served by idx_users_expires_at
+        return self._read('SELECT COUNT(*) FROM users WHERE expires_at > ? AND (valid IS NULL OR valid = 1)',
+                          (_now(now),))[0][0]
+
+    def add_verified(self, guild_id, user_id):
+        self._write('INSERT OR REPLACE INTO verified (guild_id, discord_id) VALUES (?, ?)', (int(guild_id), int(user_id)))
+
+    def verified_ids(self, guild_id, include_oauth_users=False):
+        conn = self.connect()
+        try:
+            ids = {row[0] for row in conn.execute('SELECT discord_id FROM verified WHERE guild_id = ?', (int(guild_id),))}
+            if include_oauth_users:
+                ids.update(row[0] for row in conn.execute('SELECT user_id FROM users'))
+        finally:
+            conn.close()
+        return ids
+
+    def save_guild_config(self, guild_id, verify_channel_id=None, unverified_role_id=None, rules_role_id=None):
+        self._write('REPLACE INTO guild_config (guild_id, verify_channel_id, unverified_role_id, rules_role_id) VALUES (?,?,?,?)',
+                    (int(guild_id), _id(verify_channel_id), _id(unverified_role_id), _id(rules_role_id)))
+
+    def get_guild_config(self, guild_id):
+        rows = self._read('SELECT verify_channel_id, unverified_role_id, rules_role_id FROM guild_config WHERE guild_id = ?',
+                          (int(guild_id),))
+        return tuple(rows[0]) if rows else (None, None, None)
+
+    def create_job(self, kind, guild_id=None, payload=None):
+        now = int(time.time())
+        # needs the new row id back, so this one bypasses the write-behind buffer
+        conn = self.connect()
+        try:
+            cur = conn.execute('INSERT INTO jobs (kind, guild_id, status, payload, progress, created_at, updated_at) '
+                               'VALUES (?,?,?,?,?,?,?)',
+                               (kind, _id(guild_id), PENDING, json.dumps(payload or {}), json.dumps({}), now, now))
+            conn.commit()
+            return cur.lastrowid
+        finally:
+            conn.close()
+
+    def update_job(self, job_id, status=None, progress=None):
+        sets, params = ['updated_at = ?'], [int(time.time())]
+        if status is not None:
+            sets.append('status = ?')
+            params.append(status)
+        if progress is not None:
+            sets.append('progress = ?')
+            params.append(json.dumps(progress))
+        self._write(f'UPDATE jobs SET {", ".join(sets)} WHERE id = ?', (*params, int(job_id)))
+
+    @staticmethod
+    def _job_row(row):
+        job_id, kind, guild_id, status, payload, progress, created_at, updated_at = row
+        return {'id': job_id, 'kind': kind, 'guild_id': guild_id, 'status': status,
+                'payload': json.loads(payload or '{}'), 'progress': json.loads(progress or '{}'),
+                'created_at': created_at, 'updated_at': updated_at}
+
+    _JOB_COLUMNS = 'id, kind, guild_id, status, payload, progress, created_at, updated_at'
+
+    def get_job(self, job_id):
+        rows = self._read(f'SELECT {self._JOB_COLUMNS} FROM jobs WHERE id = ?', (int(job_id),))
+        return self._job_row(rows[0]) if rows else None
+
+    def list_jobs(self, status=None, kind=None):
+        where, params = [], []
+        if status is not None:
+            where.append('status = ?')
+            params.append(status)
+        if kind is not None:
+            where.append('kind = ?')
+            params.append(kind)
+        sql = f'SELECT {self._JOB_COLUMNS} FROM jobs'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        return [self._job_row(row) for row in self._read(sql + ' ORDER BY id', params)]
+
+    def record_event(self, kind, guild_id=None, user_id=None, detail=None, ts=None):
+        if self.writer is not None:
+            self._events.record(kind, guild_id, user_id, detail, ts)
+            return
+        # no buffer attached (tools, benchmarks): write the event and its rollups in one transaction
+        conn = self.connect()
+        try:
+            with conn:
+                events.EventLog(_DirectWriter(conn)).record(kind, guild_id, user_id, detail, ts)
+        finally:
+            conn.close()
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def event_stats(self, guild_id=0, now=None):
+        conn = self.connect()
+        try:
+            return events.read_stats(conn, guild_id, now)
+        finally:
+            conn.close()
+
+
+class _DirectWriter:
+    """Minimal stand-in for WriteBehindBuffer.submit() that executes on one connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def submit(self, sql, params=()):
+        self.conn.execute(sql, params)
+
+
+class MemoryStorage(Storage):
+    """Process-local backend for benchmarks, tests and dry runs. Nothing survives a restart."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._validity = {}
+        self._verified = set()
+        self._guild_config = {}
+        self._jobs = {}
+        self._next_job = 1
+        self._events = []
+        self._hourly = {}
+        self._daily = {}
+
+    def save_token(self, user_id, access_token, token_type, scope, expires_at, validated_at=None):
+        with self._lock:
+            self._tokens[int(user_id)] = (access_token, token_type, scope, int(expires_at))
+            self._validity[int(user_id)] = 1 if validated_at else None
+
+    def get_token(self, user_id):
+        return self._tokens.get(int(user_id))
+
+    def delete_token(self, user_id):
+        with self._lock:
+            self._tokens.pop(int(user_id), None)
+            self._validity.pop(int(user_id), None)
+
+    def all_users(self):
+        with self._lock:
+            return [(uid, t[0]) for uid, t in self._tokens.items()]
+
+    def live_users(self, now=None):
+        now = _now(now)
+        with self._lock:
+            return [(uid, t[0]) for uid, t in self._tokens.items()
+                    if t[3] > now and self._validity.get(uid) in (None, 1)]
+
+    def count_live_tokens(self, now=None):
+        return len(self.live_users(now))
+
+    def add_verified(self, guild_id, user_id):
+        with self._lock:
+            self._verified.add((int(guild_id), int(user_id)))
+
+    def verified_ids(self, guild_id, include_oauth_users=False):
+        with self._lock:
+            ids = {uid for gid, uid in self._verified if gid == int(guild_id)}
+            if include_oauth_users:
+                ids.update(self._tokens)
+        return ids
+
+    def save_guild_config(self, guild_id, verify_channel_id=None, unverified_role_id=None, rules_role_id=None):
+        with self._lock:
+            self._guild_config[int(guild_id)] = (_id(verify_channel_id), _id(unverified_role_id), _id(rules_role_id))
+
+    def get_guild_config(self, guild_id):
+        return self._guild_config.get(int(guild_id), (None, None, None))
+
+    def create_job(self, kind, guild_id=None, payload=None):
+        now = int(time.time())
+        with self._lock:
+            job_id = self._next_job
+            self._next_job += 1
+            self._jobs[job_id] = {'id': job_id, 'kind': kind, 'guild_id': _id(guild_id), 'status': PENDING,
+                                  'payload': json.loads(json.dumps(payload or {})), 'progress': {},
+                                  'created_at': now, 'updated_at': now}
+        return job_id
+
+    def update_job(self, job_id, status=None, progress=None):
+        with self._lock:
+            job = self._jobs.get(int(job_id))
+            if job is None:
+                return
+            job['updated_at'] = int(time.time())
+            if status is not None:
+                job['status'] = status
+            if progress is not None:
+                job['progress'] = json.loads(json.dumps(progress))
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(int(job_id))
+            return json.loads(json.dumps(job)) if job else None
+
+    def list_jobs(self, status=None, kind=None):
+        with self._lock:
+            jobs = [job for _, job in sorted(self._jobs.items())
+                    if (status is None or job['status'] == status) and (kind is None or job['kind'] == kind)]
+            return json.loads(json.dumps(jobs))
+
+    def record_event(self, kind, guild_id=None, user_id=None, detail=None, ts=None):
+        ts = _now(ts)
+        with self._lock:
+            self._events.append((ts, kind, _id(guild_id), _id(user_id), detail))
+            for guild in {0, _id(guild_id) or 0}:
+                for rollup, size in ((self._hourly, events.HOUR), (self._daily, events.DAY)):
+                    key = (ts - ts % size, kind, guild)
+                    rollup[key] = rollup.get(key, 0) + 1
+
+    def event_stats(self, guild_id=0, now=None):
+        now = _now(now)
+        guild_id = _id(guild_id) or 0
+        hour_start = now - now % events.HOUR
+        day_start = now - now % events.DAY
+        stats = {'today': {}, 'last_24h': {}, 'last_7d': {}}
+        with self._lock:
+            for days_back in range(7):
+                period = day_start - days_back * events.DAY
+                for (start, kind, guild), count in self._daily.items():
+                    if start == period and guild == guild_id:
+                        stats['last_7d'][kind] = stats['last_7d'].get(kind, 0) + count
+                        if days_back == 0:
+                            stats['today'][kind] = count
+            for (start, kind, guild), count in self._hourly.items():
+                if hour_start - 24 * events.HOUR < start <= hour_start and guild == guild_id:
+                    stats['last_24h'][kind] = stats['last_24h'].get(kind, 0) + count
+        return stats
+
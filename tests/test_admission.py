@@ -0,0 +1,33 @@
+from flask import Flask
+
+import admission
+from admission import AdmissionController
+
+
+def _app(trust_forwarded):
+    app = Flask(__name__)
+
+    @app.route('/callback')
+    def callback():
+        return 'ok'
+
+    controller = AdmissionController(per_ip_rate=0.001, per_ip_burst=2, global_rate=1000, global_burst=1000)
+    admission.install(app, controller, ('callback',), trust_forwarded=trust_forwarded)
+    return app.test_client()
+
+
+def test_spoofed_forwarded_for_does_not_get_a_fresh_bucket():
+    client = _app(trust_forwarded=True)
+    statuses = []
+    for i in range(4):
+        # the client invents the left entry; the proxy appends the real address
+        headers = {'X-Forwarded-For': f'10.0.0.{i}, 203.0.113.7'}
+        statuses.append(client.get('/callback', headers=headers).status_code)
+    assert statuses == [200, 200, 429, 429]
+
+
+def test_forwarded_for_ignored_unless_trusted():
+    client = _app(trust_forwarded=False)
+    statuses = [client.get('/callback', headers={'X-Forwarded-For': f'10.0.0.{i}'}).status_code
+                for i in range(3)]
+    assert statuses == [200, 200, 429]
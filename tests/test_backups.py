@@ -0,0 +1,40 @@
+import multiprocessing
+import threading
+import time
+
+from backups import BackupStore
+
+
+def _hold_lock(root, locked, release):
+    store = BackupStore(root)
+    with store._locked():
+        locked.set()
+        release.wait(10)
+
+
+def test_retention_keeps_objects_shared_with_remaining_snapshots(tmp_path):
+    store = BackupStore(str(tmp_path))
+    shared = {'kind': 'role', 'id': 1, 'name': 'shared'}
+    store.write_snapshot(1, {}, [shared, {'kind': 'role', 'id': 2, 'name': 'old'}])
+    second = store.write_snapshot(1, {}, [shared])
+    assert second['reused_objects'] == 1
+
+    assert store.apply_retention(1, keep=1) == (1, 1)
+    assert list(store.iter_records(1, second['name'])) == [shared]
+
+
+def test_lock_excludes_other_processes(tmp_path):
+    ctx = multiprocessing.get_context('fork')
+    locked, release = ctx.Event(), ctx.Event()
+    holder = ctx.Process(target=_hold_lock, args=(str(tmp_path), locked, release))
+    holder.start()
+    try:
+        assert locked.wait(10)
+        store = BackupStore(str(tmp_path))
+        started = time.monotonic()
+        threading.Timer(0.3, release.set).start()
+        store.write_snapshot(1, {}, [{'kind': 'role', 'id': 1, 'name': 'a'}])
+        assert time.monotonic() - started >= 0.25
+    finally:
+        release.set()
+        holder.join(10)
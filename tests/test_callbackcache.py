@@ -0,0 +1,60 @@
+import sqlite3
+import threading
+import time
+
+from callbackcache import RedemptionCache, TTLCache
+from migrations import migrate
+from writebehind import WriteBehindBuffer
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=0.05)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+    time.sleep(0.1)
+    assert cache.get('a') is None
+
+
+def test_concurrent_duplicates_wait_for_the_first_redemption():
+    cache = RedemptionCache()
+    exchanges, seen = [], []
+
+    def callback():
+        with cache.redeeming('code-1') as previous:
+            if previous is None:
+                exchanges.append(1)
+                time.sleep(0.1)
+                cache.remember_outcome('code-1', ['joined'])
+                previous = ['joined']
+        seen.append(previous)
+
+    threads = [threading.Thread(target=callback) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(exchanges) == 1
+    assert seen == [['joined']] * 5
+
+
+def test_outcomes_and_joins_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / 'tokens.db')
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.close()
+    writer = WriteBehindBuffer(path)
+    try:
+        first, second = RedemptionCache(), RedemptionCache()
+        for cache in (first, second):
+            cache.share_via(lambda: sqlite3.connect(path), writer)
+        first.remember_outcome('code-2', ['ok'])
+        first.remember_join(42, 7)
+        writer.flush(5)
+        assert second.outcome('code-2') == ['ok']
+        assert not second.recently_joined(42, 7, shared=False)
+        assert second.recently_joined(42, 7)
+    finally:
+        writer.close()
@@ -0,0 +1,122 @@
+import time
+
+import pytest
+import requests
+
+from circuit import HALF_OPEN, OPEN, ApiClient, BreakerRegistry, CircuitBreaker, CircuitOpenError, RetryPolicy, never_sent
+
+URL = 'https://discord.test/api/guilds/1/members/123456789'
+BOT = {'Authorization': 'Bot x'}
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status_code = status
+        self.headers = {}
+
+
+class FakeSession:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def request(self, method, url, timeout=None, **kwargs):
+        self.calls += 1
+        status = self.statuses.pop(0)
+        if isinstance(status, Exception):
+            raise status
+        return FakeResponse(status)
+
+
+class FakeLimiter:
+    def __init__(self):
+        self.fail_next = False
+        self.refunds = 0
+
+    def acquire(self, route, timeout=None):
+        if self.fail_next:
+            self.fail_next = False
+            raise TimeoutError(route)
+
+    def refund(self, route):
+        self.refunds += 1
+
+    def update(self, route, status, headers):
+        pass
+
+
+def tripped_client(statuses, limiter=None):
+    breakers = BreakerRegistry(failure_threshold=1, open_for=0.05)
+    client = ApiClient(FakeSession(statuses), breakers, RetryPolicy(attempts=1), limiter=limiter)
+    assert client.request('PUT', URL, headers=BOT).status_code == 503
+    time.sleep(0.06)
+    return client, breakers
+
+
+def test_limiter_timeout_does_not_leak_the_probe():
+    limiter = FakeLimiter()
+    client, breakers = tripped_client([503, 204], limiter)
+    limiter.fail_next = True
+    with pytest.raises(TimeoutError):
+        client.request('PUT', URL, headers=BOT)
+    # the probe slot was never taken, so the next call probes and closes the breaker
+    assert client.request('PUT', URL, headers=BOT).status_code == 204
+    assert not breakers.snapshot()
+
+
+def test_open_breaker_fails_fast_and_refunds_nothing():
+    limiter = FakeLimiter()
+    breakers = BreakerRegistry(failure_threshold=1, open_for=10)
+    session = FakeSession([503])
+    client = ApiClient(session, breakers, RetryPolicy(attempts=1), limiter=limiter)
+    client.request('PUT', URL, headers=BOT)
+    with pytest.raises(CircuitOpenError):
+        client.request('PUT', URL, headers=BOT)
+    assert session.calls == 1 and limiter.refunds == 0
+
+
+def test_silent_probe_is_written_off_after_probe_timeout():
+    breaker = CircuitBreaker('x', failure_threshold=1, open_for=0.01, probe_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    time.sleep(0.02)
+    breaker.allow()                  # a probe that never reports back
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.failures == 0 and breaker.retry_after() == 0
+
+
+def _connect_failure():
+    from urllib3.exceptions import MaxRetryError, NewConnectionError
+    return requests.ConnectionError(MaxRetryError(None, URL, NewConnectionError(None, 'refused')))
+
+
+def test_only_connect_failures_count_as_never_sent():
+    from urllib3.exceptions import ProtocolError
+    assert never_sent(requests.ConnectTimeout())
+    assert never_sent(_connect_failure())
+    assert not never_sent(requests.ConnectionError(ProtocolError('Connection aborted.', 'RemoteDisconnected')))
+    assert not never_sent(requests.ReadTimeout())
+
+
+def test_non_idempotent_request_is_not_replayed_after_a_dropped_connection():
+    from urllib3.exceptions import ProtocolError
+    limiter = FakeLimiter()
+    dropped = requests.ConnectionError(ProtocolError('Connection aborted.', 'RemoteDisconnected'))
+    session = FakeSession([dropped, 200])
+    client = ApiClient(session, BreakerRegistry(), RetryPolicy(attempts=3, base_delay=0.001), limiter=limiter)
+    with pytest.raises(requests.ConnectionError):
+        client.request('POST', URL, idempotent=False, headers=BOT)
+    assert session.calls == 1 and limiter.refunds == 0
+
+
+def test_non_idempotent_request_is_retried_after_a_connect_failure():
+    limiter = FakeLimiter()
+    session = FakeSession([_connect_failure(), 200])
+    client = ApiClient(session, BreakerRegistry(), RetryPolicy(attempts=3, base_delay=0.001), limiter=limiter)
+    assert client.request('POST', URL, idempotent=False, headers=BOT).status_code == 200
+    assert session.calls == 2 and limiter.refunds == 1
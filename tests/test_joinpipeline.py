@@ -0,0 +1,51 @@
+import asyncio
+import threading
+
+from joinpipeline import JoinPipeline
+
+
+class FakeGuild:
+    id = 1
+
+    def __init__(self):
+        self.members = {}
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+
+class FakeMember:
+    def __init__(self, guild, member_id, roles=()):
+        self.guild = guild
+        self.id = member_id
+        self.roles = list(roles)
+        guild.members[member_id] = self
+
+    async def add_roles(self, role, reason=None):
+        self.roles.append(role)
+
+
+def test_batch_resolves_the_role_off_the_event_loop():
+    guild = FakeGuild()
+    role_threads = []
+
+    def role_for(g):
+        # stands in for a blocking guild config read
+        role_threads.append(threading.get_ident())
+        return 'unverified'
+
+    async def scenario():
+        pipeline = JoinPipeline(role_for, should_skip=lambda m: m.id == 3, flush_interval=0.01)
+        members = [FakeMember(guild, i) for i in (1, 2, 3)]
+        members.append(FakeMember(guild, 4, roles=['unverified']))
+        for member in members + members[:1]:
+            pipeline.enqueue(member)
+        await asyncio.sleep(0.2)
+        await pipeline.close()
+        return pipeline, members, threading.get_ident()
+
+    pipeline, members, loop_thread = asyncio.run(scenario())
+    assert len(role_threads) == 1 and role_threads[0] != loop_thread
+    assert [m.roles for m in members] == [['unverified'], ['unverified'], [], ['unverified']]
+    assert pipeline.counters['applied'] == 2 and pipeline.counters['skipped'] == 2
+    assert pipeline.counters['batches'] == 1
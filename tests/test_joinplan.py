@@ -0,0 +1,43 @@
+from joinplan import JoinPlan, estimate, format_duration
+from records import UserTokens
+from sharedlimits import SharedRateLimiter
+
+ROUTES = ['PUT /guilds/1/members/{id}', 'PUT /guilds/1/members/{id}/roles/{id}']
+
+
+class FakeClient:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def latency_stats(self, route):
+        return self.stats.get(route)
+
+
+def _plan():
+    live = UserTokens.from_rows([(3, 'c'), (1, 'a'), (2, 'b'), (4, 'd')])
+    return JoinPlan(1, stored=6, live_users=live, member_ids={2, 4})
+
+
+def test_plan_counts_and_resume_order():
+    plan = _plan()
+    assert (plan.live, plan.expired, plan.already_members, plan.size) == (4, 2, 2, 2)
+    assert list(plan.users) == [(1, 'a'), (3, 'c')]
+    assert list(_plan().users.after(1)) == [(3, 'c')]
+
+
+def test_estimate_uses_the_slower_of_latency_and_rate_limit_spacing(tmp_path):
+    limiter = SharedRateLimiter(str(tmp_path / 'limits.db'), global_rate=50)
+    client = FakeClient({route: (10, 0.1, 0.4) for route in ROUTES})
+    assert estimate(_plan(), ROUTES, limiter, client).per_user == 0.2
+
+    # both routes draw from one learned bucket of 10 requests per 10s
+    for route in ROUTES:
+        limiter.update(route, 200, {'X-RateLimit-Bucket': 'shared', 'X-RateLimit-Limit': '10',
+                                    'X-RateLimit-Remaining': '9', 'X-RateLimit-Reset-After': '10'})
+    plan = estimate(_plan(), ROUTES, limiter, client)
+    assert (plan.per_user, plan.per_user_high, plan.eta) == (2.0, 2.0, 4.0)
+    assert 'Estimated time: 4s' in plan.summary()
+
+
+def test_format_duration():
+    assert [format_duration(s) for s in (59.4, 61, 3 * 3600 + 5 * 60)] == ['59s', '1m 01s', '3h 05m']
@@ -0,0 +1,78 @@
+import sqlite3
+
+import pytest
+
+from leases import LeaseManager
+from migrations import migrate
+
+NAME = 'all:bulk-jobs'
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'tokens.db')
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.execute('CREATE TABLE writes (token INTEGER)')
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _expire(db_path):
+    # the holder stopped renewing and its ttl ran out
+    conn = sqlite3.connect(db_path)
+    conn.execute('UPDATE leases SET expires_at = 0 WHERE name = ?', (NAME,))
+    conn.commit()
+    conn.close()
+
+
+def _writes(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in conn.execute('SELECT token FROM writes')]
+    finally:
+        conn.close()
+
+
+def test_one_holder_at_a_time(db_path):
+    a = LeaseManager(db_path, [NAME], owner_id='a')
+    b = LeaseManager(db_path, [NAME], owner_id='b')
+    assert a.acquire(NAME) == 1
+    assert b.acquire(NAME) is None
+    assert a.acquire(NAME) == 1, 'renewal keeps the token'
+    assert a.holds(NAME) and not b.holds(NAME)
+
+
+def test_takeover_bumps_the_token_and_fences_the_stale_owner(db_path):
+    a = LeaseManager(db_path, [NAME], owner_id='a')
+    b = LeaseManager(db_path, [NAME], owner_id='b')
+    old = a.acquire(NAME)
+    _expire(db_path)
+    new = b.acquire(NAME)
+    assert new == old + 1
+
+    # a paused leader wakes up and writes with the token it still has
+    assert not a.fenced(NAME, old, 'INSERT INTO writes VALUES (?)', (old,))
+    assert not a.holds(NAME)
+    assert b.fenced(NAME, new, 'INSERT INTO writes VALUES (?)', (new,))
+    assert _writes(db_path) == [new]
+
+
+def test_release_hands_over_without_waiting_for_the_ttl(db_path):
+    a = LeaseManager(db_path, [NAME], owner_id='a', ttl=60, renew_interval=5)
+    b = LeaseManager(db_path, [NAME], owner_id='b', ttl=60, renew_interval=5)
+    a.acquire(NAME)
+    a.release(NAME)
+    assert b.acquire(NAME) == 2
+    assert a.acquire(NAME) is None
+
+
+def test_a_restarted_owner_is_a_new_owner(db_path):
+    first = LeaseManager(db_path, [NAME])
+    token = first.acquire(NAME)
+    _expire(db_path)
+    # same host and pid after a restart, but a fresh owner id: the old token is dead
+    second = LeaseManager(db_path, [NAME])
+    assert second.acquire(NAME) == token + 1
+    assert not first.fenced(NAME, token, 'INSERT INTO writes VALUES (?)', (token,))
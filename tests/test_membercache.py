@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+import discord
+from discord.state import ConnectionState
+
+from membercache import MemberCachePolicy
+
+TRACKED = 5
+
+
+def _role(role_id, name, position):
+    return {'id': str(role_id), 'name': name, 'permissions': '0', 'position': position, 'color': 0,
+            'hoist': False, 'managed': False, 'mentionable': False}
+
+
+class _Guild(discord.Guild):
+    """A real Guild whose REST methods tests can replace."""
+
+
+def _guild():
+    state = ConnectionState(dispatch=lambda *a: None, handlers={}, hooks={}, http=None,
+                            intents=discord.Intents.default(), member_cache_flags=discord.MemberCacheFlags.none())
+    state.user = discord.ClientUser(state=state, data={'id': '7', 'username': 'bot', 'discriminator': '0', 'avatar': None})
+    return _Guild(data={'id': '1', 'name': 'guild', 'member_count': 2,
+                          'roles': [_role(1, '@everyone', 0), _role(TRACKED, 'member', 1)]}, state=state)
+
+
+def _member(guild, user_id, roles=()):
+    data = {'user': {'id': str(user_id), 'username': f'u{user_id}', 'discriminator': '0', 'avatar': None},
+            'roles': [str(r) for r in roles], 'joined_at': None, 'flags': 0}
+    return discord.Member(data=data, guild=guild, state=guild._state)
+
+
+def test_roles_mode_caches_only_tracked_role_holders():
+    # remember() edits the guild's member map through discord.py internals; this pins that behaviour
+    guild = _guild()
+    policy = MemberCachePolicy('roles', tracked_roles=lambda g: {TRACKED})
+    policy.remember(_member(guild, 42, roles=[TRACKED]))
+    policy.remember(_member(guild, 43))
+    assert guild.get_member(42) is not None
+    assert guild.get_member(43) is None
+    assert policy.index.contains(guild.id, 43)
+
+    policy.remember(_member(guild, 42))
+    assert guild.get_member(42) is None
+
+
+def test_uncached_member_gaining_a_tracked_role_is_fetched_and_cached():
+    guild = _guild()
+    policy = MemberCachePolicy('roles', tracked_roles=lambda g: {TRACKED})
+    fetched = []
+
+    async def fetch_member(user_id):
+        fetched.append(user_id)
+        return _member(guild, user_id, roles=[TRACKED])
+    guild.fetch_member = fetch_member
+
+    msg = json.dumps({'op': 0, 't': 'GUILD_MEMBER_UPDATE', 's': 3,
+                      'd': {'guild_id': '1', 'user': {'id': '42'}, 'roles': [str(TRACKED)]}})
+    update = policy.member_update_from_gateway(msg)
+    assert update == (1, 42, {TRACKED})
+    asyncio.run(policy.member_updated(guild, *update[1:]))
+    assert fetched == [42]
+    assert guild.get_member(42) is not None
+
+    asyncio.run(policy.member_updated(guild, 43, set()))
+    assert fetched == [42]
+    assert policy.member_update_from_gateway('{"op": 0, "t": "MESSAGE_CREATE", "d": {}}') is None
+
+
+def test_lazy_lookup_fetches_one_member_without_chunking():
+    guild = _guild()
+    policy = MemberCachePolicy('lazy')
+
+    async def chunk(**kwargs):
+        raise AssertionError('a single lookup must not chunk the guild')
+
+    async def fetch_member(user_id):
+        return _member(guild, user_id)
+    guild.chunk, guild.fetch_member = chunk, fetch_member
+    assert asyncio.run(policy.get_member(guild, 42)).id == 42
+
+
+def test_lazy_member_ids_stream_without_caching():
+    guild = _guild()
+    policy = MemberCachePolicy('lazy')
+
+    async def chunk(**kwargs):
+        raise AssertionError('a join plan must not chunk the guild')
+
+    async def fetch_members(limit=1000):
+        for user_id in (42, 43):
+            yield _member(guild, user_id)
+    guild.chunk, guild.fetch_members = chunk, fetch_members
+    assert asyncio.run(policy.member_ids(guild)) == {42, 43}
+    assert guild.get_member(42) is None
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import threading
+
+from migrations import LATEST_VERSION, _v1_base_tables, import_legacy_verification_db, migrate, schema_version
+
+
+def _v1_database(path):
+    conn = sqlite3.connect(path)
+    _v1_base_tables(conn)
+    conn.execute('PRAGMA user_version = 1')
+    conn.executemany('INSERT INTO users VALUES (?, ?, ?, ?, ?)', [
+        ('123456789012345678', 'tok1', 'Bearer', 'identify', 2000000000),
+        ('None', 'tok2', 'Bearer', 'identify', 2000000000),
+        ('12ab', 'tok3', 'Bearer', 'identify', 2000000000),
+    ])
+    conn.executemany('INSERT INTO guild_config VALUES (?, ?, ?, ?)', [
+        ('111', '222', 'None', None),
+        ('None', '1', '2', '3'),
+    ])
+    conn.commit()
+    return conn
+
+
+def test_v2_converts_text_snowflakes_and_drops_none_rows(tmp_path):
+    conn = _v1_database(str(tmp_path / 'tokens.db'))
+    migrate(conn)
+    assert schema_version(conn) == LATEST_VERSION
+    assert conn.execute('SELECT user_id, typeof(user_id) FROM users').fetchall() == [(123456789012345678, 'integer')]
+    assert conn.execute('SELECT * FROM guild_config').fetchall() == [(111, 222, None, None)]
+    conn.close()
+
+
+def _legacy_database(path):
+    legacy = sqlite3.connect(path)
+    # the on_ready variant without verified_at
+    legacy.execute('CREATE TABLE verified (discord_id TEXT PRIMARY KEY)')
+    legacy.executemany('INSERT INTO verified VALUES (?)', [('42',), ('None',), ('43',)])
+    legacy.execute('CREATE TABLE oauth_links (discord_id TEXT PRIMARY KEY, username TEXT)')
+    legacy.executemany('INSERT INTO oauth_links VALUES (?, ?)', [('42', 'alice'), ('None', 'ghost')])
+    legacy.commit()
+    legacy.close()
+
+
+def _migrated(path):
+    conn = sqlite3.connect(path, timeout=30)
+    migrate(conn)
+    return conn
+
+
+def test_legacy_import_runs_once(tmp_path):
+    db, legacy = str(tmp_path / 'tokens.db'), str(tmp_path / 'linked_users.db')
+    _legacy_database(legacy)
+    conn = _migrated(db)
+    assert import_legacy_verification_db(conn, legacy, 7)
+    assert sorted(conn.execute('SELECT guild_id, discord_id FROM verified')) == [(7, 42), (7, 43)]
+    assert conn.execute('SELECT discord_id, username FROM oauth_links').fetchall() == [(42, 'alice')]
+    assert not os.path.exists(legacy) and os.path.exists(legacy + '.imported')
+    assert not import_legacy_verification_db(conn, legacy, 7)
+    conn.close()
+
+
+def test_concurrent_legacy_imports_do_not_fail(tmp_path):
+    db, legacy = str(tmp_path / 'tokens.db'), str(tmp_path / 'linked_users.db')
+    _legacy_database(legacy)
+    _migrated(db).close()
+    barrier = threading.Barrier(4)
+    results, errors = [], []
+
+    def start():
+        conn = sqlite3.connect(db, timeout=30)
+        try:
+            barrier.wait()
+            results.append(import_legacy_verification_db(conn, legacy, 7))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=start) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert sorted(results) == [False, False, False, True]
@@ -0,0 +1,28 @@
+from notifier import WebhookNotifier
+
+
+def _notifier(max_buffer):
+    notifier = WebhookNotifier(None, max_buffer=max_buffer)
+    # no url means no sender thread; feed the buffer directly
+    notifier.notify = lambda kind, text: notifier._events.append((0, kind, text))
+    return notifier
+
+
+def test_payload_takes_what_it_renders():
+    notifier = _notifier(max_buffer=10)
+    for i in range(3):
+        notifier.notify('verified', f'user {i}')
+    payload, count = notifier._build_payload()
+    assert count == 3
+    assert payload['embeds'][0]['description'].count('user') == 3
+    assert not notifier._events
+
+
+def test_oversized_batches_leave_the_rest_buffered():
+    notifier = _notifier(max_buffer=1000)
+    for i in range(200):
+        notifier.notify('verified', f'user {i} ' + 'x' * 100)
+    payload, count = notifier._build_payload()
+    assert 0 < count < 200
+    assert len(notifier._events) == 200 - count
+    assert notifier._events[0][2].startswith(f'user {count} ')
@@ -0,0 +1,45 @@
+import asyncio
+
+from progress import ProgressBoard, ProgressReporter
+
+
+class FakeMessage:
+    def __init__(self):
+        self.content = 'Starting to add authorized users to this server...'
+        self.edits = 0
+
+    async def edit(self, content):
+        self.content = content
+        self.edits += 1
+
+
+def test_job_that_fails_before_tracking_still_closes_its_messages():
+    async def run():
+        board = ProgressBoard()
+        message = FakeMessage()
+        board.attach(7, ProgressReporter(message, min_interval=0))
+        await board.finish(7, 'The job failed.', 'join_all job #7 for guild 1')
+        return board, message
+
+    board, message = asyncio.run(run())
+    assert message.content.startswith('**join_all job #7 for guild 1**')
+    assert 'The job failed.' in message.content
+    assert not board.watched(7)
+
+
+def test_updates_are_throttled_to_one_trailing_edit():
+    async def run():
+        board = ProgressBoard()
+        message = FakeMessage()
+        board.track(1, 'job')
+        board.attach(1, ProgressReporter(message, min_interval=0.2))
+        for done in range(1, 1001):
+            board.publish(1, done, 1000, {'added': done})
+            if done % 100 == 0:
+                await asyncio.sleep(0.01)
+        await asyncio.sleep(0.25)
+        return message
+
+    message = asyncio.run(run())
+    assert message.edits == 2
+    assert '1,000 of 1,000 done' in message.content
@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+
+from reconcile import Reconciler
+
+MEMBER_ROLE = SimpleNamespace(id=5, name='member', members=[])
+
+
+class FakeMember:
+    def __init__(self, user_id, roles=()):
+        self.id = user_id
+        self.bot = False
+        self.roles = list(roles)
+        self.added = []
+
+    async def add_roles(self, role, reason=None):
+        self.added.append(role)
+        self.roles.append(role)
+
+
+class LazyCache:
+    """A `lazy` member cache: IDs are known, members are fetched one at a time."""
+
+    mode = 'lazy'
+
+    def __init__(self, members):
+        self.members = {m.id: m for m in members}
+        self.fetched = []
+
+    async def member_ids(self, guild):
+        return set(self.members)
+
+    async def get_member(self, guild, user_id):
+        self.fetched.append(user_id)
+        return self.members.get(user_id)
+
+
+def test_lazy_guild_does_not_readd_roles_of_uncached_holders():
+    holder = FakeMember(1, roles=[MEMBER_ROLE])
+    missing = FakeMember(2)
+    cache = LazyCache([holder, missing, FakeMember(3)])
+    # only part of the guild is cached, and the role's member list shows none of it
+    guild = SimpleNamespace(id=10, chunked=False, me=None)
+    reconciler = Reconciler(cache, lambda g: {1, 2}, lambda g: (MEMBER_ROLE, None))
+
+    report = asyncio.run(reconciler.run(guild))
+
+    assert report.missing_role == [2]
+    assert report.fixed == 1
+    assert holder.added == [] and missing.added == [MEMBER_ROLE]
+    assert 'unverified holders not detected' in report.note
+
+
+def test_chunked_guild_reads_holders_from_the_cache():
+    verified, unverified = FakeMember(1, roles=[MEMBER_ROLE]), FakeMember(3, roles=[MEMBER_ROLE])
+    role = SimpleNamespace(id=5, name='member', members=[verified, unverified])
+    cache = LazyCache([verified, FakeMember(2), unverified])
+    cache.mode = 'full'
+    guild = SimpleNamespace(id=10, chunked=True, me=None)
+    reconciler = Reconciler(cache, lambda g: {1, 2}, lambda g: (role, None))
+
+    report = asyncio.run(reconciler.run(guild, apply=False))
+
+    assert report.missing_role == [2]
+    assert report.extra_role == [3]
+    assert cache.fetched == []
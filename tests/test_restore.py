@@ -0,0 +1,73 @@
+import asyncio
+from types import SimpleNamespace
+
+from restore import RestoreEngine, plan_restore
+
+
+class FakeGuild:
+    """Just enough of discord.Guild for plan_restore and RestoreEngine.execute."""
+
+    def __init__(self, categories=()):
+        self.default_role = SimpleNamespace(id=1, name='@everyone', position=0)
+        self.roles = [self.default_role]
+        self.categories = list(categories)
+        self.channels = list(categories)
+        self.me = SimpleNamespace(top_role=SimpleNamespace(position=100))
+        self.created = []
+
+    def get_role(self, role_id):
+        return None
+
+    def get_channel(self, channel_id):
+        return None
+
+    def get_member(self, member_id):
+        return None
+
+    async def create_text_channel(self, name, category=None, **kwargs):
+        if name == 'broken':
+            raise ValueError('unexpected payload')
+        channel = SimpleNamespace(name=name, category=category)
+        self.created.append(channel)
+        return channel
+
+
+def _channel(channel_id, name, kind, parent_id=None, position=0):
+    return {'kind': 'channel', 'id': channel_id, 'name': name, 'type': kind, 'parent_id': parent_id,
+            'position': position, 'permissions': {}}
+
+
+def test_channels_keep_a_category_matched_by_name():
+    live_category = SimpleNamespace(id=999, name='General', type='category')
+    guild = FakeGuild([live_category])
+    records = [_channel(10, 'General', 'category'), _channel(11, 'chat', 'text', parent_id=10),
+               _channel(12, 'broken', 'text', parent_id=10), _channel(13, 'news', 'text', parent_id=10)]
+    plan = plan_restore(guild, 1, records)
+    assert plan.existing == 1 and len(plan.channels) == 3
+
+    results = asyncio.run(RestoreEngine().execute(guild, plan))
+
+    assert [c.name for c in guild.created] == ['chat', 'news']
+    assert all(c.category is live_category for c in guild.created)
+    # a non-HTTP error fails its own record only
+    assert results['created']['channel'] == 2
+    assert [(kind, name) for kind, name, _ in results['failed']] == [('channel', 'broken')]
+
+
+def test_restore_against_fake_discord_api():
+    from bench import FakeDiscordAPI, restore_into_fake, synthetic_backup
+
+    source_guild_id, records = synthetic_backup(roles=6, categories=3, channels_per_category=4)
+    api = FakeDiscordAPI(latency=0.01, bucket_limit=8, window=0.2)
+    api.start()
+    try:
+        plan, results, problems = asyncio.run(
+            restore_into_fake(api, source_guild_id, records, RestoreEngine(concurrency=4)))
+    finally:
+        api.stop()
+    assert problems == []
+    assert results['failed'] == []
+    assert results['created'] == {'role': 6, 'category': 3, 'channel': 12}
+    assert 1 < api.max_in_flight['channel'] <= 4
+    # every create ran once, plus the one role move, however many were rate limited
+    assert len(api.calls) == plan.operations + 1
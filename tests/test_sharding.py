@@ -0,0 +1,25 @@
+from types import SimpleNamespace
+
+from sharding import ShardMetrics, parse_shard_ids, shard_for_guild
+
+
+def test_parse_shard_ids():
+    assert parse_shard_ids('0-3,7') == [0, 1, 2, 3, 7]
+    assert parse_shard_ids(' ') is None
+
+
+def test_snapshot_of_unsharded_bot():
+    guild_id = 81384788765712384
+    bot = SimpleNamespace(shard_id=None, latency=0.0421, is_closed=lambda: False,
+                          guilds=[SimpleNamespace(shard_id=shard_for_guild(guild_id, 1))])
+    assert ShardMetrics().snapshot(bot) == [{'shard_id': 0, 'latency_ms': 42.1, 'closed': False, 'guilds': 1}]
+
+
+def test_event_rate():
+    metrics = ShardMetrics()
+    metrics.sample()
+    for _ in range(100):
+        metrics.record_event()
+    metrics._last = (metrics._last[0] - 10, metrics._last[1])
+    metrics.sample()
+    assert 9.9 < metrics.events_per_sec <= 10.0
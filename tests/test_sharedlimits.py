@@ -0,0 +1,65 @@
+import pytest
+
+from sharedlimits import SharedRateLimiter, route_key
+
+ROUTE = route_key('PUT', 'https://discord.com/api/v10/guilds/123456789/members/987654321')
+
+
+@pytest.fixture
+def limiters(tmp_path):
+    path = str(tmp_path / 'limits.db')
+    # two processes' limiters: separate instances, separate connections, one file
+    return lambda **kw: (SharedRateLimiter(path, **kw), SharedRateLimiter(path, **kw))
+
+
+def _headers(limit, remaining, reset_after, bucket='abc'):
+    return {'X-RateLimit-Bucket': bucket, 'X-RateLimit-Limit': str(limit),
+            'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Reset-After': str(reset_after)}
+
+
+def test_route_key_keeps_major_parameters_only():
+    assert ROUTE == 'PUT /guilds/123456789/members/{id}'
+
+
+def test_global_budget_is_shared_and_refunds_return_to_it(limiters):
+    a, b = limiters(global_rate=1, global_burst=2)
+    assert a.reserve(ROUTE) == 0.0
+    assert b.reserve(ROUTE) == 0.0
+    assert a.reserve(ROUTE) > 0.5
+    b.refund(ROUTE)
+    assert a.reserve(ROUTE) == 0.0
+
+
+def test_bucket_remaining_is_shared(limiters):
+    a, b = limiters(global_rate=1000)
+    a.update(ROUTE, 200, _headers(limit=2, remaining=1, reset_after=30))
+    assert b.bucket(ROUTE)[:2] == ('abc:123456789', 2)
+    assert a.reserve(ROUTE) == 0.0
+    wait = b.reserve(ROUTE)
+    assert 25 < wait <= 30
+    a.refund(ROUTE)
+    assert b.reserve(ROUTE) == 0.0
+
+
+def test_stale_header_does_not_hand_out_reservations_twice(limiters):
+    a, b = limiters(global_rate=1000)
+    a.update(ROUTE, 200, _headers(limit=5, remaining=2, reset_after=30))
+    assert a.reserve(ROUTE) == 0.0
+    assert b.reserve(ROUTE) == 0.0
+    # a response sent before both reservations still says 2 remain
+    a.update(ROUTE, 200, _headers(limit=5, remaining=2, reset_after=30))
+    assert b.reserve(ROUTE) > 0
+
+
+def test_global_429_pauses_every_sender(limiters):
+    a, b = limiters(global_rate=1000)
+    a.update(ROUTE, 429, {'Retry-After': '5', 'X-RateLimit-Global': 'true'})
+    other = route_key('GET', 'https://discord.com/api/v10/users/@me')
+    assert 4 < b.reserve(other) <= 5
+
+
+def test_acquire_gives_up_past_its_timeout(limiters):
+    a, _ = limiters(global_rate=1000)
+    a.update(ROUTE, 200, _headers(limit=1, remaining=0, reset_after=30))
+    with pytest.raises(TimeoutError):
+        a.acquire(ROUTE, timeout=0.1)
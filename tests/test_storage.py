@@ -0,0 +1,94 @@
+import sqlite3
+import time
+
+import pytest
+
+import events
+from migrations import migrate
+from storage import DONE, PENDING, RUNNING, MemoryStorage, SQLiteStorage, Storage
+from writebehind import WriteBehindBuffer
+
+NOW = int(time.time())
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'sqlite-buffered'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        yield MemoryStorage()
+        return
+    path = str(tmp_path / 'tokens.db')
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    migrate(conn)
+    conn.close()
+    if request.param == 'sqlite':
+        yield SQLiteStorage(path)
+        return
+    buffer = WriteBehindBuffer(path, max_delay=0.005)
+    yield SQLiteStorage(path, writer=buffer)
+    buffer.close()
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        Storage()
+
+
+def test_tokens(store):
+    assert store.get_token(1) is None
+    store.save_token(1, 'a', 'Bearer', 'identify guilds.join', NOW + 3600, validated_at=NOW)
+    store.save_token('2', 'b', 'Bearer', 'identify', NOW - 1)
+    assert store.get_token('1') == ('a', 'Bearer', 'identify guilds.join', NOW + 3600)
+    assert sorted(store.all_users()) == [(1, 'a'), (2, 'b')]
+    assert store.live_users(NOW) == [(1, 'a')]
+    assert store.count_live_tokens(NOW) == 1
+    store.save_token(1, 'c', 'Bearer', 'identify', NOW + 60)
+    assert store.get_token(1)[0] == 'c'
+    store.delete_token(2)
+    assert store.get_token(2) is None and store.all_users() == [(1, 'c')]
+
+
+def test_verified(store):
+    store.save_token(1, 'a', 'Bearer', 'identify', NOW + 60)
+    assert store.verified_ids(5) == set()
+    assert store.verified_ids(5, include_oauth_users=True) == {1}
+    store.add_verified('5', 7)
+    store.add_verified(5, 7)
+    assert store.verified_ids(5) == {7} and store.verified_ids(6) == set()
+
+
+def test_guild_config(store):
+    assert store.get_guild_config(5) == (None, None, None)
+    store.save_guild_config('5', '10', 11, 'not-an-id')
+    assert store.get_guild_config(5) == (10, 11, None)
+    store.save_guild_config(5, rules_role_id=12)
+    assert store.get_guild_config(5) == (None, None, 12)
+
+
+def test_jobs(store):
+    first = store.create_job('join_all', 5, {'users': 3})
+    second = store.create_job('restore', None)
+    assert first != second
+    job = store.get_job(first)
+    assert job['status'] == PENDING and job['payload'] == {'users': 3} and job['progress'] == {}
+    assert job['guild_id'] == 5
+    store.update_job(first, status=RUNNING, progress={'done': 1})
+    assert store.get_job(first)['progress'] == {'done': 1}
+    assert [j['id'] for j in store.list_jobs(status=RUNNING)] == [first]
+    assert [j['id'] for j in store.list_jobs(kind='restore')] == [second]
+    assert [j['id'] for j in store.list_jobs()] == [first, second]
+    store.update_job(first, status=DONE)
+    assert store.get_job(first)['progress'] == {'done': 1} and store.get_job(first)['status'] == DONE
+    assert store.get_job(10 ** 9) is None
+
+
+def test_events(store):
+    store.record_event(events.VERIFIED, 5, 1, ts=NOW)
+    store.record_event(events.VERIFIED, 5, 2, {'via': 'button'}, ts=NOW - 2 * events.DAY)
+    store.record_event(events.CALLBACK, ts=NOW)
+    store.flush()
+    stats = store.event_stats(5, NOW)
+    assert stats['today'].get(events.VERIFIED) == 1 and stats['last_7d'].get(events.VERIFIED) == 2
+    assert events.CALLBACK not in stats['today']
+    totals = store.event_stats(0, NOW)
+    assert totals['last_24h'].get(events.CALLBACK) == 1 and totals['last_7d'].get(events.VERIFIED) == 2
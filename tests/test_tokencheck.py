@@ -0,0 +1,42 @@
+import sqlite3
+import time
+
+from migrations import migrate
+from tokencheck import validate_tokens
+
+
+class Response:
+    def __init__(self, status):
+        self.status_code = status
+
+
+class ReauthorizingSession:
+    """Says every token is revoked, and meanwhile user 1 re-authorizes with a new token."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, url, headers=None, timeout=None):
+        conn = sqlite3.connect(self.path)
+        conn.execute("UPDATE users SET access_token = 'fresh', valid = NULL, validated_at = NULL WHERE user_id = 1")
+        conn.commit()
+        conn.close()
+        return Response(401)
+
+
+def test_result_for_an_old_token_does_not_touch_a_new_one(tmp_path):
+    path = str(tmp_path / 'tokens.db')
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.execute('INSERT INTO users (user_id, access_token, token_type, scope, expires_at) VALUES (?,?,?,?,?)',
+                 (1, 'old', 'Bearer', 'identify guilds.join', int(time.time()) + 3600))
+    conn.commit()
+    conn.close()
+
+    stats = validate_tokens(lambda: sqlite3.connect(path), ReauthorizingSession(path), 'http://api', rate=1000,
+                            prune=True)
+
+    assert stats['invalid'] == 1
+    conn = sqlite3.connect(path)
+    assert conn.execute('SELECT access_token, valid FROM users WHERE user_id = 1').fetchone() == ('fresh', None)
+    conn.close()
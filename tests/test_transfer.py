@@ -0,0 +1,66 @@
+import sqlite3
+
+from migrations import migrate
+from transfer import export_store, import_store
+
+NOW = 1_700_000_000
+
+
+def _store(path, users=(), configs=()):
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.executemany('INSERT INTO users (user_id, access_token, token_type, scope, expires_at) VALUES (?, ?, ?, ?, ?)',
+                     users)
+    conn.executemany('INSERT INTO guild_config VALUES (?, ?, ?, ?)', configs)
+    conn.commit()
+    conn.close()
+
+
+def _rows(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def _user(user_id, token, expires_at):
+    return (user_id, token, 'Bearer', 'identify guilds.join', expires_at)
+
+
+def test_import_keeps_the_newer_token_of_each_user(tmp_path):
+    source, target, dump = (str(tmp_path / n) for n in ('source.db', 'target.db', 'dump.ndjson.gz'))
+    _store(source, users=[_user(1, 'new-1', NOW + 100), _user(2, 'old-2', NOW + 100), _user(3, 'only-3', NOW + 100)])
+    _store(target, users=[_user(1, 'old-1', NOW + 50), _user(2, 'new-2', NOW + 200)])
+    export_store(source, dump, now=NOW)
+
+    stats = import_store(dump, target)
+
+    assert _rows(target, 'SELECT user_id, access_token FROM users ORDER BY user_id') == [
+        (1, 'new-1'), (2, 'new-2'), (3, 'only-3')]
+    assert stats.rows['users'] == 3 and stats.written['users'] == 2
+
+
+def test_guild_config_fills_gaps_unless_the_import_is_preferred(tmp_path):
+    source, dump = str(tmp_path / 'source.db'), str(tmp_path / 'dump.ndjson.gz')
+    _store(source, configs=[(10, 11, 12, 13), (20, 21, None, None)])
+    export_store(source, dump, now=NOW)
+
+    filled = str(tmp_path / 'filled.db')
+    _store(filled, configs=[(10, 99, None, None)])
+    import_store(dump, filled)
+    assert _rows(filled, 'SELECT * FROM guild_config ORDER BY guild_id') == [(10, 99, 12, 13), (20, 21, None, None)]
+
+    replaced = str(tmp_path / 'replaced.db')
+    _store(replaced, configs=[(10, 99, None, 98)])
+    import_store(dump, replaced, prefer_import_config=True)
+    assert _rows(replaced, 'SELECT * FROM guild_config ORDER BY guild_id') == [(10, 11, 12, 13), (20, 21, None, None)]
+
+
+def test_live_only_export_skips_expired_tokens(tmp_path):
+    source, target, dump = (str(tmp_path / n) for n in ('source.db', 'target.db', 'dump.ndjson.gz'))
+    _store(source, users=[_user(1, 'live', NOW + 10), _user(2, 'expired', NOW - 10)])
+    stats = export_store(source, dump, live_only=True, now=NOW)
+    assert stats.rows == {'users': 1}
+    import_store(dump, target)
+    assert _rows(target, 'SELECT user_id FROM users') == [(1,)]
@@ -0,0 +1,32 @@
+import sqlite3
+
+from migrations import migrate
+from workqueue import WorkQueue
+
+
+def _queue(tmp_path):
+    path = str(tmp_path / 'q.db')
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.close()
+    return WorkQueue(path, visibility=60)
+
+
+def test_claim_visibility_covers_the_batch(tmp_path):
+    queue = _queue(tmp_path)
+    for i in range(3):
+        queue.put('audit', {'n': i})
+    items = queue.claim(10, now=1e10, visibility=600)
+    assert [payload['n'] for _, _, payload, _ in items] == [0, 1, 2]
+    # past the queue's default visibility, but inside the batch's
+    assert queue.claim(10, now=1e10 + 120) == []
+    assert len(queue.claim(10, now=1e10 + 601)) == 3
+
+
+def test_retry_drops_after_max_attempts(tmp_path):
+    queue = _queue(tmp_path)
+    queue.put('audit', {})
+    (item_id, _, _, attempt), = queue.claim()
+    assert queue.retry(item_id, attempt, 0)
+    assert not queue.retry(item_id, queue.max_attempts, 0)
+    assert queue.depth() == 0
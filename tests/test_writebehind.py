@@ -0,0 +1,66 @@
+import sqlite3
+import threading
+
+import pytest
+
+from writebehind import WriteBehindBuffer
+
+
+@pytest.fixture
+def buffer(tmp_path):
+    path = str(tmp_path / 'tokens.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE t (k INTEGER PRIMARY KEY, v TEXT)')
+    conn.commit()
+    conn.close()
+    buf = WriteBehindBuffer(path, max_batch=1000, max_delay=0.2)
+    yield buf, path
+    buf.close()
+
+
+def _count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM t').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_concurrent_writes_are_group_committed(buffer):
+    buf, path = buffer
+    futures = []
+
+    def writer(start):
+        futures.extend(buf.submit('INSERT INTO t VALUES (?, ?)', (k, 'x')) for k in range(start, start + 50))
+
+    threads = [threading.Thread(target=writer, args=(i * 50,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for fut in futures:
+        fut.result(5)
+    assert _count(path) == 200
+    assert buf.stats()['batches'] < 20
+
+
+def test_a_failing_statement_does_not_sink_its_batch(buffer):
+    buf, path = buffer
+    ok = buf.submit('INSERT INTO t VALUES (1, ?)', ('a',))
+    duplicate = buf.submit('INSERT INTO t VALUES (1, ?)', ('b',))
+    other = buf.submit('INSERT INTO t VALUES (2, ?)', ('c',))
+    ok.result(5)
+    other.result(5)
+    with pytest.raises(sqlite3.IntegrityError):
+        duplicate.result(5)
+    assert _count(path) == 2
+
+
+def test_close_commits_everything_already_submitted(buffer):
+    buf, path = buffer
+    futures = [buf.submit('INSERT INTO t VALUES (?, ?)', (k, 'x')) for k in range(100)]
+    buf.close()
+    assert all(fut.done() and fut.exception() is None for fut in futures)
+    assert _count(path) == 100
+    with pytest.raises(RuntimeError):
+        buf.submit('INSERT INTO t VALUES (999, ?)', ('late',))
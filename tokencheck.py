@@ -0,0 +1,83 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger('oauth-verify')
+
+VALID, INVALID, UNKNOWN = 1, 0, None
+
+
+def _check_token(session, api_base, bucket, access_token, attempts=3):
+    """Classify one OAuth token with GET /users/@me, the cheapest call a bearer token can make."""
+    for _ in range(attempts):
+        bucket.acquire()
+        try:
+            resp = session.get(f'{api_base}/users/@me', headers={'Authorization': f'Bearer {access_token}'}, timeout=10)
+        except Exception as e:
+            logger.debug('Token validation request failed: %s', e)
+            return UNKNOWN
+        if resp.status_code == 200:
+            return VALID
+        if resp.status_code in (401, 403):
+            return INVALID
+        if resp.status_code == 429:
+            try:
+                retry_after = float(resp.json().get('retry_after', 1.0))
+            except Exception:
+                retry_after = 1.0
+            time.sleep(min(retry_after, 30.0))
+            continue
+        return UNKNOWN
+    return UNKNOWN
+
+
+def validate_tokens(connect, session, api_base, ttl=86400, rate=20.0, concurrency=8, batch_size=500, prune=False):
+    """Validate stored tokens whose cached result is missing or older than `ttl` seconds.
+
+    Requests go through their own token bucket (`rate` per second), separate from
+    the bot's member-add budget. Results are written back in batches. Expired rows
+    are found through the expires_at index and deleted, together with invalid rows
+    when `prune` is set. Freed pages are reused by later inserts; the file is not
+    compacted here, since VACUUM would hold the write lock on the live database.
+    Returns a dict of counts.
+    """
+    now = int(time.time())
+    bucket = TokenBucket(rate, capacity=max(1.0, rate))
+    stats = {'checked': 0, 'valid': 0, 'invalid': 0, 'unknown': 0, 'expired_removed': 0, 'invalid_removed': 0}
+
+    conn = connect()
+    try:
+        rows = conn.execute(
+            'SELECT user_id, access_token FROM users WHERE expires_at > ? AND (validated_at IS NULL OR validated_at < ?)',
+            (now, now - ttl)).fetchall()
+        logger.info('Token validation: %d tokens due (ttl %ss, %.1f req/s)', len(rows), ttl, rate)
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            for start in range(0, len(rows), batch_size):
+                chunk = rows[start:start + batch_size]
+                results = list(pool.map(lambda row: _check_token(session, api_base, bucket, row[1]), chunk))
+                updates = []
+                for (user_id, token), result in zip(chunk, results):
+                    stats['checked'] += 1
+                    if result is UNKNOWN:
+                        stats['unknown'] += 1
+                        continue
+                    stats['valid' if result == VALID else 'invalid'] += 1
+                    updates.append((result, int(time.time()), user_id, token))
+                # a user who re-authorized meanwhile has a new token that this result says nothing about
+                conn.executemany('UPDATE users SET valid = ?, validated_at = ? WHERE user_id = ? AND access_token = ?',
+                                 updates)
+                conn.commit()
+
+        cur = conn.execute('DELETE FROM users WHERE expires_at <= ?', (int(time.time()),))
+        stats['expired_removed'] = cur.rowcount
+        if prune:
+            cur = conn.execute('DELETE FROM users WHERE valid = 0')
+            stats['invalid_removed'] = cur.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info('Token validation finished: %s', stats)
+    return stats
@@ -0,0 +1,217 @@
+"""Stream `users` and `guild_config` between token stores as gzip-compressed NDJSON.
+
+    python transfer.py export tokens.db tokens.ndjson.gz [--live-only] [--scope guilds.join] [--guild ID ...]
+    python transfer.py import tokens.ndjson.gz other/tokens.db [--batch 5000] [--prefer-import-config]
+
+An export is a header line followed by one `{"t": table, ...columns}` line per
+row. Both directions hold one batch of rows at a time, so memory use does not
+grow with the store. Import upserts in batched `executemany` transactions: a
+user row replaces the stored one only when its `expires_at` is newer, and guild
+config rows only fill in missing values unless `--prefer-import-config` is set.
+"""
+import argparse
+import gzip
+import json
+import logging
+import sqlite3
+import time
+
+from migrations import migrate, schema_version
+
+logger = logging.getLogger('oauth-verify')
+
+FORMAT = 'oauth-verify-export'
+FORMAT_VERSION = 1
+
+USER_COLUMNS = ('user_id', 'access_token', 'token_type', 'scope', 'expires_at', 'valid', 'validated_at')
+CONFIG_COLUMNS = ('guild_id', 'verify_channel_id', 'unverified_role_id', 'rules_role_id')
+TABLES = ('users', 'guild_config')
+
+_UPSERT_USER = f'''INSERT INTO users ({', '.join(USER_COLUMNS)}) VALUES ({', '.join('?' * len(USER_COLUMNS))})
+ON CONFLICT (user_id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in USER_COLUMNS[1:])}
+WHERE users.expires_at IS NULL OR excluded.expires_at > users.expires_at'''
+_UPSERT_CONFIG_FILL = f'''INSERT INTO guild_config ({', '.join(CONFIG_COLUMNS)}) VALUES (?, ?, ?, ?)
+ON CONFLICT (guild_id) DO UPDATE SET {', '.join(f'{c} = COALESCE(guild_config.{c}, excluded.{c})' for c in CONFIG_COLUMNS[1:])}
+WHERE {' OR '.join(f'(guild_config.{c} IS NULL AND excluded.{c} IS NOT NULL)' for c in CONFIG_COLUMNS[1:])}'''
+_UPSERT_CONFIG_REPLACE = f'''INSERT INTO guild_config ({', '.join(CONFIG_COLUMNS)}) VALUES (?, ?, ?, ?)
+ON CONFLICT (guild_id) DO UPDATE SET {', '.join(f'{c} = COALESCE(excluded.{c}, guild_config.{c})' for c in CONFIG_COLUMNS[1:])}'''
+
+
+class TransferStats:
+    """Row counts and throughput of one export or import."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows = {}
+        self.written = {}
+
+    def count(self, table, rows, written=None):
+        self.rows[table] = self.rows.get(table, 0) + rows
+        if written is not None:
+            self.written[table] = self.written.get(table, 0) + written
+
+    @property
+    def total(self):
+        return sum(self.rows.values())
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        parts = []
+        for table, rows in self.rows.items():
+            if table in self.written:
+                parts.append(f'{table}: {rows:,} read, {self.written[table]:,} written, '
+                             f'{rows - self.written[table]:,} kept existing')
+            else:
+                parts.append(f'{table}: {rows:,}')
+        rate = self.total / self.elapsed if self.elapsed else 0.0
+        return f"{'; '.join(parts) or 'no rows'} in {self.elapsed:.1f}s ({rate:,.0f} rows/s)"
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def export_store(db_path, out_path, tables=TABLES, live_only=False, scope=None, guild_ids=None,
+                 batch_size=5000, now=None, progress_every=500_000):
+    """Write the selected rows of `db_path` to `out_path` (gzip NDJSON); returns TransferStats.
+
+    `live_only` skips expired tokens, `scope` keeps tokens whose scope contains it,
+    and `guild_ids` limits guild_config rows to those guilds.
+    """
+    stats = TransferStats()
+    now = int(now if now is not None else time.time())
+    conn = _connect(db_path)
+    try:
+        header = {'format': FORMAT, 'version': FORMAT_VERSION, 'schema': schema_version(conn),
+                  'exported_at': now, 'tables': list(tables)}
+        with gzip.open(out_path, 'wt', encoding='utf-8', compresslevel=6) as out:
+            out.write(json.dumps(header, separators=(',', ':')) + '\n')
+            # one read transaction, so the export is a consistent snapshot while the bot keeps writing
+            conn.execute('BEGIN')
+            if 'users' in tables:
+                where, params = [], []
+                if live_only:
+                    where.append('expires_at > ?')
+                    params.append(now)
+                if scope:
+                    where.append("(' ' || scope || ' ') LIKE ?")
+                    params.append(f'% {scope} %')
+                sql = f"SELECT {', '.join(USER_COLUMNS)} FROM users"
+                if where:
+                    sql += ' WHERE ' + ' AND '.join(where)
+                _export_rows(conn.execute(sql + ' ORDER BY user_id', params), 'users', USER_COLUMNS, out,
+                             stats, batch_size, progress_every)
+            if 'guild_config' in tables:
+                sql = f"SELECT {', '.join(CONFIG_COLUMNS)} FROM guild_config"
+                params = []
+                if guild_ids:
+                    sql += f" WHERE guild_id IN ({', '.join('?' * len(guild_ids))})"
+                    params = [int(g) for g in guild_ids]
+                _export_rows(conn.execute(sql + ' ORDER BY guild_id', params), 'guild_config', CONFIG_COLUMNS, out,
+                             stats, batch_size, progress_every)
+            conn.execute('COMMIT')
+    finally:
+        conn.close()
+    return stats
+
+
+def _export_rows(cursor, table, columns, out, stats, batch_size, progress_every):
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    next_report = progress_every
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        out.write(''.join(encode({'t': table, **dict(zip(columns, row))}) + '\n' for row in rows))
+        stats.count(table, len(rows))
+        if stats.total >= next_report:
+            logger.info('Exported %s rows (%.0f rows/s)', f'{stats.total:,}', stats.total / stats.elapsed)
+            next_report += progress_every
+
+
+def import_store(in_path, db_path, batch_size=5000, prefer_import_config=False, progress_every=500_000):
+    """Merge an export into `db_path` (migrated to the current schema first); returns TransferStats."""
+    stats = TransferStats()
+    conn = _connect(db_path)
+    try:
+        migrate(conn)
+        statements = {'users': (_UPSERT_USER, USER_COLUMNS),
+                      'guild_config': (_UPSERT_CONFIG_REPLACE if prefer_import_config else _UPSERT_CONFIG_FILL,
+                                       CONFIG_COLUMNS)}
+        with gzip.open(in_path, 'rt', encoding='utf-8') as src:
+            header = json.loads(src.readline() or '{}')
+            if header.get('format') != FORMAT or header.get('version', 0) > FORMAT_VERSION:
+                raise ValueError(f'{in_path} is not an {FORMAT} file this version can read')
+            batches = {table: [] for table in statements}
+            next_report = progress_every
+            for line_no, line in enumerate(src, 2):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                table = record.get('t')
+                if table not in statements:
+                    raise ValueError(f'{in_path}:{line_no}: unknown table {table!r}')
+                batch = batches[table]
+                batch.append(tuple(record.get(c) for c in statements[table][1]))
+                if len(batch) >= batch_size:
+                    _import_batch(conn, table, statements[table][0], batch, stats)
+                    batch.clear()
+                    if stats.total >= next_report:
+                        logger.info('Imported %s rows (%.0f rows/s)', f'{stats.total:,}', stats.total / stats.elapsed)
+                        next_report += progress_every
+            for table, batch in batches.items():
+                if batch:
+                    _import_batch(conn, table, statements[table][0], batch, stats)
+    finally:
+        conn.close()
+    return stats
+
+
+def _import_batch(conn, table, sql, rows, stats):
+    before = conn.total_changes
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany(sql, rows)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    stats.count(table, len(rows), conn.total_changes - before)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(name)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('export', help='write a store (or a filtered subset) to NDJSON.gz')
+    p.add_argument('db')
+    p.add_argument('out')
+    p.add_argument('--tables', nargs='*', choices=TABLES, default=list(TABLES))
+    p.add_argument('--live-only', action='store_true', help='skip expired tokens')
+    p.add_argument('--scope', help='only tokens granted this scope, e.g. guilds.join')
+    p.add_argument('--guild', nargs='*', dest='guilds', help='only guild_config rows of these guilds')
+
+    p = sub.add_parser('import', help='merge an NDJSON.gz export into a store')
+    p.add_argument('src')
+    p.add_argument('db')
+    p.add_argument('--batch', type=int, default=5000, help='rows per transaction')
+    p.add_argument('--prefer-import-config', action='store_true',
+                   help='imported guild config overrides stored values instead of only filling gaps')
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        stats = export_store(args.db, args.out, tuple(args.tables), args.live_only, args.scope, args.guilds)
+        logger.info('Exported %s', stats.summary())
+    else:
+        stats = import_store(args.src, args.db, args.batch, args.prefer_import_config)
+        logger.info('Imported %s', stats.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger('oauth-verify')
+
+
+class WorkQueue:
+    """Hands work from web worker processes to the bot process through the `work_queue` table.
+
+    `put()` is durable: it returns once the row is committed (through `writer`, a
+    WriteBehindBuffer, when one is attached, so callbacks share group commits).
+    `claim()` hides up to `limit` due items for `visibility` seconds and hands them
+    out; the consumer calls `done()` or `retry()` for each. Items whose consumer
+    died reappear once the visibility timeout passes, so delivery is at least once
+    and handlers must be idempotent. An item is dropped after `max_attempts` claims.
+    """
+
+    def __init__(self, db_path, writer=None, visibility=60.0, max_attempts=5, timeout=30):
+        self.db_path = db_path
+        self.writer = writer
+        self.visibility = visibility
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+
+    def put(self, kind, payload):
+        now = time.time()
+        params = (kind, json.dumps(payload), now, now)
+        sql = 'INSERT INTO work_queue (kind, payload, created_at, available_at, attempts) VALUES (?,?,?,?,0)'
+        if self.writer is not None:
+            self.writer.submit(sql, params).result()
+            return
+        conn = self._connect()
+        try:
+            conn.execute(sql, params)
+        finally:
+            conn.close()
+
+    def claim(self, limit=50, now=None, visibility=None):
+        """`[(item_id, kind, payload, attempt)]` of up to `limit` due items, oldest first.
+
+        The items stay hidden for `visibility` seconds (default: the queue's); a
+        consumer working through them one by one should pass enough for the whole batch.
+        """
+        now = time.time() if now is None else now
+        visibility = self.visibility if visibility is None else visibility
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = conn.execute('SELECT id, kind, payload, attempts FROM work_queue WHERE available_at <= ? '
+                                    'ORDER BY id LIMIT ?', (now, int(limit))).fetchall()
+                conn.executemany('UPDATE work_queue SET available_at = ?, attempts = attempts + 1 WHERE id = ?',
+                                 [(now + visibility, row[0]) for row in rows])
+                conn.execute('COMMIT')
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+        return [(item_id, kind, json.loads(payload), attempts + 1) for item_id, kind, payload, attempts in rows]
+
+    def done(self, item_ids):
+        if not item_ids:
+            return
+        conn = self._connect()
+        try:
+            conn.executemany('DELETE FROM work_queue WHERE id = ?', [(int(i),) for i in item_ids])
+        finally:
+            conn.close()
+
+    def retry(self, item_id, attempt, delay):
+        """Make a claimed item due again in `delay` seconds, or drop it once `attempt` reached `max_attempts`."""
+        conn = self._connect()
+        try:
+            if attempt >= self.max_attempts:
+                conn.execute('DELETE FROM work_queue WHERE id = ?', (int(item_id),))
+                logger.error('Dropping work item %s after %d attempts', item_id, attempt)
+                return False
+            conn.execute('UPDATE work_queue SET available_at = ? WHERE id = ?', (time.time() + delay, int(item_id)))
+            return True
+        finally:
+            conn.close()
+
+    def depth(self):
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM work_queue').fetchone()[0]
+        finally:
+            conn.close()
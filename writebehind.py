@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger('oauth-verify')
+
+_STOP = object()
+
+
+class WriteBehindBuffer:
+    """Group-commits small writes from many callers in one background writer thread.
+
+    Writes are queued with `submit()` and applied in a single transaction once
+    `max_batch` statements are waiting or the oldest has waited `max_delay` seconds.
+    Every write gets a Future that resolves after its batch has committed, so callers
+    that must not acknowledge a user before the row is on disk wait on it; others
+    fire and forget. The writer connection uses `synchronous=FULL`, so one fsync
+    covers the whole batch.
+    """
+
+    def __init__(self, db_path, max_batch=256, max_delay=0.05, max_pending=10000, report_interval=60.0):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.report_interval = report_interval
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._rows = 0
+        self._batches = 0
+        self._commit_seconds = 0.0
+        self._window = (time.monotonic(), 0)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def submit(self, sql, params=()):
+        """Queue one statement; returns a Future resolved (or failed) once its batch commits."""
+        if self._closed:
+            raise RuntimeError('WriteBehindBuffer is closed')
+        fut = Future()
+        # a full queue blocks the caller, which is the backpressure we want during raids
+        self._queue.put((sql, params, fut))
+        return fut
+
+    async def write(self, sql, params=(), durable=True):
+        """Async wrapper for `submit()`; waits for the commit only when `durable`."""
+        if self._queue.full():
+            fut = await asyncio.to_thread(self.submit, sql, params)
+        else:
+            fut = self.submit(sql, params)
+        if durable:
+            await asyncio.wrap_future(fut)
+        return fut
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far has been committed."""
+        self.submit('SELECT 1').result(timeout)
+
+    def close(self, timeout=10.0):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            rows, batches, commit_seconds = self._rows, self._batches, self._commit_seconds
+        return {
+            'rows': rows,
+            'batches': batches,
+            'avg_batch': rows / batches if batches else 0.0,
+            'avg_commit_ms': commit_seconds * 1000 / batches if batches else 0.0,
+        }
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is _STOP:
+                break
+        return batch
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA synchronous=FULL')
+        stopping = False
+        try:
+            while not stopping:
+                try:
+                    first = self._queue.get(timeout=self.report_interval)
+                except queue.Empty:
+                    self._report()
+                    continue
+                if first is _STOP:
+                    break
+                batch = self._collect(first)
+                if batch[-1] is _STOP:
+                    batch.pop()
+                    stopping = True
+                self._commit(conn, batch)
+                self._report()
+        finally:
+            # drain anything submitted before close() so no acknowledged write is lost
+            leftover = []
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    leftover.append(item)
+            if leftover:
+                self._commit(conn, leftover)
+            conn.close()
+
+    def _commit(self, conn, batch):
+        started = time.perf_counter()
+        errors = {}
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for i, (sql, params, fut) in enumerate(batch):
+                try:
+                    conn.execute(sql, params)
+                except sqlite3.Error as e:
+                    # a failed statement is rolled back on its own; the rest of the batch still commits
+                    errors[i] = e
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.exception('Write-behind batch of %d statements failed', len(batch))
+            for _, _, fut in batch:
+                fut.set_exception(e)
+            return
+        elapsed = time.perf_counter() - started
+        for i, (_, _, fut) in enumerate(batch):
+            if i in errors:
+                fut.set_exception(errors[i])
+            else:
+                fut.set_result(None)
+        with self._lock:
+            self._rows += len(batch)
+            self._batches += 1
+            self._commit_seconds += elapsed
+
+    def _report(self):
+        now = time.monotonic()
+        since, rows_then = self._window
+        if now - since < self.report_interval:
+            return
+        with self._lock:
+            rows = self._rows
+        self._window = (now, rows)
+        if rows > rows_then:
+            stats = self.stats()
+            logger.info('Write-behind: %d rows in last %.0fs (%.1f rows/s), avg batch %.1f, avg commit %.1fms',
+                        rows - rows_then, now - since, (rows - rows_then) / (now - since),
+                        stats['avg_batch'], stats['avg_commit_ms'])